@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Serve the k8s agent with a stub Bedrock client and fake kubectl/helm binaries.
+
+Used by load_test.py, which starts it in a subprocess so the server's memory
+can be measured on its own, but it can also be run by hand to try the API
+offline. The Kubernetes API fast path is off by default since there is no
+cluster to talk to; other agent settings are read from the environment as
+usual.
+
+Usage: python benchmarks/agent_server.py [--port 5099] [--bedrock-latency 1.0] [--bedrock-jitter 0.2]
+"""
+
+import os
+import sys
+import argparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+FAKEBIN_DIR = os.path.join(BENCHMARKS_DIR, "fakebin")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--bedrock-latency", type=float, default=1.0, help="seconds per Bedrock call")
+    parser.add_argument("--bedrock-jitter", type=float, default=0.2, help="extra random seconds per Bedrock call")
+    parser.add_argument("--bedrock-first-token", type=float, default=0.3, help="seconds to the first streamed event")
+    args = parser.parse_args()
+
+    # Settings read at import time of the agent's modules
+    os.environ["PATH"] = FAKEBIN_DIR + os.pathsep + os.environ.get("PATH", "")
+    os.environ.setdefault("KUBE_API_FAST_PATH", "false")
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, os.path.join(REPO_DIR, "k8s"))
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+    import k8s_api_agent
+    from stub_bedrock import StubBedrockRuntime
+    from werkzeug.serving import make_server
+
+    k8s_api_agent.bedrock_llm.bedrock_runtime = StubBedrockRuntime(
+        latency=args.bedrock_latency, jitter=args.bedrock_jitter, first_token=args.bedrock_first_token)
+    server = make_server(args.host, args.port, k8s_api_agent.app, threaded=True)
+    print(f"Serving the agent with stub Bedrock on http://{args.host}:{args.port}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Offline load test for /api/sendMessage.
+
+Starts the agent with a stub Bedrock client and fake kubectl/helm binaries
+(see agent_server.py), then runs each scenario with a number of concurrent
+users, each holding conversations of several turns:
+
+- multi_turn: the agent keeps the history; commands are only suggested
+- execute_all: every turn runs the suggested commands and asks for an analysis
+  (two LLM calls and three kubectl commands per turn)
+- past_messages: like execute_all, but the client sends the whole history,
+  including command outputs, as pastMessages on every turn
+
+For each scenario it reports p50/p95/p99 latency, throughput, and the
+server's RSS before and after. Results are saved as JSON; pass an earlier
+file with --compare to print the change.
+
+Usage: python benchmarks/load_test.py [--users 20] [--conversations 2] [--turns 4] [--compare results/old.json]
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+SCENARIOS = ("multi_turn", "execute_all", "past_messages")
+
+QUESTIONS = [
+    "Why is the api service crashing?",
+    "Are any other pods in the namespace unhealthy?",
+    "What do the recent api logs show?",
+    "Is the database reachable from the namespace?",
+    "What should I change to fix it?",
+]
+
+KUBECONFIG = base64.b64encode(b"""apiVersion: v1
+kind: Config
+clusters:
+- cluster: {server: 'https://127.0.0.1:6443', insecure-skip-tls-verify: true}
+  name: bench
+contexts:
+- context: {cluster: bench, namespace: bench, user: bench}
+  name: bench-cluster
+current-context: bench-cluster
+users:
+- name: bench
+  user: {token: bench}
+""").decode()
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def rss_mb(pid):
+    """Resident set size of a process in MiB, or None if it can't be read."""
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return int(subprocess.check_output(["ps", "-o", "rss=", "-p", str(pid)]).strip()) / 1024
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def post(url, body, timeout):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def bedrock_calls(base_url):
+    try:
+        with urllib.request.urlopen(f"{base_url}/api/health", timeout=10) as response:
+            return json.loads(response.read()).get("bedrock", {}).get("calls")
+    except (OSError, ValueError):
+        return None
+
+
+def run_conversation(scenario, url, turns, timeout, latencies, errors):
+    thread_id = None
+    past_messages = []
+    for turn in range(turns):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        body = {"content": question, "platform_context": {"k8s_namespace": "bench"}, "data": {}}
+        if thread_id is None:
+            body["data"]["kubeconfig"] = KUBECONFIG
+        else:
+            body["thread_id"] = thread_id
+        if scenario in ("execute_all", "past_messages"):
+            body["data"]["execute_all"] = True
+        if scenario == "past_messages":
+            body["pastMessages"] = past_messages
+
+        start = time.perf_counter()
+        try:
+            response = post(url, body, timeout)
+        except (OSError, ValueError) as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - start)
+
+        thread_id = response.get("thread_id")
+        if scenario == "past_messages":
+            past_messages = past_messages + [{
+                "userMsg": {"content": question},
+                "agentResponse": {"content": response.get("Content", ""),
+                                  "data": {"executedCmds": response.get("data", {}).get("executedCmds", [])}},
+            }]
+
+
+def run_scenario(scenario, args, base_url, server_pid):
+    url = f"{base_url}/api/sendMessage"
+    latencies, errors = [], []
+    calls_before = bedrock_calls(base_url)
+    rss_before = rss_mb(server_pid)
+
+    def user():
+        for _ in range(args.conversations):
+            run_conversation(scenario, url, args.turns, args.timeout, latencies, errors)
+
+    start = time.perf_counter()
+    users = [threading.Thread(target=user) for _ in range(args.users)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    rss_after = rss_mb(server_pid)
+    calls_after = bedrock_calls(base_url)
+    latencies.sort()
+    result = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+        "rss_mb": {
+            "before": rss_before,
+            "after": rss_after,
+            "growth": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+        },
+        "bedrock_calls": calls_after - calls_before if calls_before is not None and calls_after is not None else None,
+    }
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args):
+    port = free_port()
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, "agent_server.py"), "--port", str(port),
+               "--bedrock-latency", str(args.bedrock_latency), "--bedrock-jitter", str(args.bedrock_jitter)]
+    env = dict(os.environ, FAKE_KUBECTL_LATENCY_SECONDS=str(args.kubectl_latency))
+    log = open(args.server_log, "a")
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"Agent server exited with code {process.returncode}, see {args.server_log}")
+        try:
+            urllib.request.urlopen(f"{base_url}/api/health", timeout=2).read()
+            return process, base_url
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.2)
+    process.kill()
+    sys.exit(f"Agent server did not start, see {args.server_log}")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fmt(value, scale=1.0, digits=3):
+    return "-" if value is None else f"{value * scale:.{digits}f}"
+
+
+def print_results(results):
+    print(f"{'scenario':<14} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'RSS MiB':>8} {'growth':>7}")
+    for name, r in results.items():
+        lat, rss = r["latency_seconds"], r["rss_mb"]
+        print(f"{name:<14} {r['requests']:>8} {r['errors']:>6} {fmt(r['throughput_rps'], digits=2):>7} "
+              f"{fmt(lat['p50']):>7} {fmt(lat['p95']):>7} {fmt(lat['p99']):>7} {fmt(rss['after'], digits=1):>8} "
+              f"{fmt(rss['growth'], digits=1):>7}")
+
+
+def print_comparison(previous, results):
+    print(f"\nCompared with {previous.get('label') or previous.get('commit') or 'previous run'} ({previous.get('timestamp')}):")
+    print(f"{'scenario':<14} {'metric':<14} {'before':>9} {'after':>9} {'change':>8}")
+    for name, r in results.items():
+        old = previous.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        rows = [("throughput_rps", old["throughput_rps"], r["throughput_rps"])]
+        rows += [(f"{p} s", old["latency_seconds"][p], r["latency_seconds"][p]) for p in ("p50", "p95", "p99")]
+        rows.append(("rss growth MiB", old["rss_mb"]["growth"], r["rss_mb"]["growth"]))
+        for metric, before, after in rows:
+            change = f"{(after - before) / before * 100:+.1f}%" if before and after is not None else "-"
+            print(f"{name:<14} {metric:<14} {fmt(before):>9} {fmt(after):>9} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--users", type=int, default=20, help="concurrent users")
+    parser.add_argument("--conversations", type=int, default=2, help="conversations per user")
+    parser.add_argument("--turns", type=int, default=4, help="requests per conversation")
+    parser.add_argument("--bedrock-latency", type=float, default=1.0, help="seconds per stub Bedrock call")
+    parser.add_argument("--bedrock-jitter", type=float, default=0.2, help="extra random seconds per stub Bedrock call")
+    parser.add_argument("--kubectl-latency", type=float, default=0.05, help="seconds per fake kubectl call")
+    parser.add_argument("--timeout", type=float, default=300, help="per-request timeout in seconds")
+    parser.add_argument("--url", help="drive an already running agent instead of starting one (RSS needs --pid)")
+    parser.add_argument("--pid", type=int, help="process ID of the agent given with --url")
+    parser.add_argument("--label", help="name stored with the results, e.g. a branch")
+    parser.add_argument("--output", help="results file (default: results/<UTC time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--server-log", default=os.devnull, help="where the started agent's output goes")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    process = None
+    if args.url:
+        base_url, server_pid = args.url.rstrip("/"), args.pid
+    else:
+        process, base_url = start_server(args)
+        server_pid = process.pid
+
+    try:
+        # Warm up imports, connections and the first thread before measuring
+        post(f"{base_url}/api/sendMessage", {"content": "hello", "data": {"kubeconfig": KUBECONFIG}}, args.timeout)
+        results = {}
+        for scenario in scenarios:
+            print(f"Running {scenario}...", file=sys.stderr)
+            results[scenario] = run_scenario(scenario, args, base_url, server_pid)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    timestamp = datetime.now(timezone.utc)
+    report = {
+        "timestamp": timestamp.isoformat(timespec="seconds"),
+        "label": args.label,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {key: getattr(args, key) for key in ("users", "conversations", "turns", "bedrock_latency",
+                                                       "bedrock_jitter", "kubectl_latency")},
+        "scenarios": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, timestamp.strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_results(results)
+    print(f"\nSaved results to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
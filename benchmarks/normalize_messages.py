@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for BedrockLLM.normalize_message_roles.
+
+Compares the current single-pass normalizer with the previous recursive
+implementation on conversation histories of increasing length. Histories are
+shaped like real threads: a user question, a run of consecutive user messages
+carrying command outputs, then an assistant reply.
+
+Usage: python benchmarks/normalize_messages.py [--sizes 500,1000,2000] [--run-length 8]
+"""
+
+import os
+import sys
+import copy
+import timeit
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.llm import BedrockLLM
+
+
+def legacy_normalize_message_roles(messages):
+    """The recursive normalizer this benchmark compares against."""
+    if not messages:
+        return messages
+    if len(messages) == 1:
+        return messages.copy()
+    merged = []
+    i = 0
+    while i < len(messages):
+        current = messages[i].copy()
+        merged.append(current)
+        j = i + 1
+        while j < len(messages) and messages[j].get("role") == current.get("role"):
+            prev_content = current.get("content", "")
+            curr_content = messages[j].get("content", "")
+            if isinstance(prev_content, list) and isinstance(curr_content, list):
+                current["content"] = prev_content + curr_content
+            elif isinstance(prev_content, list):
+                current["content"] = prev_content + [curr_content]
+            elif isinstance(curr_content, list):
+                current["content"] = [prev_content] + curr_content
+            else:
+                current["content"] = f"{prev_content}\n{curr_content}"
+            j += 1
+        i = j
+    if len(merged) < len(messages):
+        return legacy_normalize_message_roles(merged)
+    return merged
+
+
+def build_history(size, run_length, output_chars=2000):
+    """A history of `size` messages with runs of `run_length` consecutive user messages."""
+    output = ("NAME    READY   STATUS    RESTARTS   AGE\n" * (output_chars // 40))[:output_chars]
+    messages = []
+    while len(messages) < size:
+        messages.append({"role": "user", "content": "Why is my pod crashing?"})
+        for k in range(run_length - 1):
+            messages.append({"role": "user", "content": f"I ran this kubectl command: kubectl get pods -n ns{k}\n\nThe output was:\n{output}"})
+        messages.append({"role": "assistant", "content": "The pod is in CrashLoopBackOff because ..."})
+    return messages[:size]
+
+
+def bench(fn, messages, number):
+    return min(timeit.repeat(lambda: fn(messages), number=number, repeat=5)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="500,1000,2000,5000")
+    parser.add_argument("--run-length", type=int, default=8, help="consecutive same-role messages per turn")
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    # normalize_message_roles doesn't use the Bedrock client, so skip creating one
+    llm = BedrockLLM.__new__(BedrockLLM)
+
+    print(f"{'messages':>8}  {'legacy ms':>10}  {'current ms':>10}  {'speedup':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        messages = build_history(size, args.run_length)
+        snapshot = copy.deepcopy(messages)
+        assert llm.normalize_message_roles(messages) == legacy_normalize_message_roles(messages)
+        assert messages == snapshot, "normalize_message_roles modified its input"
+
+        legacy = bench(legacy_normalize_message_roles, messages, args.number)
+        current = bench(llm.normalize_message_roles, messages, args.number)
+        print(f"{size:>8}  {legacy * 1000:>10.3f}  {current * 1000:>10.3f}  {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Stand-in for the boto3 `bedrock-runtime` client used by the benchmarks.
+
+It answers `invoke_model` and `invoke_model_with_response_stream` with canned
+`return_final_response` tool calls after a configurable latency, so the agent
+can be driven without AWS credentials. A turn that asks for an analysis of
+command outputs gets a longer answer and a single follow-up command; any other
+turn gets a short answer that suggests a few read-only commands. Token counts
+are estimated from the request and response sizes (about 4 characters per
+token).
+"""
+
+import io
+import json
+import time
+import random
+import threading
+from typing import Any, Dict, List, Optional
+
+SUGGEST_RESPONSE = {
+    "content": "Let's look at the pods in the namespace, the failing pod and its recent logs.",
+    "kubectl_cmds": [
+        "kubectl get pods -n bench -o wide",
+        "kubectl describe pod api-7d9f8b6c5d-x2k4p -n bench",
+        "kubectl logs api-7d9f8b6c5d-x2k4p -n bench --tail=500",
+    ],
+}
+
+ANALYSIS_RESPONSE = {
+    "content": (
+        "The `api` pod is in CrashLoopBackOff: the container exits with code 1 about 20 seconds after "
+        "starting, right after it fails to connect to the database at `postgres.bench.svc:5432`. "
+        "The other pods are healthy. Check that the `postgres` service has ready endpoints and that the "
+        "`DATABASE_URL` secret points at it; once the database is reachable the pod will start normally.\n"
+    ) * 3,
+    "kubectl_cmds": ["kubectl get endpoints postgres -n bench"],
+}
+
+ANALYSIS_PROMPT_PREFIX = "Based on these command outputs"
+
+# Characters of the tool input sent per streamed delta
+STREAM_CHUNK_CHARS = 24
+
+
+class _Body(io.BytesIO):
+    """StreamingBody stand-in: invoke_model callers only read() it."""
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "\n".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return str(content)
+
+
+class StubBedrockRuntime:
+    """Canned tool-use responses after `latency` seconds (plus up to `jitter` seconds)."""
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.2, first_token: float = 0.3, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.first_token = first_token
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def _respond(self, body: str):
+        request = json.loads(body)
+        messages = request.get("messages", [])
+        last = _message_text(messages[-1]) if messages else ""
+        payload = ANALYSIS_RESPONSE if ANALYSIS_PROMPT_PREFIX in last else SUGGEST_RESPONSE
+        usage = {"input_tokens": len(body) // 4, "output_tokens": len(json.dumps(payload)) // 4}
+        return payload, usage
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        payload, usage = self._respond(body)
+        time.sleep(self._delay())
+        response = {
+            "role": "assistant",
+            "content": [{"type": "tool_use", "id": "toolu_bench", "name": "return_final_response", "input": payload}],
+            "stop_reason": "tool_use",
+            "usage": usage,
+        }
+        return {"body": _Body(json.dumps(response).encode("utf-8"))}
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        payload, usage = self._respond(body)
+        return {"body": self._stream(payload, usage, self._delay())}
+
+    def _stream(self, payload: Dict[str, Any], usage: Dict[str, int], delay: float):
+        raw = json.dumps(payload)
+        chunks = [raw[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(raw), STREAM_CHUNK_CHARS)]
+        first_token = min(self.first_token, delay)
+        per_chunk = (delay - first_token) / max(1, len(chunks))
+
+        events: List[Dict[str, Any]] = [
+            {"type": "message_start", "message": {"role": "assistant", "usage": {"input_tokens": usage["input_tokens"], "output_tokens": 1}}},
+            {"type": "content_block_start", "index": 0,
+             "content_block": {"type": "tool_use", "id": "toolu_bench", "name": "return_final_response", "input": {}}},
+        ]
+        time.sleep(first_token)
+        for event in events:
+            yield {"chunk": {"bytes": json.dumps(event).encode("utf-8")}}
+        for chunk in chunks:
+            time.sleep(per_chunk)
+            event = {"type": "content_block_delta", "index": 0, "delta": {"type": "input_json_delta", "partial_json": chunk}}
+            yield {"chunk": {"bytes": json.dumps(event).encode("utf-8")}}
+        for event in (
+            {"type": "content_block_stop", "index": 0},
+            {"type": "message_delta", "delta": {"stop_reason": "tool_use"}, "usage": {"output_tokens": usage["output_tokens"]}},
+            {"type": "message_stop"},
+        ):
+            yield {"chunk": {"bytes": json.dumps(event).encode("utf-8")}}
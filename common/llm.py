@@ -2,11 +2,24 @@ import json
 import boto3
 import time
 import logging
-from typing import Dict, Any, Optional
+import threading
+from botocore.config import Config
+from typing import Dict, Any, Iterator, Optional
 import os
 
+from common.rate_governor import RateGovernor
+from common.response_cache import RESPONSE_CACHE_ENABLED, ResponseCache, request_key
+from common import metrics
+
 logger = logging.getLogger(__name__)
 
+MODEL_SECONDS = metrics.histogram("k8sagent_bedrock_model_seconds", "Bedrock call latency, excluding time queued for a slot", ["model"])
+QUEUE_WAIT_SECONDS = metrics.histogram("k8sagent_bedrock_queue_wait_seconds", "Time Bedrock calls waited for a concurrency slot", ["model"])
+TOKENS = metrics.counter("k8sagent_llm_tokens_total", "Tokens used by Bedrock calls", ["model", "type"])
+
+# Token counts of Bedrock's usage block reported by last_usage()
+USAGE_TOKEN_KEYS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
 logging.basicConfig(
     level=os.getenv("LOG_LEVEL", "INFO"),
     format="%(asctime)s | %(name)s | %(message)s",
@@ -28,6 +41,16 @@ class BedrockLLM:
             region_name: AWS region name (optional, uses 'us-east-1' by default)
         """
 
+        # Per-thread record of the last call's token usage, see last_usage()
+        self._local = threading.local()
+
+        # Concurrency limit, retries and circuit breaker for every call, see stats()
+        self.governor = RateGovernor()
+        # Responses reused for identical temperature-0 requests (BEDROCK_RESPONSE_CACHE)
+        self.response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+        # Retries are left to the governor, so botocore must not retry on its own
+        client_config = Config(retries={"mode": "standard", "max_attempts": 1})
+
         app_env = os.getenv("APP_ENV", "duplo")
         logger.info(f"Initializing Bedrock client for APP_ENV: {app_env}")
         if app_env == "local":
@@ -37,9 +60,10 @@ class BedrockLLM:
                 aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
                 aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
                 aws_session_token=os.getenv("AWS_SESSION_TOKEN"),
+                config=client_config,
                 )
         else:
-            self.bedrock_runtime = boto3.client('bedrock-runtime', region_name=region_name)
+            self.bedrock_runtime = boto3.client('bedrock-runtime', region_name=region_name, config=client_config)
     
     def invoke(
         self,
@@ -54,8 +78,11 @@ class BedrockLLM:
         system_prompt: Optional[str] = None,
         tools: Optional[list] = None,
         additional_params: Optional[Dict[str, Any]] = None,
-        tool_choice: Optional[dict] = None
-    ) -> str:
+        tool_choice: Optional[dict] = None,
+        prompt_caching: bool = False,
+        use_cache: bool = True,
+        return_usage: bool = False
+    ) -> Any:
         """
         Invoke an AWS Bedrock LLM with the given prompt and parameters.
         
@@ -69,11 +96,190 @@ class BedrockLLM:
             stop_sequences: List of strings that will stop generation when encountered
             latency: handled at API call level via performanceConfigLatency header.
             additional_params: Any additional model-specific parameters
+            prompt_caching: Add prompt cache breakpoints after the system prompt, the
+                tools and the stable prefix of the conversation
+            use_cache: Reuse the response of an identical earlier request, when the
+                response cache is enabled and temperature is 0 (see last_cache_hit)
+            return_usage: Return a (response, usage) tuple, usage being what
+                `last_usage` returns for this call
             
         Returns:
             The text response from the LLM
         """
 
+        request_body = self._build_request_body(
+            messages, model_id, max_tokens, temperature, top_p, top_k, stop_sequences,
+            system_prompt, tools, additional_params, tool_choice, prompt_caching
+        )
+
+        cache_key = self._cache_key(model_id, request_body, temperature, use_cache)
+        cached = self._cached_response(model_id, cache_key)
+        if cached is not None:
+            result = self._extract_response(cached, model_id, tool_choice)
+            return (result, self.last_usage()) if return_usage else result
+
+        logger.info(
+            "Invoking model %s (latency=%s)",
+            model_id,
+            latency,
+        )
+        start_time = time.perf_counter()
+        body = json.dumps(request_body)
+
+        def call():
+            # Invoke the model
+            #TODO: Update to use the converse bedrock API, so it's easier to switch models.
+            response = self.bedrock_runtime.invoke_model(
+                modelId=model_id,
+                body=body,
+                contentType="application/json",
+                accept="application/json",
+                performanceConfigLatency=latency,
+            )
+            return json.loads(response['body'].read().decode('utf-8'))
+
+        # Parse and return the response
+        response_body = self.governor.call(call)
+
+        elapsed = time.perf_counter() - start_time
+        self._log_latency("Model %s call completed in %.2f seconds (queued %.2f seconds)", model_id, elapsed)
+        self._record_usage(model_id, response_body, elapsed)
+        self._store_response(cache_key, response_body)
+        result = self._extract_response(response_body, model_id, tool_choice)
+        return (result, self.last_usage()) if return_usage else result
+
+    def invoke_stream(
+        self,
+        messages: list,
+        model_id: str,
+        max_tokens: int = 1000,
+        temperature: float = 0.0,
+        top_p: float = 0.9,
+        top_k: Optional[int] = None,
+        stop_sequences: Optional[list] = None,
+        latency: str = "standard",
+        system_prompt: Optional[str] = None,
+        tools: Optional[list] = None,
+        additional_params: Optional[Dict[str, Any]] = None,
+        tool_choice: Optional[dict] = None,
+        prompt_caching: bool = False,
+        use_cache: bool = True
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Invoke an AWS Bedrock LLM and stream the response as it is generated.
+
+        Takes the same arguments as `invoke`. Yields event dictionaries:
+
+        - ``{"type": "text_delta", "text": ...}`` for generated text
+        - ``{"type": "input_json_delta", "partial_json": ...}`` for fragments of tool input
+        - ``{"type": "final", "response": ..., "usage": ...}`` once, at the end, carrying
+          the same value `invoke` would have returned and the call's usage (see `last_usage`)
+        """
+        request_body = self._build_request_body(
+            messages, model_id, max_tokens, temperature, top_p, top_k, stop_sequences,
+            system_prompt, tools, additional_params, tool_choice, prompt_caching
+        )
+
+        cache_key = self._cache_key(model_id, request_body, temperature, use_cache)
+        cached = self._cached_response(model_id, cache_key)
+        if cached is not None:
+            # Replay the cached blocks as single deltas so stream consumers see the same events
+            for block in cached.get("content", []):
+                if block.get("type") == "text":
+                    yield {"type": "text_delta", "text": block.get("text", "")}
+                elif block.get("type") == "tool_use":
+                    yield {"type": "input_json_delta", "partial_json": json.dumps(block.get("input", {}))}
+            yield {"type": "final", "response": self._extract_response(cached, model_id, tool_choice),
+                   "usage": self.last_usage()}
+            return
+
+        logger.info(
+            "Invoking model %s with response stream (latency=%s)",
+            model_id,
+            latency,
+        )
+        start_time = time.perf_counter()
+        body = json.dumps(request_body)
+
+        # The concurrency slot is held until the stream has been read
+        response = self.governor.call(lambda: self.bedrock_runtime.invoke_model_with_response_stream(
+            modelId=model_id,
+            body=body,
+            contentType="application/json",
+            accept="application/json",
+            performanceConfigLatency=latency,
+        ), hold=True)
+        try:
+            yield from self._read_stream(response, model_id, start_time, tool_choice, cache_key)
+        finally:
+            self.governor.release()
+
+    def _read_stream(self, response: Dict[str, Any], model_id: str, start_time: float,
+                     tool_choice: Optional[dict], cache_key: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        # Reassemble content blocks so the final event matches the non-streaming response
+        content_blocks: Dict[int, Dict[str, Any]] = {}
+        partial_json: Dict[int, str] = {}
+        response_body: Dict[str, Any] = {}
+        first_token_logged = False
+
+        for event in response["body"]:
+            chunk = event.get("chunk")
+            if not chunk:
+                continue
+            payload = json.loads(chunk["bytes"].decode("utf-8"))
+            event_type = payload.get("type")
+
+            if event_type == "message_start":
+                response_body = dict(payload.get("message", {}))
+            elif event_type == "content_block_start":
+                content_blocks[payload["index"]] = dict(payload.get("content_block", {}))
+            elif event_type == "content_block_delta":
+                if not first_token_logged:
+                    logger.info("Model %s first token after %.2f seconds", model_id, time.perf_counter() - start_time)
+                    first_token_logged = True
+                index = payload["index"]
+                delta = payload.get("delta", {})
+                if delta.get("type") == "text_delta":
+                    block = content_blocks.setdefault(index, {"type": "text", "text": ""})
+                    block["text"] = block.get("text", "") + delta.get("text", "")
+                    yield {"type": "text_delta", "text": delta.get("text", "")}
+                elif delta.get("type") == "input_json_delta":
+                    partial_json[index] = partial_json.get(index, "") + delta.get("partial_json", "")
+                    yield {"type": "input_json_delta", "partial_json": delta.get("partial_json", "")}
+            elif event_type == "content_block_stop":
+                index = payload["index"]
+                if index in partial_json:
+                    content_blocks[index]["input"] = json.loads(partial_json[index] or "{}")
+            elif event_type == "message_delta":
+                response_body.update(payload.get("delta", {}))
+                if "usage" in payload:
+                    response_body.setdefault("usage", {}).update(payload["usage"])
+
+        elapsed = time.perf_counter() - start_time
+        self._log_latency("Model %s streaming call completed in %.2f seconds (queued %.2f seconds)", model_id, elapsed)
+
+        response_body["content"] = [content_blocks[index] for index in sorted(content_blocks)]
+        self._record_usage(model_id, response_body, elapsed)
+        self._store_response(cache_key, response_body)
+        yield {"type": "final", "response": self._extract_response(response_body, model_id, tool_choice),
+               "usage": self.last_usage()}
+
+    def _build_request_body(
+        self,
+        messages: list,
+        model_id: str,
+        max_tokens: int,
+        temperature: float,
+        top_p: float,
+        top_k: Optional[int],
+        stop_sequences: Optional[list],
+        system_prompt: Optional[str],
+        tools: Optional[list],
+        additional_params: Optional[Dict[str, Any]],
+        tool_choice: Optional[dict],
+        prompt_caching: bool = False,
+    ) -> Dict[str, Any]:
+        """Validate the model and build the full request body shared by `invoke` and `invoke_stream`."""
         if "anthropic" not in model_id.lower():
             raise ValueError(f"Unsupported model: {model_id}. Currently only Anthropic/Claude models are supported.")
 
@@ -87,29 +293,124 @@ class BedrockLLM:
         if additional_params:
             request_body.update(additional_params)
 
+        if prompt_caching:
+            self._add_cache_breakpoints(request_body)
+
+        return request_body
+
+    def _add_cache_breakpoints(self, request_body: Dict[str, Any]) -> None:
+        """
+        Mark the reusable prefix of a request for prompt caching.
+
+        Anthropic models cache everything up to a `cache_control` breakpoint, in the
+        order tools, system, messages. Breakpoints are placed after the tool
+        definitions, after the system prompt and after the last message preceding
+        the current turn, so a follow-up request on the same conversation only pays
+        full price for the newest messages. Blocks are copied, never modified in place.
+        """
+        cache_control = {"type": "ephemeral"}
+
+        if request_body.get("tools"):
+            tools = list(request_body["tools"])
+            tools[-1] = {**tools[-1], "cache_control": cache_control}
+            request_body["tools"] = tools
+
+        system = request_body.get("system")
+        if isinstance(system, str) and system:
+            request_body["system"] = [{"type": "text", "text": system, "cache_control": cache_control}]
+
+        messages = request_body.get("messages", [])
+        if len(messages) > 1:
+            prefix_end = len(messages) - 2
+            message = messages[prefix_end]
+            content = message.get("content", "")
+            if isinstance(content, str):
+                blocks = [{"type": "text", "text": content}] if content else []
+            else:
+                blocks = [block if isinstance(block, dict) else {"type": "text", "text": str(block)} for block in content]
+            if blocks:
+                blocks[-1] = {**blocks[-1], "cache_control": cache_control}
+                messages = list(messages)
+                messages[prefix_end] = {**message, "content": blocks}
+                request_body["messages"] = messages
+
+    def _cache_key(self, model_id: str, request_body: Dict[str, Any], temperature: float,
+                   use_cache: bool) -> Optional[str]:
+        """Response cache key of a request, or None if the request must not use the cache."""
+        self._local.cache_hit = False
+        if self.response_cache is None or not use_cache or temperature != 0.0:
+            return None
+        return request_key(model_id, request_body)
+
+    def _cached_response(self, model_id: str, cache_key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if cache_key is None:
+            return None
+        response_body = self.response_cache.get(cache_key)
+        if response_body is None:
+            return None
+        logger.info("Model %s response served from the response cache", model_id)
+        self._local.cache_hit = True
+        # Nothing was sent to the model
+        self._local.usage = dict({key: 0 for key in USAGE_TOKEN_KEYS}, model_id=model_id, latency_seconds=0.0,
+                                 queue_seconds=0.0, response_cache_hit=True)
+        self._local.stop_reason = response_body.get("stop_reason")
+        return response_body
+
+    def _store_response(self, cache_key: Optional[str], response_body: Dict[str, Any]) -> None:
+        # Only complete answers are worth repeating
+        if cache_key is not None and response_body.get("stop_reason") in ("tool_use", "end_turn"):
+            self.response_cache.put(cache_key, response_body)
+
+    def last_cache_hit(self) -> bool:
+        """Whether the most recent call made from the current thread was answered from the response cache."""
+        return getattr(self._local, "cache_hit", False)
+
+    def _log_latency(self, message: str, model_id: str, elapsed: float) -> None:
+        """Log a call's model latency separately from the time it waited for a concurrency slot."""
+        queue_wait = self.governor.last_queue_wait()
+        logger.info(message, model_id, elapsed - queue_wait, queue_wait)
+        MODEL_SECONDS.observe(elapsed - queue_wait, model=model_id)
+        QUEUE_WAIT_SECONDS.observe(queue_wait, model=model_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Rate governor counters (current concurrency limit, throttles, retries, circuit state, queue wait)
+        and response cache counters when the cache is enabled."""
+        stats = self.governor.stats()
+        if self.response_cache is not None:
+            stats["response_cache"] = self.response_cache.stats()
+        return stats
+
+    def _record_usage(self, model_id: str, response_body: Dict[str, Any], elapsed: float) -> None:
+        """Log token usage of a call and remember it and the stop reason for `last_usage` and
+        `last_stop_reason` on the calling thread."""
+        usage = response_body.get("usage", {})
+        queue_wait = self.governor.last_queue_wait()
+        self._local.usage = dict({key: usage.get(key) or 0 for key in USAGE_TOKEN_KEYS}, model_id=model_id,
+                                 latency_seconds=round(elapsed - queue_wait, 3), queue_seconds=round(queue_wait, 3),
+                                 response_cache_hit=False)
+        self._local.stop_reason = response_body.get("stop_reason")
+        for key, token_type in (("input_tokens", "input"), ("output_tokens", "output"),
+                                ("cache_read_input_tokens", "cache_read"), ("cache_creation_input_tokens", "cache_write")):
+            if usage.get(key):
+                TOKENS.inc(usage[key], model=model_id, type=token_type)
         logger.info(
-            "Invoking model %s (latency=%s)",
+            "Model %s usage: input=%s output=%s cache_read=%s cache_write=%s",
             model_id,
-            latency,
-        )
-        start_time = time.perf_counter()
-        
-        # Invoke the model
-        #TODO: Update to use the converse bedrock API, so it's easier to switch models.
-        response = self.bedrock_runtime.invoke_model(
-            modelId=model_id,
-            body=json.dumps(request_body),
-            contentType="application/json",
-            accept="application/json",
-            performanceConfigLatency=latency,
+            usage.get("input_tokens", 0),
+            usage.get("output_tokens", 0),
+            usage.get("cache_read_input_tokens", 0),
+            usage.get("cache_creation_input_tokens", 0),
         )
-        
-        elapsed = time.perf_counter() - start_time
-        logger.info("Model %s call completed in %.2f seconds", model_id, elapsed)
-        
-        # Parse and return the response
-        response_body = json.loads(response['body'].read().decode('utf-8'))
-        return self._extract_response(response_body, model_id, tool_choice)
+
+    def last_usage(self) -> Dict[str, Any]:
+        """Return the usage of the most recent call made from the current thread: the token counts
+        of Bedrock's `usage` block (USAGE_TOKEN_KEYS), `model_id`, `latency_seconds` (model time),
+        `queue_seconds` (time waiting for a concurrency slot) and `response_cache_hit`."""
+        return dict(getattr(self._local, "usage", {}))
+
+    def last_stop_reason(self) -> Optional[str]:
+        """Return why the most recent call made from the current thread stopped, e.g. "tool_use" or "max_tokens"."""
+        return getattr(self._local, "stop_reason", None)
     
     def _prepare_request_body(
         self,
@@ -177,57 +478,52 @@ class BedrockLLM:
         Bedrock requires that roles strictly alternate between 'user' and 'assistant'.
         If two or more adjacent messages have the same role (either 'user' or 'assistant'),
         we merge their content fields into one message and remove the extras.
-        
-        This function processes the entire message list recursively until no more
-        merges are possible, ensuring the final list has proper role alternation.
-        """
-        if not messages:
-            return messages
-            
-        # Base case: single message or already normalized list
-        if len(messages) == 1:
-            return messages.copy()
 
-        # First pass: merge adjacent messages with the same role
-        merged = []
+        Runs in a single pass and never modifies the caller's messages: messages that
+        need no merging are reused as-is, and each run of same-role messages becomes
+        one new message whose content is built once.
+        """
+        normalized = []
         i = 0
         while i < len(messages):
-            current = messages[i].copy()
-            merged.append(current)
-            
-            # Look ahead for consecutive messages with the same role
+            # Find the run of consecutive messages sharing this message's role
+            role = messages[i].get("role")
             j = i + 1
-            while j < len(messages) and messages[j].get("role") == current.get("role"):
-                # Merge content from the next message into the current one
-                self._merge_message_content(current, messages[j])
+            while j < len(messages) and messages[j].get("role") == role:
                 j += 1
-                
-            # Skip all messages that were merged
+
+            if j - i == 1:
+                normalized.append(messages[i])
+            else:
+                normalized.append({
+                    **messages[i],
+                    "content": self._merge_message_content([m.get("content", "") for m in messages[i:j]]),
+                })
             i = j
-            
-        # Recursive case: if we performed any merges, run again to ensure complete normalization
-        if len(merged) < len(messages):
-            return self.normalize_message_roles(merged)
-        else:
-            return merged
 
-    def _merge_message_content(self, target_msg: dict, source_msg: dict) -> None:
-        """Helper method to merge content from source message into target message.
-        
-        Handles different content formats (string, list) appropriately.
+        return normalized
+
+    @staticmethod
+    def _merge_message_content(contents: list):
+        """Merge the contents of a run of same-role messages.
+
+        Strings are joined with newlines. Once a list of content blocks appears, the
+        result is a list: the text joined so far becomes one item, later lists are
+        concatenated and later strings appended as items.
         """
-        prev_content = target_msg.get("content", "")
-        curr_content = source_msg.get("content", "")
-
-        # Handle the different content formats: str + str, list + list, and mixed
-        if isinstance(prev_content, list) and isinstance(curr_content, list):
-            target_msg["content"] = prev_content + curr_content
-        elif isinstance(prev_content, list):
-            target_msg["content"] = prev_content + [curr_content]
-        elif isinstance(curr_content, list):
-            target_msg["content"] = [prev_content] + curr_content
-        else:  # both strings (or fall-back to str)
-            target_msg["content"] = f"{prev_content}\n{curr_content}"
+        first_list = next((k for k, content in enumerate(contents) if isinstance(content, list)), None)
+        if first_list is None:
+            return "\n".join(str(content) for content in contents)
+
+        merged = []
+        if first_list > 0:
+            merged.append("\n".join(str(content) for content in contents[:first_list]))
+        for content in contents[first_list:]:
+            if isinstance(content, list):
+                merged.extend(content)
+            else:
+                merged.append(content)
+        return merged
 
     def _extract_response(self, response_body: Dict[str, Any], model_id: str, tool_choice: Optional[Dict[str, Any]] = None) -> str:
         """
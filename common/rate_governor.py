@@ -0,0 +1,205 @@
+"""
+Client-side rate governor for Bedrock calls.
+
+Bedrock throttles per account and model, and a burst of concurrent turns turns
+into a burst of `ThrottlingException`s. The governor sits in front of every
+call made by `BedrockLLM`:
+
+- Concurrency is limited with AIMD: the limit grows by about one slot per
+  round of successful calls and is halved when Bedrock throttles. Calls
+  over the limit wait in line, and the wait is measured apart from the model
+  latency.
+- Throttling and transient service errors are retried with full-jitter
+  exponential backoff until a per-request deadline.
+- A circuit breaker opens after consecutive failures and fails calls fast
+  until a cool-down has passed, then lets a single probe call through.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+BEDROCK_MAX_CONCURRENCY = int(os.getenv("BEDROCK_MAX_CONCURRENCY", "32"))
+BEDROCK_INITIAL_CONCURRENCY = int(os.getenv("BEDROCK_INITIAL_CONCURRENCY", "8"))
+BEDROCK_REQUEST_DEADLINE_SECONDS = float(os.getenv("BEDROCK_REQUEST_DEADLINE_SECONDS", "120"))
+BEDROCK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "6"))
+BEDROCK_BACKOFF_BASE_SECONDS = 0.5
+BEDROCK_BACKOFF_MAX_SECONDS = 20.0
+BEDROCK_BREAKER_FAILURES = int(os.getenv("BEDROCK_BREAKER_FAILURES", "5"))
+BEDROCK_BREAKER_COOLDOWN_SECONDS = float(os.getenv("BEDROCK_BREAKER_COOLDOWN_SECONDS", "30"))
+
+THROTTLING_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+TRANSIENT_CODES = {"ServiceUnavailableException", "InternalServerException", "ModelNotReadyException",
+                   "ModelTimeoutException", "RequestTimeout", "RequestTimeoutException"}
+TRANSIENT_EXCEPTIONS = ("EndpointConnectionError", "ConnectionClosedError", "ReadTimeoutError",
+                        "ConnectTimeoutError")
+
+
+class LLMUnavailableError(Exception):
+    """Bedrock could not be reached in time: throttled, failing, or the circuit breaker is open."""
+
+    def __init__(self, message: str, retry_after: float = BEDROCK_BREAKER_COOLDOWN_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def classify_error(error: Exception) -> Optional[str]:
+    """Return "throttle" or "transient" for retryable errors, None for errors that must not be retried."""
+    code = getattr(error, "response", None) and error.response.get("Error", {}).get("Code")
+    if code in THROTTLING_CODES:
+        return "throttle"
+    if code in TRANSIENT_CODES:
+        return "transient"
+    if type(error).__name__ in TRANSIENT_EXCEPTIONS:
+        return "transient"
+    return None
+
+
+class RateGovernor:
+    """AIMD concurrency limit, retries with jittered backoff and a circuit breaker around Bedrock calls."""
+
+    def __init__(self, max_concurrency: int = BEDROCK_MAX_CONCURRENCY,
+                 initial_concurrency: int = BEDROCK_INITIAL_CONCURRENCY,
+                 deadline: float = BEDROCK_REQUEST_DEADLINE_SECONDS, max_attempts: int = BEDROCK_MAX_ATTEMPTS,
+                 breaker_failures: int = BEDROCK_BREAKER_FAILURES,
+                 breaker_cooldown: float = BEDROCK_BREAKER_COOLDOWN_SECONDS):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(min(max(1, initial_concurrency), self.max_concurrency))
+        self.deadline = deadline
+        self.max_attempts = max(1, max_attempts)
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._last_decrease = 0.0
+        self._counters = {"calls": 0, "throttles": 0, "retries": 0, "errors": 0, "rejected": 0}
+        self._queue_wait = {"count": 0, "sum": 0.0, "max": 0.0}
+        self._local = threading.local()
+
+    def call(self, fn: Callable[[], Any], hold: bool = False) -> Any:
+        """Run fn() in a concurrency slot, retrying throttling and transient errors until the deadline.
+
+        With hold=True the slot is still held when fn's result is returned (e.g. for a
+        response stream that is read afterwards) and must be freed with `release()`.
+        """
+        deadline = time.monotonic() + self.deadline
+        self._local.queue_wait = 0.0
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = self._check_breaker()
+            try:
+                self._acquire(deadline)
+            except LLMUnavailableError:
+                if probe:
+                    # The probe never reached Bedrock; let the next call probe instead
+                    with self._cond:
+                        self._probing = False
+                raise
+            started = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self.release()
+                kind = classify_error(e)
+                self._on_failure(kind, started)
+                if kind is None:
+                    raise
+                delay = random.uniform(0, min(BEDROCK_BACKOFF_MAX_SECONDS, BEDROCK_BACKOFF_BASE_SECONDS * 2 ** attempt))
+                if attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                    raise LLMUnavailableError(f"Bedrock is unavailable after {attempt} attempts: {e}",
+                                              retry_after=max(delay, 1.0)) from e
+                with self._cond:
+                    self._counters["retries"] += 1
+                logger.warning("Bedrock %s error (attempt %d), retrying in %.2f seconds: %s", kind, attempt, delay, e)
+                time.sleep(delay)
+                continue
+            self._on_success()
+            if not hold:
+                self.release()
+            return result
+
+    def last_queue_wait(self) -> float:
+        """Seconds the most recent call on the current thread spent waiting for a slot."""
+        return getattr(self._local, "queue_wait", 0.0)
+
+    def _acquire(self, deadline: float) -> None:
+        start = time.monotonic()
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["rejected"] += 1
+                    raise LLMUnavailableError("Timed out waiting for a Bedrock slot", retry_after=1.0)
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            self._counters["calls"] += 1
+            waited = time.monotonic() - start
+            self._queue_wait["count"] += 1
+            self._queue_wait["sum"] += waited
+            self._queue_wait["max"] = max(self._queue_wait["max"], waited)
+        self._local.queue_wait += waited
+
+    def release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def _check_breaker(self) -> bool:
+        """Raise if the circuit breaker is open; return True if this call is the half-open probe."""
+        with self._cond:
+            if self._opened_at is None:
+                return False
+            remaining = self._opened_at + self.breaker_cooldown - time.monotonic()
+            if remaining > 0 or self._probing:
+                self._counters["rejected"] += 1
+                raise LLMUnavailableError("Bedrock circuit breaker is open", retry_after=max(remaining, 1.0))
+            # Half-open: let one call through to probe whether Bedrock has recovered
+            self._probing = True
+            return True
+
+    def _on_success(self) -> None:
+        with self._cond:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            self._failures = 0
+            if self._opened_at is not None:
+                logger.info("Bedrock circuit breaker closed")
+            self._opened_at = None
+            self._probing = False
+            self._cond.notify_all()
+
+    def _on_failure(self, kind: Optional[str], started: float) -> None:
+        with self._cond:
+            self._counters["errors"] += 1
+            if kind == "throttle":
+                self._counters["throttles"] += 1
+                # Calls sent before the last decrease were throttled at the old limit; halve once per burst
+                if started >= self._last_decrease:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = time.monotonic()
+                    logger.warning("Bedrock throttled, concurrency limit lowered to %d", int(self.limit))
+            if kind is None:
+                # Validation and access errors say nothing about Bedrock's health
+                self._probing = False
+                return
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.breaker_failures):
+                logger.error("Bedrock circuit breaker opened after %d consecutive failures", self._failures)
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            state = "closed"
+            if self._opened_at is not None:
+                state = "half-open" if self._probing else "open"
+            return dict(self._counters, limit=int(self.limit), in_flight=self._in_flight, circuit=state,
+                        queue_wait_seconds=dict(self._queue_wait))
@@ -0,0 +1,66 @@
+"""
+Cache of Bedrock responses for repeated prompts.
+
+Many threads open with the same request against the same context. At
+temperature 0 the model answers an identical prompt the same way, so the
+response of a call can be reused for an identical call: the key is a hash of
+the model ID and the canonical JSON of the full request body (system prompt,
+tools, tool choice, normalized messages and sampling parameters). Entries
+expire after a TTL and the least recently used are dropped beyond a size
+bound.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+RESPONSE_CACHE_ENABLED = os.getenv("BEDROCK_RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("BEDROCK_RESPONSE_CACHE_TTL_SECONDS", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("BEDROCK_RESPONSE_CACHE_MAX_ENTRIES", "256"))
+
+
+def request_key(model_id: str, request_body: Dict[str, Any]) -> str:
+    """Hash of a request that doesn't depend on dict key order."""
+    canonical = json.dumps([model_id, request_body], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """TTL + LRU cache of response bodies. Entries are stored as JSON so callers always get a fresh copy."""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return json.loads(entry[1])
+
+    def put(self, key: str, response_body: Dict[str, Any]) -> None:
+        serialized = json.dumps(response_body)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), serialized)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,171 @@
+"""
+Incremental parser for streamed tool-use input.
+
+When a tool call is streamed, Bedrock delivers the tool input as a series of
+`input_json_delta` fragments which only form valid JSON once the block is
+complete. `ToolInputStreamParser` consumes those fragments and reports
+top-level fields as soon as they can be interpreted, so callers can surface
+partial text and completed list entries before the model has finished.
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}")
+
+
+class ToolInputStreamParser:
+    """
+    Parse a streamed JSON object one fragment at a time.
+
+    `feed` returns a list of events describing what became available:
+
+    - ``{"type": "string_delta", "key": k, "text": t}`` for each newly decoded
+      piece of a top-level string value
+    - ``{"type": "item", "key": k, "value": v}`` for each completed element of
+      a top-level array value
+    - ``{"type": "field", "key": k, "value": v}`` for any other top-level
+      value once it has been fully received
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._key: Optional[str] = None
+
+    def feed(self, fragment: str) -> List[Dict[str, Any]]:
+        """Consume a fragment of JSON and return the events it completed."""
+        self.buffer += fragment
+        events: List[Dict[str, Any]] = []
+        while self._step(events):
+            pass
+        return events
+
+    def result(self) -> Dict[str, Any]:
+        """Return the fully parsed object. Only valid once the stream has ended."""
+        return json.loads(self.buffer) if self.buffer.strip() else {}
+
+    def _skip_whitespace(self) -> bool:
+        while self._pos < len(self.buffer) and self.buffer[self._pos] in _WHITESPACE:
+            self._pos += 1
+        return self._pos < len(self.buffer)
+
+    def _decode(self):
+        """Decode one complete JSON value at the current position, or return None if incomplete."""
+        try:
+            value, end = _decoder.raw_decode(self.buffer, self._pos)
+        except json.JSONDecodeError:
+            return None
+        # A number at the end of the buffer may still be growing
+        if end == len(self.buffer) and not isinstance(value, (str, list, dict)):
+            return None
+        self._pos = end
+        return (value,)
+
+    def _step(self, events: List[Dict[str, Any]]) -> bool:
+        """Advance the state machine by one token. Returns False when more input is needed."""
+        if self._state == "done":
+            return False
+        if self._state == "string":
+            return self._pos < len(self.buffer) and self._step_string(events)
+        if not self._skip_whitespace():
+            return False
+        char = self.buffer[self._pos]
+
+        if self._state == "start":
+            if char != "{":
+                raise ValueError(f"Expected '{{' at start of tool input, got {char!r}")
+            self._pos += 1
+            self._state = "key"
+            return True
+
+        if self._state == "key":
+            if char == "}":
+                self._pos += 1
+                self._state = "done"
+                return True
+            decoded = self._decode()
+            if decoded is None:
+                return False
+            self._key = decoded[0]
+            self._state = "colon"
+            return True
+
+        if self._state == "colon":
+            self._pos += 1
+            self._state = "value"
+            return True
+
+        if self._state == "value":
+            if char == '"':
+                self._pos += 1
+                self._state = "string"
+                return True
+            if char == "[":
+                self._pos += 1
+                self._state = "array"
+                return True
+            decoded = self._decode()
+            if decoded is None:
+                return False
+            events.append({"type": "field", "key": self._key, "value": decoded[0]})
+            self._state = "after_value"
+            return True
+
+        if self._state == "array":
+            if char == "]":
+                self._pos += 1
+                self._state = "after_value"
+                return True
+            if char == ",":
+                self._pos += 1
+                return True
+            decoded = self._decode()
+            if decoded is None:
+                return False
+            events.append({"type": "item", "key": self._key, "value": decoded[0]})
+            return True
+
+        if self._state == "after_value":
+            self._pos += 1
+            self._state = "key" if char == "," else "done"
+            return True
+
+        return False
+
+    def _step_string(self, events: List[Dict[str, Any]]) -> bool:
+        """Decode as much of the current string value as is available."""
+        start = self._pos
+        i = start
+        end_of_string = False
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == "\\":
+                # Escapes are two characters, or six for \uXXXX; wait for all of it
+                width = 6 if i + 1 < len(self.buffer) and self.buffer[i + 1] == "u" else 2
+                if i + width > len(self.buffer):
+                    break
+                i += width
+                continue
+            if char == '"':
+                end_of_string = True
+                break
+            i += 1
+
+        # Do not split a UTF-16 surrogate pair across events
+        if not end_of_string and i - start >= 6 and _HIGH_SURROGATE.match(self.buffer, i - 6):
+            i -= 6
+
+        if i > start:
+            text = json.loads('"' + self.buffer[start:i] + '"')
+            events.append({"type": "string_delta", "key": self._key, "text": text})
+        self._pos = i
+        if end_of_string:
+            self._pos += 1
+            self._state = "after_value"
+            return True
+        return False
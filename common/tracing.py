@@ -0,0 +1,205 @@
+"""
+Lightweight span tracing in OpenTelemetry format, without the OpenTelemetry SDK.
+
+Spans are created with the `span()` context manager and nest through a
+context variable, so every span started while another one is open becomes its
+child. Trace attributes (e.g. `thread_id`) set with `set_trace_attribute` are
+added to every span of the trace that is still open, including its root.
+
+Finished spans are exported one per line as OTLP/JSON `ExportTraceServiceRequest`
+documents, the format read by the OpenTelemetry Collector's `otlpjsonfile`
+receiver, to stdout or a file (TRACE_EXPORTER=stdout|file). With the default
+TRACE_EXPORTER=none, trace IDs are still assigned (and returned to clients) but
+nothing is written.
+
+Context variables don't follow work handed to other threads: submit it with
+`contextvars.copy_context().run` to keep its spans in the same trace.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("/tmp", "k8sagent", "traces.jsonl"))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "k8s-agent")
+# Longest string attribute value exported, e.g. for commands
+MAX_ATTRIBUTE_CHARS = 1000
+
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER = 1, 2
+
+_random = random.SystemRandom()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "attributes")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.attributes: Dict[str, Any] = {}
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "status",
+                 "status_message")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str], kind: int, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = "%016x" % _random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("k8sagent_current_span", default=None)
+
+
+def new_trace_id() -> str:
+    return "%032x" % _random.getrandbits(128)
+
+
+def parse_traceparent(header: Optional[str]):
+    """Return (trace_id, parent span id) from a W3C traceparent header, or None if it isn't valid."""
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2]
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def set_trace_attribute(key: str, value: Any) -> None:
+    """Add an attribute to the spans of the current trace that end from now on, including the open ones."""
+    span = _current_span.get()
+    if span is not None:
+        span.trace.attributes[key] = value
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+         kind: int = SPAN_KIND_INTERNAL, **attributes: Any) -> Iterator[Span]:
+    """Record a span around a with-block.
+
+    Without trace_id the span is a child of the current span, or the root of a
+    new trace if there is none. Pass trace_id (and the remote parent_id, if any)
+    to start the local root of a given trace.
+    """
+    parent = _current_span.get()
+    if trace_id is not None or parent is None:
+        trace = _Trace(trace_id or new_trace_id())
+    else:
+        trace, parent_id = parent.trace, parent.span_id
+    current = Span(trace, name, parent_id, kind, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        _exporter.export(current)
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP/JSON encodes 64-bit integers as strings
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    text = str(value)
+    if len(text) > MAX_ATTRIBUTE_CHARS:
+        text = text[:MAX_ATTRIBUTE_CHARS] + "...[truncated]"
+    return {"stringValue": text}
+
+
+def _attributes(values: Dict[str, Any]):
+    return [{"key": key, "value": _attribute_value(value)} for key, value in values.items() if value is not None]
+
+
+def to_otlp(span: Span) -> Dict[str, Any]:
+    """OTLP/JSON ExportTraceServiceRequest holding one span."""
+    record = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _attributes({**span.trace.attributes, **span.attributes}),
+        "status": {"code": span.status, **({"message": span.status_message} if span.status_message else {})},
+    }
+    if span.parent_id:
+        record["parentSpanId"] = span.parent_id
+    return {"resourceSpans": [{
+        "resource": {"attributes": _attributes({"service.name": SERVICE_NAME})},
+        "scopeSpans": [{"scope": {"name": "k8s-agent"}, "spans": [record]}],
+    }]}
+
+
+class _Exporter:
+    def __init__(self, kind: str = TRACE_EXPORTER, path: str = TRACE_FILE):
+        self.kind = kind
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        if self.kind not in ("stdout", "file"):
+            return
+        line = json.dumps(to_otlp(span), separators=(",", ":")) + "\n"
+        with self._lock:
+            try:
+                if self.kind == "stdout":
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+                    return
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, "a", buffering=1)
+                self._file.write(line)
+            except (OSError, ValueError):
+                # Tracing must never break a request
+                pass
+
+
+_exporter = _Exporter()
@@ -0,0 +1,363 @@
+"""
+Optional watch-based cache of cluster state, one per kubeconfig.
+
+Most troubleshooting traffic is the same `get pods`, `get deployments` and
+`get events` in a few namespaces. When enabled, the first such command for a
+namespace starts an informer: it lists the resource once with server-side
+table printing and then keeps a watch open, applying each change to an
+in-memory copy of the table. Later matching commands are answered from memory
+in kubectl's table format, with the time since the informer last heard from
+the API server reported as the staleness of the answer.
+
+Memory is bounded by limits on clusters, informers per cluster and rows per
+informer; an informer that outgrows its row limit, or that the API server
+refuses (401, 403, 404), stops and its commands go back to the API until it
+is retried after FAILED_INFORMER_RETRY_SECONDS. Other errors are retried with
+jittered exponential backoff. Clusters whose commands have not been used for a while stop
+all their watches.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+import subprocess
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from kube_api import (ApiError, KubeApiClient, KubeApiFastPath, TABLE_ACCEPT, Unsupported, first_flag,
+                      format_cell, format_table, parse_kubectl_args)
+from command_cache import kubeconfig_identity
+from command_runner import SHELL_OPERATORS, split_command
+
+logger = logging.getLogger(__name__)
+
+WATCH_CACHE_ENABLED = os.getenv("CLUSTER_WATCH_CACHE", "false").lower() == "true"
+# Stop watching a cluster once none of its commands have been served for this long
+WATCH_IDLE_SECONDS = float(os.getenv("CLUSTER_WATCH_IDLE_SECONDS", "600"))
+MAX_CLUSTERS = int(os.getenv("CLUSTER_WATCH_MAX_CLUSTERS", "20"))
+MAX_INFORMERS_PER_CLUSTER = int(os.getenv("CLUSTER_WATCH_MAX_INFORMERS", "30"))
+MAX_ROWS_PER_INFORMER = int(os.getenv("CLUSTER_WATCH_MAX_ROWS", "5000"))
+# Answers are only served while the informer has heard from the server this recently
+MAX_STALENESS_SECONDS = 120
+
+WATCH_TIMEOUT_SECONDS = 240
+# Delay before listing again after an error, doubled on each consecutive error
+MIN_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+# API statuses that will not go away by retrying: the informer stops
+PERMANENT_ERROR_STATUSES = (401, 403, 404)
+# How long a stopped informer's resource and namespace are not watched again
+FAILED_INFORMER_RETRY_SECONDS = 300
+
+# Resources kept in the watch cache: alias -> (API path prefix, plural)
+WATCHED_RESOURCES = {
+    "pods": ("/api/v1", "pods"), "pod": ("/api/v1", "pods"), "po": ("/api/v1", "pods"),
+    "deployments": ("/apis/apps/v1", "deployments"), "deployment": ("/apis/apps/v1", "deployments"),
+    "deploy": ("/apis/apps/v1", "deployments"),
+    "events": ("/api/v1", "events"), "event": ("/api/v1", "events"), "ev": ("/api/v1", "events"),
+}
+
+QUERY_FLAGS = {"-n": True, "--namespace": True, "-o": True, "--output": True, "--no-headers": False}
+
+
+class RowLimitExceeded(Unsupported):
+    """Raised when an informer would hold more rows than allowed."""
+
+
+def human_duration(seconds: float) -> str:
+    """Format a duration the way kubectl formats ages (k8s.io/apimachinery duration.HumanDuration)."""
+    seconds = int(seconds)
+    if seconds < -1:
+        return "<invalid>"
+    if seconds < 0:
+        return "0s"
+    if seconds < 120:
+        return f"{seconds}s"
+    minutes = seconds // 60
+    if minutes < 10:
+        return f"{minutes}m{seconds % 60}s" if seconds % 60 else f"{minutes}m"
+    if minutes < 180:
+        return f"{minutes}m"
+    hours = seconds // 3600
+    if hours < 8:
+        return f"{hours}h{minutes % 60}m" if minutes % 60 else f"{hours}h"
+    if hours < 48:
+        return f"{hours}h"
+    if hours < 24 * 8:
+        return f"{hours // 24}d{hours % 24}h" if hours % 24 else f"{hours // 24}d"
+    if hours < 24 * 365 * 2:
+        return f"{hours // 24}d"
+    if hours < 24 * 365 * 8:
+        days = (hours // 24) % 365
+        return f"{hours // 24 // 365}y{days}d" if days else f"{hours // 24 // 365}y"
+    return f"{hours // 24 // 365}y"
+
+
+def _since(timestamp: Optional[str]) -> Optional[str]:
+    if not timestamp:
+        return None
+    moment = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return human_duration((datetime.now(timezone.utc) - moment).total_seconds())
+
+
+class ResourceInformer:
+    """List-then-watch one resource type in one namespace, keeping its table rows in memory."""
+
+    def __init__(self, client: KubeApiClient, prefix: str, plural: str, namespace: str,
+                 on_failed: Optional[Callable[["ResourceInformer"], None]] = None):
+        self.client = client
+        self.on_failed = on_failed
+        self.plural = plural
+        self.namespace = namespace
+        self.path = f"{prefix}/namespaces/{namespace}/{plural}"
+        # Events need their full object to recompute "Last Seen"; other kinds only need metadata
+        self.include_object = "Object" if plural == "events" else "Metadata"
+        self.columns: List[dict] = []
+        self.rows: Dict[str, dict] = {}
+        self.resource_version: Optional[str] = None
+        self.synced = False
+        self.failed = False
+        self.last_contact = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._response: Optional[requests.Response] = None
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"informer-{plural}-{namespace}")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def staleness(self) -> float:
+        return time.monotonic() - self.last_contact
+
+    def _list(self) -> None:
+        table = self.client.request(self.path, {"includeObject": self.include_object}, accept=TABLE_ACCEPT).json()
+        if table.get("kind") != "Table":
+            raise Unsupported("server-side printing")
+        rows = table.get("rows") or []
+        if len(rows) > MAX_ROWS_PER_INFORMER:
+            raise RowLimitExceeded(f"{len(rows)} {self.plural} exceed the watch cache row limit")
+        with self._lock:
+            self.columns = table.get("columnDefinitions", [])
+            self.rows = {self._name(row): row for row in rows}
+            self.resource_version = (table.get("metadata") or {}).get("resourceVersion")
+            self.synced = True
+            self.last_contact = time.monotonic()
+
+    @staticmethod
+    def _name(row: dict) -> str:
+        return ((row.get("object") or {}).get("metadata") or {}).get("name", "")
+
+    def _watch(self) -> None:
+        params = {
+            "watch": "true",
+            "resourceVersion": self.resource_version,
+            "allowWatchBookmarks": "true",
+            "timeoutSeconds": WATCH_TIMEOUT_SECONDS,
+            "includeObject": self.include_object,
+        }
+        self._response = self.client.request(self.path, params, accept=TABLE_ACCEPT, stream=True,
+                                             timeout=(10, WATCH_TIMEOUT_SECONDS + 30))
+        # A quiet resource sends nothing until the next bookmark, but an established watch is current
+        with self._lock:
+            self.last_contact = time.monotonic()
+        try:
+            for line in self._response.iter_lines():
+                if self._stop.is_set():
+                    return
+                if not line:
+                    continue
+                event = json.loads(line)
+                self._apply(event.get("type"), event.get("object") or {})
+        finally:
+            self._response.close()
+            self._response = None
+
+    def _apply(self, event_type: str, obj: dict) -> None:
+        if event_type == "ERROR":
+            # Typically 410 Gone: our resourceVersion is too old, so list again
+            raise Unsupported(f"watch error: {obj.get('message')}")
+        with self._lock:
+            self.last_contact = time.monotonic()
+            if event_type == "BOOKMARK":
+                self.resource_version = (obj.get("metadata") or {}).get("resourceVersion", self.resource_version)
+                return
+            for row in obj.get("rows") or []:
+                name = self._name(row)
+                if event_type == "DELETED":
+                    self.rows.pop(name, None)
+                else:
+                    self.rows[name] = row
+                self.resource_version = ((row.get("object") or {}).get("metadata") or {}).get(
+                    "resourceVersion", self.resource_version)
+            if len(self.rows) > MAX_ROWS_PER_INFORMER:
+                raise RowLimitExceeded(f"{len(self.rows)} {self.plural} exceed the watch cache row limit")
+
+    def _fail(self, reason: Exception) -> None:
+        logger.info(f"Stopping informer for {self.plural} in {self.namespace}: {reason}")
+        self.failed = True
+        with self._lock:
+            self.rows = {}
+        if self.on_failed is not None:
+            self.on_failed(self)
+
+    def _run(self) -> None:
+        backoff = MIN_BACKOFF_SECONDS
+        while not self._stop.is_set():
+            try:
+                if not self.synced:
+                    self._list()
+                self._watch()
+                backoff = MIN_BACKOFF_SECONDS
+                continue
+            except RowLimitExceeded as e:
+                self._fail(e)
+                return
+            except ApiError as e:
+                if e.status_code in PERMANENT_ERROR_STATUSES:
+                    self._fail(e)
+                    return
+                logger.info(f"Relisting {self.plural} in {self.namespace}: {e}")
+            except Unsupported as e:
+                logger.info(f"Relisting {self.plural} in {self.namespace}: {e}")
+            except (requests.RequestException, OSError, subprocess.SubprocessError, ValueError) as e:
+                # Includes failures to refresh a token or run an exec credential plugin
+                if self._stop.is_set():
+                    return
+                logger.info(f"Watch for {self.plural} in {self.namespace} interrupted: {e}")
+            self.synced = False
+            # Jittered, so informers that failed together do not retry together
+            self._stop.wait(backoff / 2 + random.uniform(0, backoff / 2))
+            backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    def render(self, wide: bool, no_headers: bool) -> Tuple[str, str, int]:
+        """Render the cached rows as kubectl would print `kubectl get <plural> -n <namespace>`."""
+        with self._lock:
+            columns = list(self.columns)
+            rows = [self.rows[name] for name in sorted(self.rows)]
+        if not rows:
+            return "", f"No resources found in {self.namespace} namespace.", 0
+
+        shown = [i for i, column in enumerate(columns) if wide or column.get("priority", 0) == 0]
+        lines: List[List[str]] = []
+        if not no_headers:
+            lines.append([columns[i]["name"].upper() for i in shown])
+        for row in rows:
+            cells = list(row.get("cells", []))
+            obj = row.get("object") or {}
+            for i, column in enumerate(columns):
+                # Relative times were computed when the row last changed; bring them up to date
+                if i < len(cells) and column["name"] == "Age":
+                    cells[i] = _since((obj.get("metadata") or {}).get("creationTimestamp")) or cells[i]
+                elif i < len(cells) and column["name"] == "Last Seen" and self.plural == "events":
+                    last_seen = ((obj.get("series") or {}).get("lastObservedTime") or obj.get("lastTimestamp")
+                                 or obj.get("firstTimestamp") or obj.get("eventTime"))
+                    cells[i] = _since(last_seen) or cells[i]
+            lines.append([format_cell(cells[i]) if i < len(cells) else "" for i in shown])
+        return format_table(lines), "", 0
+
+
+class ClusterWatchCache:
+    """Informers for the namespaces in use on each cluster, answering matching `kubectl get` commands."""
+
+    def __init__(self, fast_path: KubeApiFastPath, enabled: bool = WATCH_CACHE_ENABLED):
+        self.fast_path = fast_path
+        self.enabled = enabled
+        # identity -> {"informers": {(plural, namespace): ResourceInformer},
+        #              "failed": {(plural, namespace): retry_at}, "last_used": float}
+        self._clusters: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if enabled:
+            threading.Thread(target=self._reap_idle, daemon=True, name="watch-cache-reaper").start()
+
+    def query(self, cmd: str, kubeconfig_path: Optional[str] = None) -> Optional[Tuple[Tuple[str, str, int], float]]:
+        """Answer a `kubectl get pods|deployments|events -n <ns>` command from memory.
+
+        Returns ((stdout, stderr, returncode), staleness_in_seconds), or None if the
+        command is not covered or the informer is not ready yet (in which case one
+        is started for next time).
+        """
+        if not self.enabled:
+            return None
+        tokens = split_command(cmd)
+        if len(tokens) < 3 or tokens[0] != "kubectl" or tokens[1] != "get" \
+                or any(op in cmd for op in SHELL_OPERATORS):
+            return None
+        try:
+            positionals, flags = parse_kubectl_args(tokens[2:], QUERY_FLAGS)
+        except Unsupported:
+            return None
+        output = first_flag(flags, "-o", "--output", default="")
+        if len(positionals) != 1 or positionals[0] not in WATCHED_RESOURCES or output not in ("", "wide"):
+            return None
+
+        informer = self._informer(kubeconfig_path, positionals[0], first_flag(flags, "-n", "--namespace"))
+        if informer is None or not informer.synced or informer.failed:
+            return None
+        staleness = informer.staleness()
+        if staleness > MAX_STALENESS_SECONDS:
+            return None
+        logger.info(f"Answered '{cmd}' from watch cache ({staleness:.1f}s since last server contact)")
+        return informer.render(output == "wide", bool(flags.get("--no-headers"))), staleness
+
+    def _informer(self, kubeconfig_path: Optional[str], resource: str,
+                  namespace: Optional[str]) -> Optional[ResourceInformer]:
+        identity = kubeconfig_identity(kubeconfig_path)
+        with self._lock:
+            cluster = self._clusters.get(identity)
+            if cluster is None:
+                if len(self._clusters) >= MAX_CLUSTERS:
+                    return None
+                cluster = self._clusters[identity] = {"informers": {}, "failed": {}, "last_used": time.monotonic()}
+            cluster["last_used"] = time.monotonic()
+        client = self.fast_path.client_for(kubeconfig_path)
+        if client is None:
+            return None
+        prefix, plural = WATCHED_RESOURCES[resource]
+        key = (plural, namespace or client.default_namespace)
+        with self._lock:
+            informers = cluster["informers"]
+            informer = informers.get(key)
+            if informer is None and len(informers) < MAX_INFORMERS_PER_CLUSTER \
+                    and time.monotonic() >= cluster["failed"].get(key, 0):
+                logger.info(f"Starting watch cache informer for {key[0]} in {key[1]}")
+                cluster["failed"].pop(key, None)
+                informers[key] = ResourceInformer(client, prefix, plural, key[1],
+                                                  on_failed=lambda failed: self._remove(cluster, key, failed))
+            return informer
+
+    def _remove(self, cluster: dict, key: Tuple[str, str], informer: ResourceInformer) -> None:
+        """Drop a stopped informer and hold off starting it again."""
+        with self._lock:
+            if cluster["informers"].get(key) is informer:
+                del cluster["informers"][key]
+            cluster["failed"][key] = time.monotonic() + FAILED_INFORMER_RETRY_SECONDS
+
+    def _reap_idle(self) -> None:
+        while True:
+            time.sleep(min(60, WATCH_IDLE_SECONDS))
+            cutoff = time.monotonic() - WATCH_IDLE_SECONDS
+            with self._lock:
+                idle = [identity for identity, cluster in self._clusters.items() if cluster["last_used"] < cutoff]
+                stopped = [self._clusters.pop(identity) for identity in idle]
+            for cluster in stopped:
+                for informer in cluster["informers"].values():
+                    informer.stop()
+            if stopped:
+                logger.info(f"Stopped watch cache for {len(stopped)} idle cluster(s)")
+
+    def forget(self, kubeconfig_path: Optional[str]) -> None:
+        """Stop all informers for a kubeconfig."""
+        with self._lock:
+            cluster = self._clusters.pop(kubeconfig_identity(kubeconfig_path), None)
+        for informer in (cluster or {}).get("informers", {}).values():
+            informer.stop()
@@ -0,0 +1,171 @@
+"""
+Short-lived cache for the output of read-only kubectl commands.
+
+The LLM frequently suggests the same `kubectl get pods -n X` several times in a
+session, and threads pointing at the same cluster repeat each other's commands.
+Successful output of `get`, `describe`, `top` and bounded `logs --tail` commands
+is cached for a few seconds, keyed by the identity of the kubeconfig (a hash of
+its content) and the normalized command. Entries are evicted LRU-first once the
+entry or byte limits are reached, and any mutating command against the same
+cluster invalidates the entries for the namespace it touched.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from command_runner import is_read_only, kubectl_args, kubectl_flag_value, kubectl_namespace, split_command
+from kubeconfig_registry import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached output stays valid; 0 disables the cache
+CACHE_TTL_SECONDS = float(os.getenv("KUBECTL_CACHE_TTL_SECONDS", "15"))
+CACHE_MAX_ENTRIES = int(os.getenv("KUBECTL_CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.getenv("KUBECTL_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+CACHEABLE_VERBS = {"get", "describe", "top", "logs"}
+
+# Identity of the default kubeconfig (no per-thread kubeconfig)
+DEFAULT_IDENTITY = "default"
+
+# (path, mtime, size) -> content hash, so kubeconfigs are not re-read for every command
+_identities: Dict[Tuple[str, float, int], str] = {}
+_IDENTITY_MEMO_SIZE = 1024
+
+
+def kubeconfig_identity(kubeconfig_path: Optional[str]) -> str:
+    """Identify a cluster by the content of its kubeconfig rather than its file path."""
+    if not kubeconfig_path:
+        return DEFAULT_IDENTITY
+    # Registry files are named after the hash of their content
+    identity = content_hash(kubeconfig_path)
+    if identity:
+        return identity
+    try:
+        stat = os.stat(kubeconfig_path)
+    except OSError:
+        return kubeconfig_path
+    stat_key = (kubeconfig_path, stat.st_mtime, stat.st_size)
+    identity = _identities.get(stat_key)
+    if identity is None:
+        with open(kubeconfig_path, "rb") as f:
+            identity = hashlib.sha256(f.read()).hexdigest()
+        if len(_identities) > _IDENTITY_MEMO_SIZE:
+            _identities.clear()
+        _identities[stat_key] = identity
+    return identity
+
+
+class CommandCache:
+    """Thread-safe TTL + LRU cache of (stdout, stderr, returncode) tuples."""
+
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], dict]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def kubeconfig_identity(self, kubeconfig_path: Optional[str]) -> str:
+        return kubeconfig_identity(kubeconfig_path)
+
+    @staticmethod
+    def is_cacheable(cmd: str) -> bool:
+        """Only read-only verbs whose output is bounded are cached."""
+        if not is_read_only(cmd):
+            return False
+        args = kubectl_args(cmd)
+        verb = args[0] if args else None
+        if verb not in CACHEABLE_VERBS:
+            return False
+        if verb == "logs":
+            return kubectl_flag_value(cmd, "--tail") is not None
+        return True
+
+    @staticmethod
+    def normalize(cmd: str) -> str:
+        return " ".join(split_command(cmd))
+
+    def get(self, cmd: str, kubeconfig_path: Optional[str] = None) -> Optional[Tuple[Tuple[str, str, int], float]]:
+        """Return ((stdout, stderr, returncode), age_in_seconds) for a fresh entry, or None."""
+        if not self.enabled or not self.is_cacheable(cmd):
+            return None
+        key = (self.kubeconfig_identity(kubeconfig_path), self.normalize(cmd))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            age = now - entry["stored_at"]
+            if age > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry["result"], age
+
+    def put(self, cmd: str, kubeconfig_path: Optional[str], result: Tuple[str, str, int]) -> None:
+        """Store the result of a successful cacheable command."""
+        if not self.enabled or result[2] != 0 or not self.is_cacheable(cmd):
+            return
+        size = len(result[0]) + len(result[1])
+        if size > self.max_bytes:
+            return
+        key = (self.kubeconfig_identity(kubeconfig_path), self.normalize(cmd))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "result": result,
+                "stored_at": time.monotonic(),
+                "namespace": kubectl_namespace(cmd),
+                "size": size,
+            }
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, kubeconfig_path: Optional[str] = None, namespace: Optional[str] = None) -> int:
+        """Drop cached output for a cluster that a mutating command may have changed.
+
+        With a namespace, entries for that namespace and cluster-wide listings
+        (all namespaces or no namespace given) are dropped; without one, every
+        entry for the cluster is. Returns the number of entries removed.
+        """
+        identity = self.kubeconfig_identity(kubeconfig_path)
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if key[0] == identity and (
+                    namespace in (None, "*") or entry["namespace"] in (namespace, "*", None)
+                )
+            ]
+            for key in stale:
+                self._remove(key)
+        if stale:
+            logger.info("Invalidated %d cached kubectl outputs (namespace=%s)", len(stale), namespace)
+        return len(stale)
+
+    def invalidate_for(self, cmd: str, kubeconfig_path: Optional[str] = None) -> None:
+        """Invalidate entries affected by a kubectl command, if it is not read-only."""
+        if self.enabled and kubectl_args(cmd) and not is_read_only(cmd):
+            self.invalidate(kubeconfig_path, kubectl_namespace(cmd))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
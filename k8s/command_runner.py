@@ -0,0 +1,327 @@
+"""
+Helpers for executing approved kubectl/helm commands.
+
+Independent read-only kubectl commands are dispatched to a shared, bounded
+worker pool so a single approval turn with many `describe`/`logs` calls does
+not wait on each API round-trip in turn. Anything that may change cluster
+state runs on its own, after every earlier command has finished, so the
+observable ordering of side effects is unchanged.
+
+Processes are started through `run_process`, which bounds how many run at once
+on the pod, how long each may run and how much of its output is kept. A
+command that runs past its timeout (`kubectl logs -f`, `helm install --wait`
+on a stuck release, ...) is killed together with every process it started.
+"""
+
+import os
+import shlex
+import signal
+import logging
+import threading
+import subprocess
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of commands running at once across all requests on this pod
+GLOBAL_MAX_CONCURRENCY = int(os.getenv("KUBECTL_MAX_CONCURRENCY", "16"))
+# Maximum number of commands a single request may have in flight
+REQUEST_MAX_CONCURRENCY = int(os.getenv("KUBECTL_REQUEST_CONCURRENCY", "6"))
+# Maximum number of kubectl/helm processes running at once on this pod
+MAX_PROCESSES = int(os.getenv("COMMAND_MAX_PROCESSES", "32"))
+KUBECTL_TIMEOUT_SECONDS = float(os.getenv("KUBECTL_COMMAND_TIMEOUT_SECONDS", "60"))
+HELM_TIMEOUT_SECONDS = float(os.getenv("HELM_COMMAND_TIMEOUT_SECONDS", "600"))
+# Bytes of stdout and of stderr kept per command; the middle of longer output is dropped
+MAX_OUTPUT_BYTES = int(os.getenv("COMMAND_MAX_OUTPUT_BYTES", str(1024 * 1024)))
+# Time a process group gets to exit after SIGTERM before it is killed
+KILL_GRACE_SECONDS = 2
+TIMEOUT_EXIT_CODE = 124
+
+READ_ONLY_VERBS = {
+    "get", "describe", "logs", "top", "explain", "version",
+    "api-resources", "api-versions", "cluster-info", "events",
+}
+READ_ONLY_SUBCOMMANDS = {
+    "config": {"current-context", "get-contexts", "get-clusters", "view"},
+    "auth": {"can-i", "whoami"},
+    "rollout": {"status", "history"},
+}
+
+# Verbs reported as metric labels; anything else is counted as "other" to keep label values bounded
+METRIC_KUBECTL_VERBS = READ_ONLY_VERBS | set(READ_ONLY_SUBCOMMANDS) | {
+    "apply", "create", "delete", "patch", "replace", "edit", "scale", "autoscale", "label", "annotate",
+    "set", "expose", "run", "exec", "cp", "port-forward", "cordon", "uncordon", "drain", "taint",
+    "debug", "wait", "diff", "kustomize", "attach", "certificate",
+}
+METRIC_HELM_VERBS = {
+    "install", "upgrade", "uninstall", "rollback", "template", "lint", "list", "status", "history",
+    "get", "show", "dependency", "repo", "package", "pull", "search", "test", "version",
+}
+
+_executor = ThreadPoolExecutor(max_workers=GLOBAL_MAX_CONCURRENCY, thread_name_prefix="kubectl")
+_process_slots = threading.BoundedSemaphore(max(1, MAX_PROCESSES))
+
+
+# Characters that let the shell run more than one kubectl invocation or expand its arguments
+SHELL_OPERATORS = ("|", ";", "&", ">", "<", "`", "$", "\n", "\r")
+
+
+def split_command(cmd: str) -> List[str]:
+    """Tokenize a command string, falling back to whitespace splitting on bad quoting."""
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return cmd.split()
+
+
+def kubectl_args(cmd: str) -> List[str]:
+    """Return the positional (non-flag) arguments following `kubectl`."""
+    tokens = split_command(cmd)
+    if not tokens or os.path.basename(tokens[0]) != "kubectl":
+        return []
+    args = []
+    skip_next = False
+    for token in tokens[1:]:
+        if skip_next:
+            skip_next = False
+            continue
+        if token.startswith("-"):
+            # Short/long flags given as a separate value, e.g. "-n ns", "--namespace ns"
+            if "=" not in token and token in ("-n", "--namespace", "-l", "--selector", "-o", "--output",
+                                              "-c", "--container", "--context", "--kubeconfig", "-f",
+                                              "--field-selector", "--tail", "--since", "-s", "--server"):
+                skip_next = True
+            continue
+        args.append(token)
+    return args
+
+
+def kubectl_verb(cmd: str) -> Optional[str]:
+    """Return the kubectl verb (e.g. 'get', 'describe') of a command string, if any."""
+    args = kubectl_args(cmd)
+    return args[0] if args else None
+
+
+def metric_verb(cmd: str) -> str:
+    """Bounded label for a command: "get", "helm install", ... or "other"."""
+    tokens = split_command(cmd)
+    if tokens and os.path.basename(tokens[0]) == "helm":
+        verb = next((t for t in tokens[1:] if not t.startswith("-")), None)
+        return f"helm {verb}" if verb in METRIC_HELM_VERBS else "helm other"
+    verb = kubectl_verb(cmd)
+    return verb if verb in METRIC_KUBECTL_VERBS else "other"
+
+
+def kubectl_flag_value(cmd: str, *names: str) -> Optional[str]:
+    """Return the value of the first matching flag, accepting both "--flag value" and "--flag=value"."""
+    tokens = split_command(cmd)
+    for i, token in enumerate(tokens):
+        for name in names:
+            if token == name and i + 1 < len(tokens):
+                return tokens[i + 1]
+            if token.startswith(name + "="):
+                return token[len(name) + 1:]
+    return None
+
+
+def kubectl_namespace(cmd: str) -> Optional[str]:
+    """Return the namespace a kubectl command targets, "*" for all namespaces, or None if not given."""
+    tokens = split_command(cmd)
+    if "-A" in tokens or "--all-namespaces" in tokens or "--all-namespaces=true" in tokens:
+        return "*"
+    return kubectl_flag_value(cmd, "-n", "--namespace")
+
+
+def is_read_only(cmd: str) -> bool:
+    """Whether a kubectl command only reads cluster state and is safe to run concurrently.
+
+    Shell pipelines, redirections, command chaining (including on a new line) and
+    expansions are never considered read-only, as the shell may do more than the
+    kubectl invocation itself.
+    """
+    if any(op in cmd for op in SHELL_OPERATORS):
+        return False
+    args = kubectl_args(cmd)
+    if not args:
+        return False
+    verb = args[0]
+    if verb in READ_ONLY_SUBCOMMANDS:
+        return len(args) > 1 and args[1] in READ_ONLY_SUBCOMMANDS[verb]
+    if verb not in READ_ONLY_VERBS:
+        return False
+    # Following logs or watching never terminates and would pin a worker
+    tokens = split_command(cmd)
+    return not any(t in ("-f", "--follow", "-w", "--watch") or t.startswith(("--follow=", "--watch="))
+                   for t in tokens)
+
+
+def run_in_order(tasks: List[Tuple[Callable[[], Any], bool]],
+                 max_concurrency: int = REQUEST_MAX_CONCURRENCY) -> List[Any]:
+    """Run a batch of tasks and return their results in submission order.
+
+    Args:
+        tasks: List of (callable, parallel) tuples. Consecutive tasks marked
+            parallel run concurrently on the shared pool, with at most
+            `max_concurrency` of them in flight for this batch. A task that is
+            not parallel waits for all earlier tasks and runs on its own.
+        max_concurrency: Per-request cap on in-flight parallel tasks
+
+    Returns:
+        The list of task results, in the same order as `tasks`
+    """
+    results: List[Any] = [None] * len(tasks)
+    pending = []
+    slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+    def _release(_):
+        slots.release()
+
+    def _drain():
+        for idx, future in pending:
+            results[idx] = future.result()
+        pending.clear()
+
+    for idx, (fn, parallel) in enumerate(tasks):
+        if parallel:
+            slots.acquire()
+            # Run in a copy of the caller's context so tracing spans stay in the request's trace
+            future = _executor.submit(contextvars.copy_context().run, fn)
+            future.add_done_callback(_release)
+            pending.append((idx, future))
+        else:
+            _drain()
+            results[idx] = fn()
+    _drain()
+    return results
+
+
+class ProcessResult(NamedTuple):
+    stdout: str
+    stderr: str
+    returncode: int
+    timed_out: bool = False
+    truncated: bool = False
+
+
+class CappedBuffer:
+    """Keeps the first and last max_bytes/2 bytes of a stream and counts what is dropped in between."""
+
+    def __init__(self, max_bytes: int):
+        self.head_limit = max_bytes - max_bytes // 2
+        self.tail_limit = max_bytes // 2
+        self.head = bytearray()
+        self.tail: deque = deque()
+        self.tail_size = 0
+        self.dropped = 0
+
+    def write(self, chunk: bytes) -> None:
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if not chunk:
+            return
+        self.tail.append(chunk)
+        self.tail_size += len(chunk)
+        while self.tail_size > self.tail_limit:
+            excess = self.tail_size - self.tail_limit
+            first = self.tail[0]
+            if len(first) <= excess:
+                self.tail.popleft()
+                self.tail_size -= len(first)
+                self.dropped += len(first)
+            else:
+                self.tail[0] = first[excess:]
+                self.tail_size -= excess
+                self.dropped += excess
+
+    def text(self) -> str:
+        head = bytes(self.head).decode("utf-8", errors="replace")
+        tail = b"".join(self.tail).decode("utf-8", errors="replace")
+        if not self.dropped:
+            return head + tail
+        return f"{head}\n[... {self.dropped} bytes of output truncated by the agent ...]\n{tail}"
+
+
+def _read_stream(stream, buffer: CappedBuffer) -> None:
+    try:
+        for chunk in iter(lambda: stream.read1(65536), b""):
+            buffer.write(chunk)
+    except (OSError, ValueError):
+        pass
+
+
+def _signal_group(proc: subprocess.Popen, sig: int) -> None:
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _kill_group(proc: subprocess.Popen) -> None:
+    """SIGTERM the process group of proc, then SIGKILL whatever is left after a grace period."""
+    _signal_group(proc, signal.SIGTERM)
+    try:
+        proc.wait(timeout=KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        pass
+    _signal_group(proc, signal.SIGKILL)
+    proc.wait()
+
+
+def run_process(cmd: Union[str, List[str]], env: Optional[Dict[str, str]] = None, cwd: Optional[str] = None,
+                timeout: float = KUBECTL_TIMEOUT_SECONDS,
+                max_output_bytes: int = MAX_OUTPUT_BYTES) -> ProcessResult:
+    """Run a command in its own process group with a timeout and capped output.
+
+    A string is run by the shell; a list is run as an argument vector, without one.
+
+    Waits for a free process slot for at most `timeout` seconds. On timeout the
+    whole process group is terminated and the output read so far is returned
+    with exit code 124 and a note on stderr.
+    """
+    if not _process_slots.acquire(timeout=timeout):
+        return ProcessResult("", f"Too many commands running on the agent; {cmd!r} was not started "
+                                 f"after waiting {timeout:g}s for a slot", 1)
+    try:
+        proc = subprocess.Popen(cmd, shell=isinstance(cmd, str), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env, cwd=cwd, start_new_session=True)
+        buffers = (CappedBuffer(max_output_bytes), CappedBuffer(max_output_bytes))
+        readers = [threading.Thread(target=_read_stream, args=(stream, buffer), daemon=True)
+                   for stream, buffer in zip((proc.stdout, proc.stderr), buffers)]
+        for reader in readers:
+            reader.start()
+
+        timed_out = False
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            logger.warning("Command timed out after %gs, terminating its process group: %s", timeout, cmd)
+            _kill_group(proc)
+        else:
+            # Don't leave background processes started by the command running
+            _signal_group(proc, signal.SIGTERM)
+        for reader in readers:
+            reader.join(timeout=KILL_GRACE_SECONDS)
+        if any(reader.is_alive() for reader in readers):
+            # Something that ignored SIGTERM still holds the pipes open
+            _signal_group(proc, signal.SIGKILL)
+            for reader in readers:
+                reader.join(timeout=KILL_GRACE_SECONDS)
+        if not any(reader.is_alive() for reader in readers):
+            proc.stdout.close()
+            proc.stderr.close()
+    finally:
+        _process_slots.release()
+
+    stdout, stderr = (buffer.text() for buffer in buffers)
+    truncated = any(buffer.dropped for buffer in buffers)
+    returncode = proc.returncode
+    if timed_out:
+        returncode = TIMEOUT_EXIT_CODE
+        stderr = (stderr + "\n" if stderr else "") + f"Command timed out after {timeout:g}s and was terminated"
+    return ProcessResult(stdout, stderr, returncode, timed_out, truncated)
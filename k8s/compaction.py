@@ -0,0 +1,206 @@
+"""
+Token-budgeted compaction of conversation history before it is sent to the LLM.
+
+Threads keep their full history in memory; compaction only shapes the copy
+that goes to Bedrock. When the estimated size of a conversation exceeds the
+budget for the target model, it is reduced in stages until it fits:
+
+1. Command outputs in older turns are cut down to a head/tail excerpt.
+2. Older turns are folded into a single summary message. Summaries are
+   extractive and cached per message, so they are computed once per message
+   rather than on every request. The summary covers whole chunks of
+   SUMMARY_CHUNK_MESSAGES messages, so it only changes when the conversation
+   has grown by a chunk and the prompt cache prefix stays put in between.
+   Its oldest lines are dropped, a chunk at a time, if it alone would exceed
+   the budget.
+3. Command outputs in the recent turns are excerpted too.
+4. As a last resort, the oldest messages after the summary are dropped.
+
+The most recent turns are otherwise always sent verbatim, and the current
+request is always sent.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English text and kubectl output
+CHARS_PER_TOKEN = 4
+
+# Default input budgets (in tokens) for conversation messages, by model family.
+# Matched against the model id in order; the first match wins.
+DEFAULT_TOKEN_BUDGETS = [
+    ("haiku", 40000),
+    ("sonnet", 80000),
+    ("opus", 80000),
+]
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "60000"))
+
+# Number of most recent messages that are kept verbatim
+KEEP_RECENT_MESSAGES = int(os.getenv("COMPACTION_KEEP_RECENT_MESSAGES", "8"))
+
+# Lines kept from the start and end of an excerpted command output
+EXCERPT_HEAD_LINES = 20
+EXCERPT_TAIL_LINES = 10
+
+SUMMARY_CACHE_SIZE = 5000
+SUMMARY_LINE_CHARS = 300
+# Messages are summarized, and summary lines dropped, in chunks of this many
+SUMMARY_CHUNK_MESSAGES = 16
+SUMMARY_HEADER = "Summary of the earlier part of this conversation (older messages were compacted):"
+
+COMMAND_OUTPUT_MARKER = "\n\nThe output was:\n"
+
+_summary_cache: "OrderedDict[str, str]" = OrderedDict()
+_summary_cache_lock = threading.Lock()
+
+
+def _configured_budgets() -> List[tuple]:
+    """Per-model budgets, optionally overridden with CONTEXT_TOKEN_BUDGETS='{"haiku": 30000}'."""
+    overrides = os.getenv("CONTEXT_TOKEN_BUDGETS")
+    if not overrides:
+        return DEFAULT_TOKEN_BUDGETS
+    try:
+        return [(key.lower(), int(value)) for key, value in json.loads(overrides).items()] + DEFAULT_TOKEN_BUDGETS
+    except (ValueError, AttributeError) as e:
+        logger.error(f"Ignoring invalid CONTEXT_TOKEN_BUDGETS: {e}")
+        return DEFAULT_TOKEN_BUDGETS
+
+
+def token_budget_for(model_id: str) -> int:
+    """Return the conversation token budget for a Bedrock model id."""
+    if os.getenv("CONTEXT_TOKEN_BUDGET"):
+        return DEFAULT_TOKEN_BUDGET
+    model_id = (model_id or "").lower()
+    for family, budget in _configured_budgets():
+        if family in model_id:
+            return budget
+    return DEFAULT_TOKEN_BUDGET
+
+
+def _content_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return json.dumps(content)
+
+
+def estimate_tokens(messages: List[dict]) -> int:
+    """Cheap token estimate for a list of messages, without a tokenizer."""
+    return sum(len(_content_text(m.get("content", ""))) for m in messages) // CHARS_PER_TOKEN + 4 * len(messages)
+
+
+def excerpt_output(text: str, head: int = EXCERPT_HEAD_LINES, tail: int = EXCERPT_TAIL_LINES) -> str:
+    """Shorten a command output to its first and last lines."""
+    lines = text.split("\n")
+    if len(lines) <= head + tail + 1:
+        return text
+    omitted = len(lines) - head - tail
+    return "\n".join(lines[:head] + [f"[... {omitted} lines omitted ...]"] + lines[-tail:])
+
+
+def _excerpt_message(message: dict) -> dict:
+    """Return a copy of a message with any embedded command output excerpted."""
+    content = message.get("content")
+    if not isinstance(content, str) or COMMAND_OUTPUT_MARKER not in content:
+        return message
+    prefix, output = content.split(COMMAND_OUTPUT_MARKER, 1)
+    shortened = excerpt_output(output)
+    if shortened is output:
+        return message
+    return {**message, "content": prefix + COMMAND_OUTPUT_MARKER + shortened}
+
+
+def _summarize_message(message: dict) -> str:
+    """One-line extractive summary of a message, cached by content."""
+    text = _content_text(message.get("content", ""))
+    key = hashlib.sha256(f"{message.get('role')}\0{text}".encode("utf-8")).hexdigest()
+    with _summary_cache_lock:
+        if key in _summary_cache:
+            _summary_cache.move_to_end(key)
+            return _summary_cache[key]
+
+    if COMMAND_OUTPUT_MARKER in text:
+        # Keep the command and the first lines of what it returned
+        prefix, output = text.split(COMMAND_OUTPUT_MARKER, 1)
+        first_lines = " / ".join(line.strip() for line in output.strip().split("\n")[:3] if line.strip())
+        summary = f"{prefix.strip()} -> {first_lines}"
+    else:
+        summary = " ".join(text.split())
+    if len(summary) > SUMMARY_LINE_CHARS:
+        summary = summary[:SUMMARY_LINE_CHARS] + " ..."
+    summary = f"- {message.get('role', 'user')}: {summary}"
+
+    with _summary_cache_lock:
+        _summary_cache[key] = summary
+        if len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+    return summary
+
+
+def _summary_message(lines: List[str], omitted: int) -> dict:
+    if omitted:
+        lines = [f"[{omitted} messages omitted]"] + lines
+    return {"role": "user", "content": "\n".join([SUMMARY_HEADER] + lines)}
+
+
+def compact_messages(messages: List[dict], token_budget: int,
+                     keep_recent: Optional[int] = None) -> List[dict]:
+    """Return a copy of `messages` that fits within `token_budget` estimated tokens.
+
+    Only the current request (the last message) is never shortened or dropped,
+    so the result can exceed the budget if that message alone does. The input
+    list and its messages are never modified. If the conversation already fits,
+    it is returned as is.
+    """
+    keep_recent = KEEP_RECENT_MESSAGES if keep_recent is None else keep_recent
+    original_tokens = estimate_tokens(messages)
+    if original_tokens <= token_budget:
+        return messages
+
+    split = max(0, len(messages) - keep_recent)
+    # Summarized messages end at a chunk boundary; the rest of the older ones are only excerpted
+    boundary = split - split % SUMMARY_CHUNK_MESSAGES
+
+    # Stage 1: excerpt command outputs in older turns
+    older = [_excerpt_message(m) for m in messages[:split]]
+    recent = messages[split:]
+    compacted = older + recent
+
+    # Stage 2: fold whole chunks of older turns into a single summary message
+    lines, omitted = None, 0
+    if boundary and estimate_tokens(compacted) > token_budget:
+        lines = [_summarize_message(m) for m in messages[:boundary]]
+        compacted = older[boundary:] + recent
+        # The summary must leave room for the rest; drop its oldest lines a chunk at a time
+        rest_tokens = estimate_tokens(compacted)
+        while lines and estimate_tokens([_summary_message(lines, omitted)]) + rest_tokens > token_budget:
+            lines = lines[SUMMARY_CHUNK_MESSAGES:]
+            omitted += SUMMARY_CHUNK_MESSAGES
+    head = [] if lines is None else [_summary_message(lines, omitted)]
+
+    # Stage 3: excerpt command outputs in recent turns, except the current request
+    if estimate_tokens(head + compacted) > token_budget:
+        compacted = [_excerpt_message(m) for m in compacted[:-1]] + compacted[-1:]
+
+    # Stage 4: drop the oldest messages after the summary until the rest fits, up to
+    # chunk boundaries so the start stays the same for a few turns. The conversation
+    # still starts with a user message that says what is missing.
+    start = first = boundary if lines is not None else 0
+    while len(compacted) > 1 and estimate_tokens(head + compacted) > token_budget:
+        step = min(SUMMARY_CHUNK_MESSAGES - start % SUMMARY_CHUNK_MESSAGES, len(compacted) - 1)
+        compacted = compacted[step:]
+        start += step
+        head = [_summary_message(lines or [], omitted + start - first)]
+    compacted = head + compacted
+
+    logger.info(
+        "Compacted conversation from ~%d to ~%d tokens (budget %d, %d messages -> %d)",
+        original_tokens, estimate_tokens(compacted), token_budget, len(messages), len(compacted),
+    )
+    return compacted
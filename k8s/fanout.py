@@ -0,0 +1,129 @@
+"""
+Fan-out of read-only kubectl commands over many clusters and namespaces.
+
+A fan-out request names a command (or a question the LLM turns into
+commands) and a set of targets: every kubeconfig crossed with every
+namespace. The commands run on all targets concurrently, and the results are
+merged for a single analysis call: targets that returned the same output are
+grouped into one message, so a fleet where most clusters look alike costs
+little more context than a single cluster.
+
+Only read-only commands are fanned out; a mistake repeated over dozens of
+clusters is not something to risk. They are run as argument vectors, without a
+shell, and commands with shell operators, expansions or line breaks are refused.
+"""
+
+import os
+import shlex
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from command_runner import SHELL_OPERATORS, is_read_only, split_command
+from compaction import COMMAND_OUTPUT_MARKER
+
+FANOUT_MAX_TARGETS = int(os.getenv("FANOUT_MAX_TARGETS", "100"))
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "8"))
+# Commands taken from the LLM's suggestions when the request only has a question
+FANOUT_MAX_COMMANDS = 5
+# Target names listed in a merged message before the rest are only counted
+MAX_LISTED_TARGETS = 20
+
+_NAMESPACE_FLAGS = ("-n", "--namespace", "-A", "--all-namespaces")
+
+
+class FanoutError(ValueError):
+    """The fan-out request is invalid; reported to the client as a 400."""
+
+
+class Target(NamedTuple):
+    name: str
+    kubeconfig: Optional[str]  # Base64 encoded kubeconfig, None for the agent's own
+    namespace: Optional[str]
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}/{self.namespace}" if self.namespace else self.name
+
+
+def parse_targets(data: Dict[str, Any], max_targets: int = FANOUT_MAX_TARGETS) -> List[Target]:
+    """Targets of a request: each of `kubeconfigs` (or the agent's own cluster) in each of `namespaces`.
+
+    `kubeconfigs` items are base64 kubeconfigs or `{"name": ..., "kubeconfig": ...}` objects.
+    """
+    kubeconfigs = data.get("kubeconfigs") or []
+    namespaces = data.get("namespaces") or []
+    if not isinstance(kubeconfigs, list) or not isinstance(namespaces, list):
+        raise FanoutError("'kubeconfigs' and 'namespaces' must be lists")
+    if not kubeconfigs and not namespaces:
+        raise FanoutError("Provide 'kubeconfigs', 'namespaces' or both")
+
+    clusters = []
+    for i, item in enumerate(kubeconfigs or [None], 1):
+        if isinstance(item, dict):
+            if not item.get("kubeconfig"):
+                raise FanoutError(f"kubeconfigs[{i - 1}] has no 'kubeconfig'")
+            clusters.append((str(item.get("name") or f"cluster-{i}"), item["kubeconfig"]))
+        elif isinstance(item, str) or item is None:
+            clusters.append((f"cluster-{i}" if item else "default", item))
+        else:
+            raise FanoutError(f"kubeconfigs[{i - 1}] must be a string or an object")
+    if not all(isinstance(ns, str) and ns for ns in namespaces):
+        raise FanoutError("'namespaces' must be a list of names")
+
+    targets = [Target(name, kubeconfig, namespace)
+               for name, kubeconfig in clusters for namespace in (namespaces or [None])]
+    if len(targets) > max_targets:
+        raise FanoutError(f"{len(targets)} targets requested, at most {max_targets} are allowed")
+    return targets
+
+
+def check_command(cmd: Any) -> str:
+    """Validate a command to fan out and return it stripped."""
+    if not isinstance(cmd, str) or not cmd.strip().startswith("kubectl"):
+        raise FanoutError("'command' must be a kubectl command")
+    cmd = cmd.strip()
+    if any(op in cmd for op in SHELL_OPERATORS):
+        raise FanoutError(f"Fanned out commands must be a single kubectl command, without shell operators: {cmd!r}")
+    try:
+        shlex.split(cmd)
+    except ValueError as e:
+        raise FanoutError(f"Invalid quoting in command {cmd!r}: {e}")
+    if not is_read_only(cmd):
+        raise FanoutError(f"Only read-only commands can be fanned out: {cmd}")
+    return cmd
+
+
+def sets_namespace(cmd: str) -> bool:
+    return any(token in _NAMESPACE_FLAGS or token.startswith(("--namespace=", "-n=")) for token in split_command(cmd))
+
+
+def scoped_command(cmd: str, namespace: Optional[str]) -> str:
+    """The command to run in a target's namespace."""
+    if namespace is None:
+        return cmd
+    if sets_namespace(cmd):
+        raise FanoutError(f"Commands fanned out over namespaces must not set a namespace: {cmd}")
+    return f"{cmd} -n {shlex.quote(namespace)}"
+
+
+def _targets_text(labels: List[str]) -> str:
+    listed = ", ".join(labels[:MAX_LISTED_TARGETS])
+    if len(labels) > MAX_LISTED_TARGETS:
+        listed += f" and {len(labels) - MAX_LISTED_TARGETS} more"
+    return listed
+
+
+def merge_results(cmd: str, results: List[Dict[str, Any]]) -> List[dict]:
+    """User messages carrying a command's results, one per distinct output with the targets that returned it.
+
+    The messages use the same "I ran this kubectl command" form as thread history, so
+    output reduction and compaction apply to them."""
+    groups: Dict[str, List[str]] = {}
+    for result in results:
+        groups.setdefault(result["Output"].strip(), []).append(result["target"])
+    messages = []
+    for output, labels in groups.items():
+        where = "On every target" if len(labels) == len(results) and len(results) > 1 else \
+            f"On {len(labels)} target{'s' if len(labels) > 1 else ''} ({_targets_text(labels)})"
+        messages.append({"role": "user", "content": f"{where}, I ran this kubectl command: {cmd}"
+                                                    f"{COMMAND_OUTPUT_MARKER}{output or '(no output)'}"})
+    return messages
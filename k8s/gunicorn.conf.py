@@ -0,0 +1,29 @@
+# Gunicorn configuration for serving the Kubernetes agent in production.
+#
+# Usage: gunicorn -c gunicorn.conf.py k8s_api_agent:app
+#
+# Requests spend almost all of their time waiting on Bedrock and on kubectl/helm,
+# so the agent is served by threaded workers: each waiting conversation holds a
+# cheap thread rather than a whole process. Conversation state lives in the
+# worker's memory by default, so keep a single worker unless SESSION_STORE=sqlite
+# is set; scale concurrency with GUNICORN_THREADS instead.
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "256"))
+
+# A single turn can include two LLM calls and several commands; don't kill slow turns
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "600"))
+graceful_timeout = 60
+keepalive = 75
+
+# Pending connections queued while all threads are busy
+backlog = 2048
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
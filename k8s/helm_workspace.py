@@ -0,0 +1,188 @@
+"""
+Reusable working directories for Helm operations.
+
+Each Helm operation comes with the chart files the LLM generated. Workspaces
+are keyed by the set of file paths and the content of the chart definitions
+(`Chart.yaml`, `requirements.yaml`), so a follow-up `helm upgrade` of the same
+chart, e.g. with changed values or templates, runs in the directory of the
+previous one: files whose content hasn't changed are not written again, and
+dependencies Helm downloaded into the chart (`charts/`, `Chart.lock`) are
+still there. A different chart, or the same chart with changed dependencies,
+gets a workspace of its own, so downloaded dependencies never leak between
+them. Operations on the same workspace are
+serialized. Idle workspaces are deleted least recently used first once there
+are too many of them or they take too much disk space.
+
+All operations also share one Helm cache, config and data directory, so
+repository indexes and downloaded charts are reused across runs.
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from common import tracing
+
+logger = logging.getLogger(__name__)
+
+HELM_WORKSPACE_DIR = os.getenv("HELM_WORKSPACE_DIR", os.path.join("/tmp", "k8sagent", "helm"))
+HELM_WORKSPACE_MAX_COUNT = int(os.getenv("HELM_WORKSPACE_MAX_COUNT", "64"))
+HELM_WORKSPACE_MAX_BYTES = int(os.getenv("HELM_WORKSPACE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Files that name a chart and its dependencies; their content is part of the workspace key
+CHART_DEFINITION_FILES = ("Chart.yaml", "requirements.yaml")
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class HelmWorkspaceCache:
+    """LRU cache of chart working directories, bounded by count and total size."""
+
+    def __init__(self, root: str = HELM_WORKSPACE_DIR, max_workspaces: int = HELM_WORKSPACE_MAX_COUNT,
+                 max_bytes: int = HELM_WORKSPACE_MAX_BYTES):
+        self.root = root
+        self.max_workspaces = max_workspaces
+        self.max_bytes = max_bytes
+        # Gunicorn workers share the root; each process keeps its workspaces apart
+        self._dir = os.path.join(root, f"workspaces-{os.getpid()}")
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._remove_orphans()
+
+    def _remove_orphans(self) -> None:
+        """Delete workspaces left behind by processes that are no longer running."""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            prefix, _, pid = name.partition("workspaces-")
+            if not prefix and pid.isdigit() and not _pid_alive(int(pid)):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def helm_env(self) -> Dict[str, str]:
+        """Environment for helm with shared cache, config and data directories (unless already set)."""
+        env = dict(os.environ)
+        for var, name in (("HELM_CACHE_HOME", "cache"), ("HELM_CONFIG_HOME", "config"), ("HELM_DATA_HOME", "data")):
+            env.setdefault(var, os.path.join(self.root, name))
+        return env
+
+    @staticmethod
+    def _relative_path(file_path: str):
+        """Normalize a chart file path, or return None if it would escape the workspace."""
+        path = os.path.normpath(file_path.lstrip("/"))
+        if path in ("", ".") or path == ".." or path.startswith(".." + os.sep):
+            return None
+        return path
+
+    @contextmanager
+    def workspace(self, files: List[Dict[str, Any]]) -> Iterator[str]:
+        """Check out a workspace containing the given chart files and yield its directory.
+
+        The workspace is locked for the duration of the with-block."""
+        contents = {}
+        for file_info in files:
+            file_path = file_info.get("file_path")
+            file_content = file_info.get("file_content")
+            if not file_path or file_content is None:
+                continue
+            path = self._relative_path(file_path)
+            if path is None:
+                logger.warning("Skipping file outside the chart workspace: %s", file_path)
+                continue
+            contents[path] = file_content
+
+        key = self._key(contents)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    "dir": os.path.join(self._dir, key), "files": {}, "bytes": 0, "users": 0,
+                    "lock": threading.Lock(),
+                }
+            self._entries.move_to_end(key)
+            entry["users"] += 1
+
+        try:
+            with entry["lock"]:
+                with tracing.span("helm_workspace_sync", files=len(contents), workspace=entry["dir"]):
+                    self._sync(entry, contents)
+                try:
+                    yield entry["dir"]
+                finally:
+                    entry["bytes"] = _dir_size(entry["dir"])
+        finally:
+            with self._lock:
+                entry["users"] -= 1
+            self._evict()
+
+    @staticmethod
+    def _key(contents: Dict[str, str]) -> str:
+        """Workspace key: the file paths plus the content of the chart definitions."""
+        digest = hashlib.sha256()
+        for path in sorted(contents):
+            digest.update(path.encode() + b"\0")
+            if os.path.basename(path) in CHART_DEFINITION_FILES:
+                digest.update(contents[path].encode() + b"\0")
+        return digest.hexdigest()[:32]
+
+    def _sync(self, entry: Dict[str, Any], contents: Dict[str, str]) -> None:
+        """Write the files whose content differs from what is on disk."""
+        os.makedirs(entry["dir"], exist_ok=True)
+        written = 0
+        for path, content in contents.items():
+            full_path = os.path.join(entry["dir"], path)
+            digest = hashlib.sha256(content.encode()).hexdigest()
+            known = entry["files"].get(path)
+            try:
+                stat = os.stat(full_path)
+                unchanged = known == (digest, stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                unchanged = False
+            if unchanged:
+                continue
+            logger.info("Creating file: %s", path)
+            os.makedirs(os.path.dirname(full_path) or entry["dir"], exist_ok=True)
+            with open(full_path, "w") as f:
+                f.write(content)
+            stat = os.stat(full_path)
+            entry["files"][path] = (digest, stat.st_mtime_ns, stat.st_size)
+            written += 1
+        logger.info("Helm workspace %s: wrote %d of %d files", entry["dir"], written, len(contents))
+
+    def _evict(self) -> None:
+        with self._lock:
+            total = sum(entry["bytes"] for entry in self._entries.values())
+            victims = []
+            for key, entry in list(self._entries.items()):
+                if len(self._entries) <= self.max_workspaces and total <= self.max_bytes:
+                    break
+                if entry["users"]:
+                    continue
+                victims.append(self._entries.pop(key))
+                total -= entry["bytes"]
+        for entry in victims:
+            logger.info("Removing helm workspace: %s", entry["dir"])
+            shutil.rmtree(entry["dir"], ignore_errors=True)
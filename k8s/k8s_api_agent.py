@@ -1,23 +1,44 @@
 #!/usr/bin/env python3
 
 import os
-import subprocess
+import json
+import queue
+import hashlib
+import time
 import requests
 import uuid
 import sys
-from flask import Flask, request, jsonify
-from threading import Lock
+from flask import Flask, Response, request, jsonify
+from threading import Thread
 
 # Add parent directory to Python path for local execution
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common.llm import BedrockLLM
+from common import metrics, tracing
+from common.stream_parser import ToolInputStreamParser
+from command_runner import (run_in_order, is_read_only, run_process, split_command, metric_verb, HELM_TIMEOUT_SECONDS,
+                            TIMEOUT_EXIT_CODE)
+from compaction import compact_messages, token_budget_for
+from output_reducer import OUTPUT_REDUCTION, reduce_command_outputs
+from model_router import route_turn, validate_response, turn_has_command_output, LARGE_MAX_TOKENS
+from common.rate_governor import LLMUnavailableError
+from command_cache import CommandCache, kubeconfig_identity
+from kube_api import KubeApiFastPath
+from cluster_cache import ClusterWatchCache
+from thread_store import ThreadRegistry
+from session_store import create_session_store
+from kubeconfig_registry import KubeconfigRegistry
+from token_ledger import TokenLedger, add_usage, empty_usage
+from fanout import (FanoutError, parse_targets, check_command, scoped_command, sets_namespace, merge_results,
+                    FANOUT_CONCURRENCY, FANOUT_MAX_COMMANDS)
+from helm_workspace import HelmWorkspaceCache
 import logging
 import os
 import tempfile
-import subprocess
 import shutil
-from typing import Dict, Any
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
 
 logging.basicConfig(
     level=os.getenv("LOG_LEVEL", "INFO"),
@@ -37,57 +58,130 @@ PORT = 5002  # Changed to port 5002
 # Initialize a single BedrockLLM client for reuse across requests
 bedrock_llm = BedrockLLM(region_name=os.getenv("AWS_REGION", "us-east-1"))
 
-# Thread storage - in a production app, this would be a database
-conversation_threads = {}
-thread_locks = {}
-user_configs = {}  # Store user-specific configurations (kubeconfig, API tokens)
+# Prometheus metrics served at /api/metrics
+SEND_MESSAGE_SECONDS = metrics.histogram("k8sagent_send_message_seconds", "End-to-end latency of sendMessage requests", ["endpoint"])
+THREAD_LOCK_WAIT_SECONDS = metrics.histogram("k8sagent_thread_lock_wait_seconds", "Time requests waited for their thread's lock")
+HISTORY_REBUILD_SECONDS = metrics.histogram("k8sagent_history_rebuild_seconds", "Time spent rebuilding thread history from pastMessages")
+INVOKE_LLM_SECONDS = metrics.histogram("k8sagent_invoke_llm_seconds", "Latency of invoke_llm calls, including reduction, compaction and escalation", ["turn"])
+COMMAND_SECONDS = metrics.histogram("k8sagent_command_seconds", "Latency of kubectl commands and Helm operations", ["verb"])
+COMMANDS = metrics.counter("k8sagent_commands_total", "kubectl commands and Helm operations run", ["verb", "status"])
+metrics.callback("k8sagent_bedrock_concurrency_limit", "Current adaptive limit on concurrent Bedrock calls", lambda: bedrock_llm.stats()["limit"])
+metrics.callback("k8sagent_bedrock_in_flight", "Bedrock calls in progress", lambda: bedrock_llm.stats()["in_flight"])
+metrics.callback("k8sagent_bedrock_throttles_total", "Throttling responses from Bedrock", lambda: bedrock_llm.stats()["throttles"], type="counter")
+metrics.callback("k8sagent_bedrock_retries_total", "Retried Bedrock calls", lambda: bedrock_llm.stats()["retries"], type="counter")
+metrics.callback("k8sagent_bedrock_rejected_total", "Bedrock calls rejected by the circuit breaker or deadline", lambda: bedrock_llm.stats()["rejected"], type="counter")
+
+# Mark the system prompt, tool schema and conversation prefix as cacheable on Bedrock
+PROMPT_CACHING = os.getenv("BEDROCK_PROMPT_CACHING", "true").lower() == "true"
+
+# Cache of recent read-only kubectl output, shared by all threads
+command_cache = CommandCache()
+
+# Pooled Kubernetes API clients used instead of the kubectl binary for common read verbs
+kube_api = KubeApiFastPath()
+
+# Optional informer-style cache answering common `kubectl get` commands from memory
+cluster_cache = ClusterWatchCache(kube_api)
+
+# Thread storage: conversation history, user-specific configuration (kubeconfig) and per-thread locks
+session_store = create_session_store()
+
+# Token usage per thread and per kubeconfig identity, and the budgets on it
+token_ledger = TokenLedger(session_store)
 
 # Fallback token storage - this is a temporary fix
 thread_tokens = {}
 
+def release_cluster(kubeconfig_path):
+    """Drop pooled API clients and informers for a kubeconfig no thread uses anymore."""
+    kube_api.forget(kubeconfig_path)
+    cluster_cache.forget(kubeconfig_path)
+
+# Chart working directories reused across Helm operations
+helm_workspaces = HelmWorkspaceCache()
+
+# Kubeconfig files shared by all threads sending the same kubeconfig
+kubeconfig_registry = KubeconfigRegistry(on_unused=release_cluster)
+
 # Debug flag
 DEBUG = True
 
-def debug_print(*args, **kwargs):
-    """Log debug messages using the logger"""
-    message = ' '.join(str(arg) for arg in args)
-    logger.debug(message)
+# Static prompt and tool schema, built once and reused for every request so the
+# request prefix stays byte-identical and can be served from the prompt cache
+DUPLOCLOUD_CONCEPTS_CONTEXT = """
+## What “service” means here
+• **DuploCloud Service** = one micro-service you declared in the DuploCloud UI.  
+  ↳ DuploCloud materialises it as **one Kubernetes Deployment (or StatefulSet)** plus its Pods, HPA, ConfigMaps, etc.  
+  ↳ The Deployment/Pods carry the label **app=<service-name>**.
 
-def run_command(cmd, kubeconfig_path=None):
-    """Run a shell command and return output, error, and exit code.
-    If kubeconfig_path is provided, set KUBECONFIG env var for the command."""
-    logger.info(f"Running command: {cmd} with kubeconfig_path: {kubeconfig_path}")
-    try:
-        env = os.environ.copy()
-        if kubeconfig_path:
-            env['KUBECONFIG'] = kubeconfig_path
-            
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, env=env)
-        logger.debug(f"Command output: {result.stdout.strip()}")
-        logger.debug(f"Command error: {result.stderr.strip()}")
-        logger.debug(f"Command return code: {result.returncode}")
-        return result.stdout.strip(), result.stderr.strip(), result.returncode
-    except Exception as e:
-        return '', str(e), 1
+• **It is *not* a Kubernetes `Service` object.**  
+  – A K8s `Service` is just the ClusterIP/LoadBalancer front-end DuploCloud creates for traffic.  
+  – When a user says “cart service”, they almost always mean the *workload* (Deployment & Pods) called **cart**, not that K8s `Service` resource.
 
-def check_kubectl_access(kubeconfig_path=None):
-    """Check if kubectl is accessible and cluster is reachable."""
-    out, err, code = run_command('kubectl version', kubeconfig_path)
-    if code != 0:
-        return False, "kubectl is not installed or not in PATH."
-    if 'Server Version' not in out:
-        return False, "kubectl is installed, but cannot connect to the cluster."
-    return True, "Connected to Kubernetes cluster successfully!"
+## How agents should translate a DuploCloud Service name
 
-def invoke_llm(messages, system_prompt, api_key=None, thread_id=None):
-    """Call Anthropic Claude via AWS Bedrock using BedrockLLM.
-    The original signature is preserved; api_key/thread_id are retained for
-    backward compatibility but ignored by the Bedrock path."""
-    # Delegate to BedrockLLM; pass system_prompt explicitly instead of
-    # injecting it into the messages list (BedrockLLM handles this).
-    debug_print("Invoking Claude 3 Haiku through Bedrock …")
+| Context               | What to filter on                           | Example for “cart” |
+|-----------------------|---------------------------------------------|--------------------|
+| **kubectl / k8s**     | `deployment/cart` **or** `-l app=cart`      | `kubectl logs -n <ns> -l app=cart --tail=100` |
+| **LogQL (Loki)**      | `namespace="<ns>"` and container regex      | `{namespace="duploservices-demo", container=~".*cart.*"}` |
+| **TraceQL (Tempo)**   | `resource.k8s.namespace.name="<ns>"` **&&** `resource.service.name="cart"` | `{resource.k8s.namespace.name="duploservices-demo" && resource.service.name="cart"}` |
+
+### Key takeaway
+Whenever a user mentions “<name> service” inside DuploCloud, interpret it as **the Deployment/StatefulSet and its Pods labeled `app=<name>`**, *not* the Kubernetes `Service` resource.
+"""
+# System prompt that guides Claude's behavior
+SYSTEM_PROMPT = """
+You are a seasoned Kubernetes and Helm expert agent for DuploCloud. Your role is to help users manage, troubleshoot, and deploy applications using kubectl commands and Helm in a less wordy manner.
+
+---------------------------
+DuploCloud Concepts Context:
+""" + DUPLOCLOUD_CONCEPTS_CONTEXT + """
+---------------------------
+
+## Expertise Areas
+- Kubernetes resource management and troubleshooting
+- Helm chart creation and deployment
+- Docker Compose to Helm chart conversion
+- DuploCloud-specific Kubernetes configurations
+
+## Response Format
+Always use the `return_final_response` tool for every response with these fields:
+
+- `content`: Clear, educational explanation of your solution
+- `kubectl_cmds`: Array of kubectl commands when applicable
+- `helm_operations`: Helm commands with their required files when applicable
+
+## Kubectl Command Guidelines
+- Be specific about namespaces
+- Choose efficient commands to diagnose or solve problems
+- Consider cluster impact and resource constraints
+- Format commands properly with appropriate flags
 
-    return_final_response_tool_input_schema = {
+## Helm Operation Guidelines
+- If a user asks to convert a Docker Compose file to a Helm chart, ask the user for the name to use for the helm chart
+- Follow Helm best practices for chart structure
+- Use values.yaml for configurable elements
+- Include proper labels and annotations
+- Create reusable and maintainable templates
+
+## Docker Compose Conversion Guidelines
+When converting Docker Compose to Helm:
+1. Map services to appropriate Kubernetes resources
+2. Convert volumes to PersistentVolumeClaims
+3. Handle networking through Services and Ingresses
+4. Create a complete chart structure with all necessary files
+5. Remember that users will approve commands before execution, and files for Helm operations will be created temporarily and removed after command execution.
+
+## Conversation Approach
+- Be concise and to the point
+- Maintain context from previous interactions
+- Reference command outputs shared by the user
+- Explain the reasoning behind your suggestions
+- Do not execute the same command again and again for no reason
+- Ask clarifying questions when needed
+"""
+
+RETURN_FINAL_RESPONSE_TOOL = {
   "name": "return_final_response",
   "description": "Generate a complete response containing both a user-friendly explanation and structured Kubernetes/Helm commands with any necessary file contents. Use this tool for ALL responses to user queries.",
   "input_schema": {
@@ -140,34 +234,151 @@ def invoke_llm(messages, system_prompt, api_key=None, thread_id=None):
     "required": ["content"]
   }
 }
-    tool_choice = {
-            "type": "tool",
-            "name": "return_final_response"
-        }
 
+RETURN_FINAL_RESPONSE_TOOL_CHOICE = {
+    "type": "tool",
+    "name": "return_final_response"
+}
+
+# Prepended to the current user message on every LLM call, without being stored in the thread
+EPHEMERAL_INSTRUCTIONS = "Current Request Ephemeral Instructions: - If the user asks to convert a docker compose into a helm chart, ask for the name of the helm chart and confirm with the user.\n- Be less wordy and to the point."
+
+
+def debug_print(*args, **kwargs):
+    """Log debug messages using the logger"""
+    message = ' '.join(str(arg) for arg in args)
+    logger.debug(message)
+
+def run_command(cmd, kubeconfig_path=None, cache_status=None, shell=True):
+    """Run a shell command and return output, error, and exit code.
+    If kubeconfig_path is provided, set KUBECONFIG env var for the command.
+    With shell=False the command is split into arguments and run without a shell.
+    Read-only kubectl commands are answered from the watch cache or a short-lived
+    output cache when possible; if cache_status is a dict, it is filled with whether
+    the output came from a cache ("hit") and how old it is in seconds ("age")."""
+    verb = metric_verb(cmd)
+    with COMMAND_SECONDS.time(verb=verb), tracing.span("run_command", command=cmd, verb=verb) as span:
+        output = _run_command(cmd, kubeconfig_path, cache_status, shell)
+        span.set_attribute("exit_code", output[2])
+        if cache_status is not None:
+            span.set_attribute("cached", bool(cache_status.get("hit")))
+    COMMANDS.inc(verb=verb, status="ok" if output[2] == 0 else "error")
+    return output
+
+def _run_command(cmd, kubeconfig_path=None, cache_status=None, shell=True):
+    cached = cluster_cache.query(cmd, kubeconfig_path) or command_cache.get(cmd, kubeconfig_path)
+    if cache_status is not None:
+        cache_status["hit"] = cached is not None
+    if cached is not None:
+        result, age = cached
+        logger.info(f"Using cached output ({age:.1f}s old) for command: {cmd}")
+        if cache_status is not None:
+            cache_status["age"] = age
+        return result
+
+    # Common read-only commands are served directly by the Kubernetes API when possible
+    output = kube_api.run(cmd, kubeconfig_path)
+    if output is not None:
+        command_cache.put(cmd, kubeconfig_path, output)
+        return output
+
+    logger.info(f"Running command: {cmd} with kubeconfig_path: {kubeconfig_path}")
+    try:
+        env = os.environ.copy()
+        if kubeconfig_path:
+            env['KUBECONFIG'] = kubeconfig_path
+            
+        # Bounded by KUBECTL_COMMAND_TIMEOUT_SECONDS and COMMAND_MAX_OUTPUT_BYTES
+        result = run_process(cmd if shell else split_command(cmd), env=env)
+        logger.debug(f"Command output: {result.stdout.strip()}")
+        logger.debug(f"Command error: {result.stderr.strip()}")
+        logger.debug(f"Command return code: {result.returncode}")
+        output = (result.stdout.strip(), result.stderr.strip(), result.returncode)
+        if not result.timed_out:
+            command_cache.put(cmd, kubeconfig_path, output)
+        command_cache.invalidate_for(cmd, kubeconfig_path)
+        return output
+    except Exception as e:
+        return '', str(e), 1
+
+def run_kubectl_command(cmd, kubeconfig_path=None, shell=True):
+    """Run a kubectl command and return its output (or the error text if it failed)
+    together with its cache status. A command that timed out returns what it printed
+    before it was stopped, followed by the timeout notice."""
+    cache_status = {}
+    out, err, code = run_command(cmd, kubeconfig_path, cache_status, shell)
+    if code == 0:
+        return out, cache_status
+    if code == TIMEOUT_EXIT_CODE and out:
+        return f"{out}\n\nError: {err}", cache_status
+    return f"Error: {err}", cache_status
+
+def annotate_cache_status(cmd_obj, cache_status):
+    """Record on an executed command object whether its output was served from the cache."""
+    cmd_obj['Cached'] = bool(cache_status.get('hit'))
+    if cmd_obj['Cached']:
+        cmd_obj['CacheAgeSeconds'] = round(cache_status['age'], 1)
+
+def check_kubectl_access(kubeconfig_path=None):
+    """Check if kubectl is accessible and cluster is reachable."""
+    out, err, code = run_command('kubectl version', kubeconfig_path)
+    if code != 0:
+        return False, "kubectl is not installed or not in PATH."
+    if 'Server Version' not in out:
+        return False, "kubectl is installed, but cannot connect to the cluster."
+    return True, "Connected to Kubernetes cluster successfully!"
+
+def invoke_llm(messages, system_prompt, api_key=None, thread_id=None, on_event=None, usage=None, reduce_outputs=OUTPUT_REDUCTION,
+               identities=None):
+    """Call Anthropic Claude via AWS Bedrock using BedrockLLM.
+    The original signature is preserved; api_key is retained for backward
+    compatibility but ignored by the Bedrock path. The usage of each call is
+    recorded for thread_id (see token_ledger), and charged to the kubeconfig
+    identities given in identities instead of the thread's, if any.
+    If on_event is provided, the response is streamed and partial content and
+    suggested commands are reported through on_event(event, payload).
+    If usage is provided, the token counts of the calls are added to it, along
+    with the totals of the thread and its kubeconfig.
+    If reduce_outputs is true, kubectl outputs in the conversation are reduced
+    (healthy rows grouped, noisy fields dropped) in the copy sent to the model.
+    With MODEL_ROUTING enabled, cheap turns go to the small model first and are
+    asked again on the default model if the response fails validation; a
+    streamed call then starts over with a new message_start event."""
+    # Delegate to BedrockLLM; pass system_prompt explicitly instead of
+    # injecting it into the messages list (BedrockLLM handles this).
+    debug_print("Invoking Claude 3 Haiku through Bedrock …")
 
     # try:
     if True:
-        # add ephemeral extra instructions to last message if it's from the user
-        if messages[-1]["role"] == "user":
-            messages[-1]["content"] = "Current Request Ephemeral Instructions: - If the user asks to convert a docker compose into a helm chart, ask for the name of the helm chart and confirm with the user.\n- Be less wordy and to the point." + "\n\n" + messages[-1]["content"]
-
-        # model_id="anthropic.claude-3-haiku-20240307-v1:0"
-        # model_id="anthropic.claude-3-5-haiku-20241022-v1:0"
-        # model_id="anthropic.claude-3-5-sonnet-20240620-v1:0"
-        model_id=os.getenv("BEDROCK_MODEL_ID", "us.anthropic.claude-3-5-sonnet-20240620-v1:0")
-        # model_id = os.getenv("BEDROCK_MODEL_ID", "us.anthropic.claude-3-7-sonnet-20250219-v1:0")
-
-        llm_response = bedrock_llm.invoke(
-            model_id=model_id,
-            messages=bedrock_llm.normalize_message_roles(messages),
-            max_tokens=10000,
-            system_prompt=system_prompt,
-            tools=[return_final_response_tool_input_schema],
-            tool_choice=tool_choice,
-            # latency="optimized"
-        )
+        start_time = time.perf_counter()
+        # Small model and output budget for cheap turns, the default model otherwise
+        route = route_turn(messages)
+        # Outputs of commands just run describe the cluster right now; never answer them from the response cache
+        use_cache = not turn_has_command_output(messages)
+
+        # add ephemeral extra instructions to last message if it's from the user; the thread's own messages are left as they are
+        if messages and messages[-1]["role"] == "user" and isinstance(messages[-1]["content"], str):
+            messages = messages[:-1] + [{**messages[-1], "content": EPHEMERAL_INSTRUCTIONS + "\n\n" + messages[-1]["content"]}]
+
+        if reduce_outputs:
+            messages = reduce_command_outputs(messages)
+
+        if route.escalate_to:
+            try:
+                llm_response = call_model(messages, system_prompt, route.model_id, route.max_tokens, on_event, usage, use_cache, thread_id, identities)
+                problem = validate_response(llm_response, bedrock_llm.last_stop_reason())
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                # e.g. a tool input cut off mid-JSON, or the small model not being enabled in the account
+                problem = f"call failed: {e}"
+            if problem:
+                logger.warning(f"Escalating {route.turn} turn from {route.model_id} to {route.escalate_to}: {problem}")
+                llm_response = call_model(messages, system_prompt, route.escalate_to, LARGE_MAX_TOKENS, on_event, usage, use_cache, thread_id, identities)
+        else:
+            llm_response = call_model(messages, system_prompt, route.model_id, route.max_tokens, on_event, usage, use_cache, thread_id, identities)
 
+        INVOKE_LLM_SECONDS.observe(time.perf_counter() - start_time, turn=route.turn)
         logger.info("LLM Response: %s", llm_response)
         return llm_response
 
@@ -175,6 +386,67 @@ def invoke_llm(messages, system_prompt, api_key=None, thread_id=None):
     #     logger.error("LLM Invoke Error: %s", str(e))
     #     return f"Unable to invoke LLM right now. Please try again later."
 
+def call_model(messages, system_prompt, model_id, max_tokens, on_event=None, usage=None, use_cache=True, thread_id=None, identities=None):
+    """Make one LLM call for invoke_llm on the given model, with the history compacted to its budget
+    (a smaller one for threads past their soft token budget).
+    Calls answered from the response cache are counted in usage["response_cache_hits"]."""
+    # model_id="anthropic.claude-3-haiku-20240307-v1:0"
+    # model_id="anthropic.claude-3-5-haiku-20241022-v1:0"
+    # model_id="anthropic.claude-3-5-sonnet-20240620-v1:0"
+    # model_id = os.getenv("BEDROCK_MODEL_ID", "us.anthropic.claude-3-7-sonnet-20250219-v1:0")
+
+    # Fit the history into the model's token budget; the thread itself keeps everything
+    messages = compact_messages(messages, token_ledger.context_budget(thread_id, token_budget_for(model_id)))
+
+    llm_kwargs = dict(
+        model_id=model_id,
+        messages=messages,  # BedrockLLM merges consecutive same-role messages
+        max_tokens=max_tokens,
+        system_prompt=system_prompt,
+        tools=[RETURN_FINAL_RESPONSE_TOOL],
+        tool_choice=RETURN_FINAL_RESPONSE_TOOL_CHOICE,
+        prompt_caching=PROMPT_CACHING,
+        use_cache=use_cache,
+        # latency="optimized"
+    )
+
+    with tracing.span("llm_call", model=model_id, max_tokens=max_tokens, streaming=bool(on_event)) as span:
+        if on_event:
+            llm_response, call_usage = stream_llm_response(llm_kwargs, on_event)
+        else:
+            llm_response, call_usage = bedrock_llm.invoke(**llm_kwargs, return_usage=True)
+        for key in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+            span.set_attribute(key, call_usage.get(key))
+        span.set_attribute("stop_reason", bedrock_llm.last_stop_reason())
+        span.set_attribute("response_cache_hit", call_usage.get("response_cache_hit"))
+
+    token_ledger.record(thread_id, call_usage, identities)
+    if usage is not None:
+        add_usage(usage, call_usage)
+        if thread_id:
+            usage.update(token_ledger.usage(thread_id))
+    return llm_response
+
+def stream_llm_response(llm_kwargs, on_event):
+    """Stream a tool-use response from Bedrock, reporting partial output through on_event.
+    Returns the complete tool input and the call's usage once the stream ends."""
+    parser = ToolInputStreamParser()
+    llm_response, call_usage = {}, {}
+    on_event("message_start", {})
+    for event in bedrock_llm.invoke_stream(**llm_kwargs):
+        if event["type"] == "input_json_delta":
+            for parsed in parser.feed(event["partial_json"]):
+                if parsed["type"] == "string_delta" and parsed["key"] == "content":
+                    on_event("content", {"text": parsed["text"]})
+                elif parsed["type"] == "item" and parsed["key"] == "kubectl_cmds":
+                    on_event("kubectl_cmd", {"Command": parsed["value"], "Output": "", "execute": False})
+                elif parsed["type"] == "item" and parsed["key"] == "helm_operations":
+                    helm_operation = parsed["value"]
+                    on_event("helm_operation", {"Command": helm_operation.get("helm_command", ""), "Output": "", "execute": False, "files": helm_operation.get("required_files", [])})
+        elif event["type"] == "final":
+            llm_response, call_usage = event["response"], event["usage"]
+    return llm_response, call_usage
+
 def extract_kubectl_commands(llm_response):
     """Extract kubectl commands from Claude's response and format as objects with Command and Output fields"""
     logger.debug(f"Extracting kubectl commands from LLM response: {llm_response}")
@@ -200,60 +472,47 @@ def extract_kubectl_commands(llm_response):
     
     return k8s_cmd_objects + helm_operation_cmd_objects
 
-def execute_helm_operation(helm_op: Dict[Any, Any]) -> str:
+def execute_helm_operation(helm_op: Dict[Any, Any], kubeconfig_path: Optional[str] = None) -> str:
     """
-    Execute a Helm operation by creating temporary files and running the Helm command. With info logging.
+    Execute a Helm operation by writing its files to a cached workspace and running the Helm command. With info logging.
     
     Args:
         helm_op: A dictionary containing the Helm command and required files
+        kubeconfig_path: Kubeconfig of the cluster to operate on, if not the default one
     
     Returns:
         The output of the Helm command as a string, including errors and return code
     """
-    # Create a temporary directory
-    temp_dir = tempfile.mkdtemp(prefix="helm_op_")
-    
     try:
+        start_time = time.perf_counter()
         logger.info("Executing Helm operation with command: %s", helm_op.get("Command", ""))
-        # Create all required files
-        for file_info in helm_op.get("files", []):
-            # Get file path and content
-            file_path = file_info.get("file_path")
-            file_content = file_info.get("file_content")
-            
-            if not file_path or file_content is None:
-                continue
-                
-            logger.info("Creating file: %s", file_path)
-            # Create full path within the temp directory
-            full_path = os.path.join(temp_dir, file_path)
-                
-            # Create directory structure if it doesn't exist
-            dir_path = os.path.dirname(full_path)
-            if dir_path and not os.path.exists(dir_path):
-                os.makedirs(dir_path)
-                
-            # Write the file
-            with open(full_path, 'w') as f:
-                f.write(file_content)
-        
         # Execute the Helm command
         command = helm_op.get("Command", "")
         if not command:
             return "Error: No Helm command provided"
-            
-        logger.info("Executing Helm command: %s", command)
-        # Execute the command and capture output
-        # Using cwd parameter instead of changing the current directory
-        result = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            cwd=temp_dir,  # Run command in the temp directory without changing process cwd
-            env=os.environ  # This ensures environment variables like $AWS_ACCESS_KEY_ID are available
-        )
+
+        # Check out a workspace with the chart files; unchanged files from earlier runs are not rewritten
+        with tracing.span("helm_operation", command=command) as span, \
+                helm_workspaces.workspace(helm_op.get("files", [])) as workspace_dir:
+            logger.info("Executing Helm command: %s", command)
+            env = helm_workspaces.helm_env()  # Environment variables like $AWS_ACCESS_KEY_ID plus the shared Helm cache
+            if kubeconfig_path:
+                env['KUBECONFIG'] = kubeconfig_path
+            # Execute the command and capture output
+            # Using cwd parameter instead of changing the current directory
+            result = run_process(
+                command,
+                cwd=workspace_dir,  # Run command in the workspace without changing process cwd
+                env=env,
+                timeout=HELM_TIMEOUT_SECONDS
+            )
+            span.set_attribute("exit_code", result.returncode)
+        COMMAND_SECONDS.observe(time.perf_counter() - start_time, verb=metric_verb(command))
+        COMMANDS.inc(verb=metric_verb(command), status="ok" if result.returncode == 0 else "error")
         
+        # Helm releases change cluster state, so cached kubectl output may be stale
+        command_cache.invalidate(kubeconfig_path)
+
         # Build a comprehensive output string
         output_parts = []
         if result.stdout:
@@ -278,11 +537,6 @@ def execute_helm_operation(helm_op: Dict[Any, Any]) -> str:
         error_msg = str(e)
         logger.error("Error executing Helm command: %s", error_msg)
         return f"Exception occurred while executing command: {error_msg}"
-        
-    finally:
-        # Clean up the temporary directory  
-        logger.info("Cleaning up temporary directory: %s", temp_dir)
-        # shutil.rmtree(temp_dir, ignore_errors=True)
 
 
 def setup_kubeconfig(kubeconfig_base64, thread_id):
@@ -290,70 +544,70 @@ def setup_kubeconfig(kubeconfig_base64, thread_id):
     logger.info(f"Setting up kubeconfig for thread: {thread_id}")
     if not kubeconfig_base64:
         return None
+    # Threads sending the same kubeconfig share one file; unchanged content is not rewritten
+    kubeconfig_path = kubeconfig_registry.register(thread_id, kubeconfig_base64)
+    logger.info(f"Kubeconfig path: {kubeconfig_path}")
+    return kubeconfig_path
+
+def evict_thread(thread_id):
+    """Release a thread's conversation, config and kubeconfig.
+
+    Returns False without evicting if a request is currently using the thread."""
+    lock = session_store.lock(thread_id)
+    if not lock.acquire(blocking=False):
+        return False
     try:
-        # Add padding if necessary
-        import base64            
-        # Decode the base64 kubeconfig
-        kubeconfig_content = base64.b64decode(kubeconfig_base64).decode('utf-8')
-        
-        # Create a temporary directory for this thread if it doesn't exist
-        temp_dir = os.path.join('/tmp', 'k8sagent', thread_id)
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Write the kubeconfig to a file
-        kubeconfig_path = os.path.join(temp_dir, 'kubeconfig')
-        logger.info(f"Kubeconfig path: {kubeconfig_path}")
-        with open(kubeconfig_path, 'w') as f:
-            f.write(kubeconfig_content)
-        
-        # Make sure only the user can read it
-        os.chmod(kubeconfig_path, 0o600)
-        
-        return kubeconfig_path
-    except Exception as e:
-        logger.error(f"Error setting up kubeconfig: {e}")
-        return None
+        session_store.unload(thread_id)
+        thread_tokens.pop(thread_id, None)
+        # Releases the cluster's clients if no other thread in this process uses it
+        kubeconfig_registry.release(thread_id)
+    finally:
+        lock.release()
+    return True
+
+# Bounds the number of live threads and evicts idle ones
+thread_registry = ThreadRegistry(evict_thread)
+metrics.callback("k8sagent_live_threads", "Conversation threads held in memory", lambda: thread_registry.stats()["live_threads"])
+metrics.callback("k8sagent_thread_evictions_total", "Conversation threads evicted from memory", lambda: thread_registry.stats()["evictions"], type="counter")
 
 def get_or_create_thread(thread_id=None, kubeconfig_base64=None):
     """Get an existing thread or create a new one with optional user-specific config"""
     logger.info(f"Getting or creating thread with ID: {thread_id}")
-    global conversation_threads, thread_locks, user_configs, thread_tokens
+    global thread_tokens
 
     logger.info(f"Getting or creating thread: {thread_id}")
     
     # Print debug info about the current state
     debug_print(f"Current thread_id: {thread_id}")
-    debug_print(f"Available threads: {list(conversation_threads.keys())}")
-    debug_print(f"Available configs: {list(user_configs.keys())}")
+    debug_print(f"Loaded threads: {session_store.thread_ids()}")
     
-    # If thread_id is provided and valid, use it
-    if thread_id and thread_id in conversation_threads:
+    # If thread_id is provided and valid, use it (loading it from the store if needed)
+    if thread_id and session_store.exists(thread_id):
         debug_print(f"Using existing thread: {thread_id}")
-        
-        # Make sure user_configs exists for this thread
-        if thread_id not in user_configs:
-            debug_print(f"Creating new user_config for existing thread: {thread_id}")
-            user_configs[thread_id] = {}
-        else:
-            debug_print(f"Existing user_config found for thread: {thread_id}")
-            debug_print(f"Current config: {user_configs[thread_id]}")
+        debug_print(f"Current kubeconfig path: {session_store.config(thread_id).get('kubeconfig_path')}")
         
         # Update user config if new values are provided
         if kubeconfig_base64:
             logger.info(f"Updating kubeconfig for thread: {thread_id}")
             kubeconfig_path = setup_kubeconfig(kubeconfig_base64, thread_id)
-            user_configs[thread_id]['kubeconfig_path'] = kubeconfig_path
+            if kubeconfig_path != session_store.config(thread_id).get('kubeconfig_path'):
+                # The content is kept so the file can be written again wherever the thread is loaded
+                session_store.update_config(thread_id, kubeconfig_path=kubeconfig_path,
+                                            kubeconfig=kubeconfig_base64 if kubeconfig_path else None)
+        else:
+            # The thread may have been loaded from the session store, possibly without its kubeconfig file
+            thread_config = session_store.config(thread_id)
+            kubeconfig_registry.track(thread_id, thread_config.get('kubeconfig_path'), thread_config.get('kubeconfig'))
             
         # Don't overwrite existing values if not provided
         # This ensures we keep using the previously provided token
         
+        thread_registry.touch(thread_id)
         return thread_id
     
     # If thread_id is provided but doesn't exist yet, use it to create a new thread
     new_thread_id = thread_id if thread_id else str(uuid.uuid4())
     logger.info(f"Creating new thread: {new_thread_id}")
-    conversation_threads[new_thread_id] = []
-    thread_locks[new_thread_id] = Lock()
     
     # Set up user-specific configuration
     kubeconfig_path = None
@@ -361,34 +615,213 @@ def get_or_create_thread(thread_id=None, kubeconfig_base64=None):
         logger.info(f"Setting up kubeconfig for new thread: {new_thread_id}")
         kubeconfig_path = setup_kubeconfig(kubeconfig_base64, new_thread_id)
         
-    # Store user configuration
-    user_configs[new_thread_id] = {
-        'kubeconfig_path': kubeconfig_path
-    }
-        
-    debug_print(f"Created new user config for thread {new_thread_id}: {user_configs[new_thread_id]}")
     debug_print(f"Thread tokens: {thread_tokens}")
     
-    # Get cluster context for better troubleshooting
-    context_out, _, _ = run_command('kubectl config current-context', kubeconfig_path)
+    # Get cluster context for better troubleshooting (read from the kubeconfig, cached)
+    context_out = kubeconfig_registry.current_context(kubeconfig_path)
     
-    # Add initial context message
-    conversation_threads[new_thread_id].append({
+    # Store the thread with its user configuration and initial context message
+    session_store.create(new_thread_id, {
+        'kubeconfig_path': kubeconfig_path,
+        'kubeconfig': kubeconfig_base64 if kubeconfig_path else None,
+    }, [{
         "role": "user", 
         "content": f"I'm troubleshooting a Kubernetes cluster with context: {context_out}. I'll ask you questions about troubleshooting this cluster."
-    })
+    }])
+    debug_print(f"Created new user config for thread {new_thread_id} with kubeconfig path: {kubeconfig_path}")
     
+    thread_registry.touch(new_thread_id)
     return new_thread_id
 
+def request_trace():
+    """Trace ID and remote parent span for a request: continues a W3C traceparent header if sent, else a new trace."""
+    return tracing.parse_traceparent(request.headers.get('traceparent')) or (tracing.new_trace_id(), None)
+
+@app.errorhandler(LLMUnavailableError)
+def llm_unavailable(e):
+    """Bedrock is throttling or failing: tell the client when to retry instead of returning a 500."""
+    logger.error(f"LLM unavailable: {e}")
+    retry_after = max(1, round(e.retry_after))
+    return jsonify({"error": "The AI service is busy right now. Please try again shortly.",
+                    "retry_after": retry_after}), 503, {"Retry-After": str(retry_after)}
+
 @app.route('/api/sendMessage', methods=['POST'])
 def send_message():
     """API endpoint to send a message to the agent"""
     data = request.json
+    trace_id, parent_id = request_trace()
+    with SEND_MESSAGE_SECONDS.time(endpoint="sendMessage"), \
+            tracing.span("send_message", trace_id, parent_id, tracing.SPAN_KIND_SERVER, endpoint="sendMessage"):
+        response, status = process_message(data)
+    return jsonify(response), status, {"X-Trace-Id": trace_id}
+
+@app.route('/api/sendMessage/stream', methods=['POST'])
+def send_message_stream():
+    """API endpoint to send a message to the agent and stream the reply as server-sent events.
+
+    Emits `message_start` at the start of each LLM call, `content` events with partial
+    response text, `kubectl_cmd` and `helm_operation` events as each suggested command
+    is fully parsed, and finally a `final` event whose data is exactly the JSON body
+    `/api/sendMessage` would have returned (or an `error` event).
+    """
+    data = request.json
+    if not data or 'content' not in data:
+        return jsonify({"error": "Missing 'content' field in request body"}), 400
+
+    events = queue.Queue()
+    trace_id, parent_id = request_trace()
+
+    def on_event(event, payload):
+        events.put((event, payload))
+
+    def worker():
+        try:
+            with SEND_MESSAGE_SECONDS.time(endpoint="sendMessage/stream"), \
+                    tracing.span("send_message", trace_id, parent_id, tracing.SPAN_KIND_SERVER, endpoint="sendMessage/stream"):
+                response, status = process_message(data, on_event=on_event)
+            events.put(("final" if status == 200 else "error", response))
+        except LLMUnavailableError as e:
+            logger.error(f"LLM unavailable: {e}")
+            events.put(("error", {"error": "The AI service is busy right now. Please try again shortly.",
+                                  "retry_after": max(1, round(e.retry_after))}))
+        except Exception as e:
+            logger.exception("Error processing streamed message")
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+
+    Thread(target=worker, daemon=True).start()
+
+    def generate():
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            event, payload = item
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'X-Trace-Id': trace_id,
+    })
 
+def build_history(past_messages):
+    """Convert client-provided pastMessages pairs into conversation messages."""
+    history = []
+    
+    # Process each message pair in pastMessages
+    for msg_pair in past_messages:
+        if 'userMsg' in msg_pair and 'content' in msg_pair['userMsg']:
+            # Add user message to conversation
+            history.append({
+                "role": "user",
+                "content": msg_pair['userMsg']['content']
+            })
+
+        # Process executed commands from the data field in userMsg
+        if 'userMsg' in msg_pair and 'data' in msg_pair['userMsg'] and isinstance(msg_pair['userMsg']['data'], dict):
+            msg_data = msg_pair['userMsg']['data']
+            if 'executedCmds' in msg_data and isinstance(msg_data['executedCmds'], list):
+                for cmd_obj in msg_data['executedCmds']:
+                    if isinstance(cmd_obj, dict) and 'Command' in cmd_obj and 'Output' in cmd_obj:
+                        cmd = cmd_obj['Command']
+                        command_output = cmd_obj['Output']
+                        if command_output and command_output.strip():
+                            history.append({
+                                "role": "user",
+                                "content": f"I ran this kubectl command: {cmd}\n\nThe output was:\n{command_output}"
+                            })
+
+        # Process rejected commands from the data field in userMsg
+        if 'userMsg' in msg_pair and 'data' in msg_pair['userMsg'] and isinstance(msg_pair['userMsg']['data'], dict):
+            msg_data = msg_pair['userMsg']['data']
+            if 'RejectedCmds' in msg_data and isinstance(msg_data['RejectedCmds'], list) and len(msg_data['RejectedCmds']) > 0:
+                # Add a message about rejected commands
+                history.append({
+                    "role": "user",
+                    "content": "Out of the commands you suggested, the following were rejected by me:"
+                })
+
+                # Add details of each rejected command
+                for idx, rc in enumerate(msg_data['RejectedCmds'], 1):
+                    cmd = rc.get('Command', '[unknown command]')
+                    reason = rc.get('reason', '[no reason provided]')
+                    history.append({
+                        "role": "user",
+                        "content": f"{idx}. Command: {cmd}\nReason: {reason}"
+                    })
+
+        # Process executed commands from the data field in agentResponse
+        if 'agentResponse' in msg_pair and 'data' in msg_pair['agentResponse'] and isinstance(msg_pair['agentResponse']['data'], dict):
+            agent_data = msg_pair['agentResponse']['data']
+            if 'executedCmds' in agent_data and isinstance(agent_data['executedCmds'], list):
+                for cmd_obj in agent_data['executedCmds']:
+                    if isinstance(cmd_obj, dict) and 'Command' in cmd_obj and 'Output' in cmd_obj:
+                        cmd = cmd_obj['Command']
+                        command_output = cmd_obj['Output']
+                        if command_output and command_output.strip():
+                            history.append({
+                                "role": "assistant",
+                                "content": f"I ran this kubectl command with your approval: {cmd}\n\nThe output was:\n{command_output}"
+                            })
+
+        if 'agentResponse' in msg_pair and 'content' in msg_pair['agentResponse']:
+            # Add agent response to conversation
+            history.append({
+                "role": "assistant",
+                "content": msg_pair['agentResponse']['content']
+            })
+
+        # Check for terminal command outputs in nextMsgContext
+        if 'nextMsgContext' in msg_pair and isinstance(msg_pair['nextMsgContext'], list):
+            for context_item in msg_pair['nextMsgContext']:
+                if context_item.get('type') == 'userTerminal' and 'command' in context_item:
+                    cmd = context_item['command'].get('Command', '')
+                    output = context_item['command'].get('Output', '')
+                    if cmd and output:
+                        history.append({
+                            "role": "user",
+                            "content": f"I ran this kubectl command with your approval: {cmd}\n\nThe output was:\n{output}"
+                        })
+
+    return history
+
+def history_version(previous_version, past_messages):
+    """Version of a synced history: a hash chain over the pastMessages pairs applied to it."""
+    version = previous_version or ""
+    for msg_pair in past_messages:
+        pair_json = json.dumps(msg_pair, sort_keys=True, separators=(',', ':'))
+        version = hashlib.sha256(f"{version}\n{pair_json}".encode()).hexdigest()
+    return version
+
+@contextmanager
+def timed_acquire(lock):
+    """Hold a thread lock for a with-block, recording how long it took to get it."""
+    start = time.perf_counter()
+    with tracing.span("thread_lock_wait"):
+        lock.acquire()
+    try:
+        THREAD_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+        yield
+    finally:
+        lock.release()
+
+def process_message(data, on_event=None):
+    """Handle a sendMessage request body and return a (response, status code) tuple.
+
+    If on_event is provided, LLM output is streamed and reported through
+    on_event(event, payload) as it is generated."""
     logger.info(f"Received request data: {data}")
     
     if not data or 'content' not in data:
-        return jsonify({"error": "Missing 'content' field in request body"}), 400
+        return {"error": "Missing 'content' field in request body"}, 400
+
+    # Token counts across all LLM calls made for this request, plus the thread's and its kubeconfig's totals
+    request_usage = empty_usage()
+
+    # Clients can ask for command outputs to reach the LLM unreduced
+    reduce_outputs = OUTPUT_REDUCTION and not data.get('data', {}).get('full_output', False)
 
     k8s_namespace = data.get('platform_context', {}).get('k8s_namespace')
     if not k8s_namespace:
@@ -402,181 +835,67 @@ def send_message():
     # Print the request data for debugging
     debug_print(f"Request thread_id: {data.get('thread_id')}")
     
-    thread_id = get_or_create_thread(
-        data.get('thread_id'),
-        user_data.get('kubeconfig'),  # Base64 encoded kubeconfig
-    )
+    with tracing.span("get_or_create_thread") as span:
+        thread_id = get_or_create_thread(
+            data.get('thread_id'),
+            user_data.get('kubeconfig'),  # Base64 encoded kubeconfig
+        )
+        span.set_attribute("created", thread_id != data.get('thread_id'))
+    tracing.set_trace_attribute("thread_id", thread_id)
     
     # Get thread lock
-    thread_lock = thread_locks[thread_id]
+    thread_lock = session_store.lock(thread_id)
     
-    with thread_lock:  # Ensure thread-safety for conversation history
+    with timed_acquire(thread_lock):  # Ensure thread-safety for conversation history
+        if not session_store.exists(thread_id):
+            # Evicted between lookup and use; start the thread over
+            get_or_create_thread(thread_id, user_data.get('kubeconfig'))
+        # Pick up messages other workers added to this thread
+        session_store.refresh(thread_id)
+
+        over_budget = token_ledger.over_budget(thread_id)
+        if over_budget:
+            logger.warning(f"Refusing message on thread {thread_id}: {over_budget}")
+            return {"error": over_budget, "thread_id": thread_id, "usage": token_ledger.usage(thread_id)}, 429
+
         # If client is providing conversation history via pastmessages, use that instead of internal thread state
 
+        # Version of the client-provided history after this request, returned so the next request can send a delta
+        synced_version = None
+
         # agent_managed_memory = data.get('agent_managed_memory', False)
         agent_managed_memory = False
         if not agent_managed_memory and 'pastMessages' in data and isinstance(data['pastMessages'], list):
         # if 'pastmessages' in data and isinstance(data['pastmessages'], list):
             debug_print("Using client-provided conversation history")
-            # Reset conversation history for this thread
-            conversation_threads[thread_id] = []
-            
-            # Process each message pair in pastMessages
-            for msg_pair in data['pastMessages']:
-                if 'userMsg' in msg_pair and 'content' in msg_pair['userMsg']:
-                    # Add user message to conversation
-                    conversation_threads[thread_id].append({
-                        "role": "user",
-                        "content": msg_pair['userMsg']['content']
-                    })
-                
-                # Process executed commands from the data field in userMsg
-                if 'userMsg' in msg_pair and 'data' in msg_pair['userMsg'] and isinstance(msg_pair['userMsg']['data'], dict):
-                    user_data = msg_pair['userMsg']['data']
-                    if 'executedCmds' in user_data and isinstance(user_data['executedCmds'], list):
-                        for cmd_obj in user_data['executedCmds']:
-                            if isinstance(cmd_obj, dict) and 'Command' in cmd_obj and 'Output' in cmd_obj:
-                                cmd = cmd_obj['Command']
-                                command_output = cmd_obj['Output']
-                                if command_output and command_output.strip():
-                                    conversation_threads[thread_id].append({
-                                        "role": "user",
-                                        "content": f"I ran this kubectl command: {cmd}\n\nThe output was:\n{command_output}"
-                                    })
-
-                # Process rejected commands from the data field in userMsg
-                if 'userMsg' in msg_pair and 'data' in msg_pair['userMsg'] and isinstance(msg_pair['userMsg']['data'], dict):
-                    user_data = msg_pair['userMsg']['data']
-                    if 'RejectedCmds' in user_data and isinstance(user_data['RejectedCmds'], list) and len(user_data['RejectedCmds']) > 0:
-                        # Add a message about rejected commands
-                        conversation_threads[thread_id].append({
-                            "role": "user",
-                            "content": "Out of the commands you suggested, the following were rejected by me:"
-                        })
-                        
-                        # Add details of each rejected command
-                        for idx, rc in enumerate(user_data['RejectedCmds'], 1):
-                            cmd = rc.get('Command', '[unknown command]')
-                            reason = rc.get('reason', '[no reason provided]')
-                            conversation_threads[thread_id].append({
-                                "role": "user",
-                                "content": f"{idx}. Command: {cmd}\nReason: {reason}"
-                            })
-
-                # Process executed commands from the data field in agentResponse
-                if 'agentResponse' in msg_pair and 'data' in msg_pair['agentResponse'] and isinstance(msg_pair['agentResponse']['data'], dict):
-                    agent_data = msg_pair['agentResponse']['data']
-                    if 'executedCmds' in agent_data and isinstance(agent_data['executedCmds'], list):
-                        for cmd_obj in agent_data['executedCmds']:
-                            if isinstance(cmd_obj, dict) and 'Command' in cmd_obj and 'Output' in cmd_obj:
-                                cmd = cmd_obj['Command']
-                                command_output = cmd_obj['Output']
-                                if command_output and command_output.strip():
-                                    conversation_threads[thread_id].append({
-                                        "role": "assistant",
-                                        "content": f"I ran this kubectl command with your approval: {cmd}\n\nThe output was:\n{command_output}"
-                                    })
-
-                if 'agentResponse' in msg_pair and 'content' in msg_pair['agentResponse']:
-                    # Add agent response to conversation
-                    conversation_threads[thread_id].append({
-                        "role": "assistant",
-                        "content": msg_pair['agentResponse']['content']
-                    })
-                
-                # Check for terminal command outputs in nextMsgContext
-                if 'nextMsgContext' in msg_pair and isinstance(msg_pair['nextMsgContext'], list):
-                    for context_item in msg_pair['nextMsgContext']:
-                        if context_item.get('type') == 'userTerminal' and 'command' in context_item:
-                            cmd = context_item['command'].get('Command', '')
-                            output = context_item['command'].get('Output', '')
-                            if cmd and output:
-                                conversation_threads[thread_id].append({
-                                    "role": "user",
-                                    "content": f"I ran this kubectl command with your approval: {cmd}\n\nThe output was:\n{output}"
-                                })
-
-        DUPLOCLOUD_CONCEPTS_CONTEXT = """
-## What “service” means here
-• **DuploCloud Service** = one micro-service you declared in the DuploCloud UI.  
-  ↳ DuploCloud materialises it as **one Kubernetes Deployment (or StatefulSet)** plus its Pods, HPA, ConfigMaps, etc.  
-  ↳ The Deployment/Pods carry the label **app=<service-name>**.
-
-• **It is *not* a Kubernetes `Service` object.**  
-  – A K8s `Service` is just the ClusterIP/LoadBalancer front-end DuploCloud creates for traffic.  
-  – When a user says “cart service”, they almost always mean the *workload* (Deployment & Pods) called **cart**, not that K8s `Service` resource.
-
-## How agents should translate a DuploCloud Service name
-
-| Context               | What to filter on                           | Example for “cart” |
-|-----------------------|---------------------------------------------|--------------------|
-| **kubectl / k8s**     | `deployment/cart` **or** `-l app=cart`      | `kubectl logs -n <ns> -l app=cart --tail=100` |
-| **LogQL (Loki)**      | `namespace="<ns>"` and container regex      | `{namespace="duploservices-demo", container=~".*cart.*"}` |
-| **TraceQL (Tempo)**   | `resource.k8s.namespace.name="<ns>"` **&&** `resource.service.name="cart"` | `{resource.k8s.namespace.name="duploservices-demo" && resource.service.name="cart"}` |
-
-### Key takeaway
-Whenever a user mentions “<name> service” inside DuploCloud, interpret it as **the Deployment/StatefulSet and its Pods labeled `app=<name>`**, *not* the Kubernetes `Service` resource.
-"""
-        # System prompt that guides Claude's behavior
-        system_prompt = """
-You are a seasoned Kubernetes and Helm expert agent for DuploCloud. Your role is to help users manage, troubleshoot, and deploy applications using kubectl commands and Helm in a less wordy manner.
+            past_messages = data['pastMessages']
+            base_version = data.get('pastMessagesVersion')
+            thread_config = session_store.config(thread_id)
+            if base_version is not None:
+                # Delta sync: pastMessages only holds pairs added since base_version
+                if base_version != thread_config.get('history_version'):
+                    return {
+                        "error": "pastMessagesVersion does not match this thread's history; resend the full pastMessages without pastMessagesVersion",
+                        "thread_id": thread_id,
+                        "history_version": thread_config.get('history_version')
+                    }, 409
+                debug_print(f"Appending {len(past_messages)} message pairs to synced history")
+                # Drop the messages added by the last turn; the client sends them back as pairs
+                session_store.truncate(thread_id, thread_config['history_length'])
+                with HISTORY_REBUILD_SECONDS.time(), tracing.span("history_rebuild", pairs=len(past_messages), delta=True):
+                    session_store.extend(thread_id, build_history(past_messages))
+            else:
+                # Rebuild the conversation history for this thread
+                with HISTORY_REBUILD_SECONDS.time(), tracing.span("history_rebuild", pairs=len(past_messages), delta=False):
+                    session_store.replace(thread_id, build_history(past_messages))
+            synced_version = history_version(base_version, past_messages)
+            session_store.update_config(thread_id, history_version=synced_version,
+                                        history_length=len(session_store.messages(thread_id)))
 
----------------------------
-DuploCloud Concepts Context:
-""" + DUPLOCLOUD_CONCEPTS_CONTEXT + """
----------------------------
-
-## Expertise Areas
-- Kubernetes resource management and troubleshooting
-- Helm chart creation and deployment
-- Docker Compose to Helm chart conversion
-- DuploCloud-specific Kubernetes configurations
-
-## Response Format
-Always use the `return_final_response` tool for every response with these fields:
-
-- `content`: Clear, educational explanation of your solution
-- `kubectl_cmds`: Array of kubectl commands when applicable
-- `helm_operations`: Helm commands with their required files when applicable
-
-## Kubectl Command Guidelines
-- Be specific about namespaces
-- Choose efficient commands to diagnose or solve problems
-- Consider cluster impact and resource constraints
-- Format commands properly with appropriate flags
-
-## Helm Operation Guidelines
-- If a user asks to convert a Docker Compose file to a Helm chart, ask the user for the name to use for the helm chart
-- Follow Helm best practices for chart structure
-- Use values.yaml for configurable elements
-- Include proper labels and annotations
-- Create reusable and maintainable templates
-
-## Docker Compose Conversion Guidelines
-When converting Docker Compose to Helm:
-1. Map services to appropriate Kubernetes resources
-2. Convert volumes to PersistentVolumeClaims
-3. Handle networking through Services and Ingresses
-4. Create a complete chart structure with all necessary files
-5. Remember that users will approve commands before execution, and files for Helm operations will be created temporarily and removed after command execution.
-
-## Conversation Approach
-- Be concise and to the point
-- Maintain context from previous interactions
-- Reference command outputs shared by the user
-- Explain the reasoning behind your suggestions
-- Do not execute the same command again and again for no reason
-- Ask clarifying questions when needed
-"""
-        
         # Get user-specific configuration first so we can use it for command execution
-        if thread_id not in user_configs:
-            user_configs[thread_id] = {}
-            
-        user_config = user_configs[thread_id]
+        user_config = session_store.config(thread_id)
         
         # Debug info
-        debug_print(f"Available user configs: {list(user_configs.keys())}")
         debug_print(f"User config for thread {thread_id}: {user_config}")
         
         # First, check if user provided executedCmds with output
@@ -597,7 +916,7 @@ When converting Docker Compose to Helm:
                     if command_output and command_output.strip():
                         has_commands_with_output = True
                         # Add the command and its output to conversation history
-                        conversation_threads[thread_id].append({
+                        session_store.append(thread_id, {
                             "role": "user", 
                             "content": f"I ran this kubectl command: {cmd}\n\nThe output was:\n{command_output}"
                         })
@@ -608,7 +927,8 @@ When converting Docker Compose to Helm:
         
         # Check if user provided commands to execute
         if 'data' in data and 'Cmds' in data['data'] and isinstance(data['data']['Cmds'], list) and len(data['data']['Cmds']) > 0:
-            # First pass: execute any commands that have execute=True
+            # First pass: decide which commands need to be executed
+            commands_to_execute = []
             for cmd_obj in data['data']['Cmds']:
                 if isinstance(cmd_obj, dict) and 'Command' in cmd_obj:
 
@@ -630,43 +950,36 @@ When converting Docker Compose to Helm:
                     # Execute helm operations
                     if should_execute and cmd_obj.get('files', False): #use better check for helm operations
                         logger.info("Executing helm operation")
-                        command_output = execute_helm_operation(cmd_obj)
-
-                                                # Update the command object with the output
-                        cmd_obj['Output'] = command_output
-                        # Add to executed commands list - both tracking lists
-                        previously_executed_commands.append(cmd_obj)
-                        newly_executed_commands.append(cmd_obj)
-                        # Add a summary for the content
-                        execution_results.append(f"Command: {cmd}\nOutput: {command_output}\n")
-                        # Add the command and its output to conversation history
-                        conversation_threads[thread_id].append({
-                            "role": "user", 
-                            "content": f"I ran this helm operation: {cmd}\n\nThe output was:\n{command_output}"
-                        })
+                        kubeconfig_path = user_config.get('kubeconfig_path')
+                        commands_to_execute.append((cmd_obj, "helm operation", lambda c=cmd_obj, k=kubeconfig_path: (execute_helm_operation(c, k), None), False))
 
                     # Execute kubectl commands
                     elif should_execute and cmd.startswith('kubectl'):
                         debug_print(f"Executing user command: {cmd}")
                         # Get user-specific kubeconfig if available
                         kubeconfig_path = user_config.get('kubeconfig_path')
-                        
-                        # Run command with user's kubeconfig
-                        out, err, code = run_command(cmd, kubeconfig_path)
-                        command_output = out if code == 0 else f"Error: {err}"
-                        
-                        # Update the command object with the output
-                        cmd_obj['Output'] = command_output
-                        # Add to executed commands list - both tracking lists
-                        previously_executed_commands.append(cmd_obj)
-                        newly_executed_commands.append(cmd_obj)
-                        # Add a summary for the content
-                        execution_results.append(f"Command: {cmd}\nOutput: {command_output}\n")
-                        # Add the command and its output to conversation history
-                        conversation_threads[thread_id].append({
-                            "role": "user", 
-                            "content": f"I ran this kubectl command: {cmd}\n\nThe output was:\n{command_output}"
-                        })
+                        commands_to_execute.append((cmd_obj, "kubectl command", lambda c=cmd, k=kubeconfig_path: run_kubectl_command(c, k), is_read_only(cmd)))
+
+            # Read-only commands run concurrently; results come back in submission order
+            outputs = run_in_order([(fn, parallel) for _, _, fn, parallel in commands_to_execute])
+
+            # Second pass: record outputs in the order the commands were submitted
+            for (cmd_obj, kind, _, _), (command_output, cache_status) in zip(commands_to_execute, outputs):
+                cmd = cmd_obj['Command']
+                # Update the command object with the output
+                cmd_obj['Output'] = command_output
+                if cache_status is not None:
+                    annotate_cache_status(cmd_obj, cache_status)
+                # Add to executed commands list - both tracking lists
+                previously_executed_commands.append(cmd_obj)
+                newly_executed_commands.append(cmd_obj)
+                # Add a summary for the content
+                execution_results.append(f"Command: {cmd}\nOutput: {command_output}\n")
+                # Add the command and its output to conversation history
+                session_store.append(thread_id, {
+                    "role": "user", 
+                    "content": f"I ran this {kind}: {cmd}\n\nThe output was:\n{command_output}"
+                })
             
             # No need for a second pass to add commands with output to conversation history
             # as we now process all previously executed commands from the executedCmds field
@@ -675,26 +988,28 @@ When converting Docker Compose to Helm:
             if previously_executed_commands or newly_executed_commands:
                 # Get Claude's analysis of the command output(s)
                 analysis_prompt = "Based on these command outputs, what insights can you provide? What should I look for or what next steps would you recommend?"
-                conversation_threads[thread_id].append({"role": "user", "content": analysis_prompt})
+                session_store.append(thread_id, {"role": "user", "content": analysis_prompt})
                 
-                llm_response = invoke_llm(conversation_threads[thread_id], system_prompt, thread_id)
+                llm_response = invoke_llm(session_store.messages(thread_id), SYSTEM_PROMPT, thread_id=thread_id, on_event=on_event, usage=request_usage, reduce_outputs=reduce_outputs)
                 claude_response = llm_response["content"]
                 helm_operations = llm_response.get("helm_operations", [])
 
                 debug_print(f"Claude response: {claude_response}")
-                conversation_threads[thread_id].append({"role": "assistant", "content": claude_response})
+                session_store.append(thread_id, {"role": "assistant", "content": claude_response})
                 
                 # Extract kubectl commands
                 kubectl_commands = extract_kubectl_commands(llm_response)
                 
-                return jsonify({
+                return {
                     "Content": f"Analysis of command(s):\n\n{claude_response}",
                     "thread_id": thread_id,
                     "data": {
                         "Cmds": kubectl_commands,
                         "executedCmds": newly_executed_commands
-                    }
-                })
+                    },
+                    "usage": request_usage,
+                    "history_version": synced_version
+                }, 200
         
         # Regular message handling
         user_message = data['content']
@@ -702,16 +1017,12 @@ When converting Docker Compose to Helm:
         #Add k8s namespace to user message
         user_message = f"Current Message Context: K8s Namespace: {k8s_namespace}\n\n{user_message}"
 
-        conversation_threads[thread_id].append({"role": "user", "content": user_message})
+        session_store.append(thread_id, {"role": "user", "content": user_message})
         
         # Get user-specific configuration
-        if thread_id not in user_configs:
-            user_configs[thread_id] = {}
-            
-        user_config = user_configs[thread_id]
+        user_config = session_store.config(thread_id)
         
         # Print debug info
-        debug_print(f"Available user configs: {list(user_configs.keys())}")
         debug_print(f"User config for thread {thread_id}: {user_config}")
         
 
@@ -722,17 +1033,17 @@ When converting Docker Compose to Helm:
         if rejected_cmds:
             # Prepend a message for the LLM
             prepend_msg = "the user has rejected these commands and has provided the reasoning, make sure you account for that in your response\n"
-            conversation_threads[thread_id].append({"role": "user", "content": prepend_msg})
+            session_store.append(thread_id, {"role": "user", "content": prepend_msg})
             # Add details of rejected commands
             formatted_rejected = "The following commands were rejected by the user:\n"
             for idx, rc in enumerate(rejected_cmds, 1):
                 cmd = rc.get('command', '[unknown command]')
                 reason = rc.get('reason', '[no reason provided]')
                 formatted_rejected += f"{idx}. Command: {cmd}\n   Reason: {reason}\n"
-            conversation_threads[thread_id].append({"role": "user", "content": formatted_rejected})
+            session_store.append(thread_id, {"role": "user", "content": formatted_rejected})
 
         # Get Claude's response using user's token if available
-        llm_response = invoke_llm(conversation_threads[thread_id], system_prompt, thread_id)
+        llm_response = invoke_llm(session_store.messages(thread_id), SYSTEM_PROMPT, thread_id=thread_id, on_event=on_event, usage=request_usage, reduce_outputs=reduce_outputs)
         logger.info(f"LLM response: {llm_response}")
         claude_response = llm_response["content"]
         helm_operations = llm_response.get("helm_operations", [])
@@ -741,7 +1052,7 @@ When converting Docker Compose to Helm:
         
         debug_print(f"Claude response: {claude_response}")
 
-        conversation_threads[thread_id].append({"role": "assistant", "content": claude_response})
+        session_store.append(thread_id, {"role": "assistant", "content": claude_response})
         
         # Extract kubectl commands suggested by Claude
         kubectl_commands = extract_kubectl_commands(llm_response)
@@ -756,48 +1067,47 @@ When converting Docker Compose to Helm:
             
             # Track commands we execute
             claude_executed_commands = []
-            claude_execution_results = []
             
             # Execute each kubectl command suggested by Claude
-            for cmd_obj in kubectl_commands:
-                cmd = cmd_obj['Command']
-                if cmd.startswith('kubectl'):
-                    debug_print(f"Executing Claude-suggested command: {cmd}")
-                    # Get user-specific kubeconfig if available
-                    kubeconfig_path = user_config.get('kubeconfig_path')
-                    
-                    # Run command with user's kubeconfig
-                    out, err, code = run_command(cmd, kubeconfig_path)
-                    command_output = out if code == 0 else f"Error: {err}"
-                    
-                    # Update the command object with the output
-                    cmd_obj['Output'] = command_output
-                    
-                    # Add to executed commands list
-                    claude_executed_commands.append(cmd_obj)
-                    newly_executed_commands.append(cmd_obj)  # Add to newly executed commands
-                    
-                    # Add a summary for the content
-                    claude_execution_results.append(f"Command: {cmd}\nOutput: {command_output}\n")
+            # Get user-specific kubeconfig if available
+            kubeconfig_path = user_config.get('kubeconfig_path')
+            suggested_commands = [cmd_obj for cmd_obj in kubectl_commands if cmd_obj['Command'].startswith('kubectl')]
+            for cmd_obj in suggested_commands:
+                debug_print(f"Executing Claude-suggested command: {cmd_obj['Command']}")
+
+            # Run command with user's kubeconfig, read-only commands concurrently
+            outputs = run_in_order([
+                (lambda c=cmd_obj['Command']: run_kubectl_command(c, kubeconfig_path), is_read_only(cmd_obj['Command']))
+                for cmd_obj in suggested_commands
+            ])
+
+            for cmd_obj, (command_output, cache_status) in zip(suggested_commands, outputs):
+                # Update the command object with the output
+                cmd_obj['Output'] = command_output
+                annotate_cache_status(cmd_obj, cache_status)
+                
+                # Add to executed commands list
+                claude_executed_commands.append(cmd_obj)
+                newly_executed_commands.append(cmd_obj)  # Add to newly executed commands
             
             # If we executed any commands, add them to conversation history and get new analysis
             if claude_executed_commands:
-                execution_summary = "\n\n" + "\n".join(claude_execution_results)
-                conversation_threads[thread_id].append({
-                    "role": "user", 
-                    "content": f"I executed the suggested kubectl commands. Here are the results:\n{execution_summary}"
-                })
+                # One message per command, in the same form as user-run commands, so outputs are reduced and compacted
+                session_store.extend(thread_id, [{
+                    "role": "user",
+                    "content": f"I ran this kubectl command: {cmd_obj['Command']}\n\nThe output was:\n{cmd_obj['Output']}"
+                } for cmd_obj in claude_executed_commands])
                 
                 # Get Claude's analysis of the command outputs
                 analysis_prompt = "Based on these command outputs, what insights can you provide? What should I look for or what next steps would you recommend?"
-                conversation_threads[thread_id].append({"role": "user", "content": analysis_prompt})
+                session_store.append(thread_id, {"role": "user", "content": analysis_prompt})
                 
                 # Get Claude's response using user's token if available
-                llm_response = invoke_llm(conversation_threads[thread_id], system_prompt, thread_id)
+                llm_response = invoke_llm(session_store.messages(thread_id), SYSTEM_PROMPT, thread_id=thread_id, on_event=on_event, usage=request_usage, reduce_outputs=reduce_outputs)
                 analysis_response = llm_response["content"]
                 helm_operations = llm_response.get("helm_operations", [])
 
-                conversation_threads[thread_id].append({"role": "assistant", "content": analysis_response})
+                session_store.append(thread_id, {"role": "assistant", "content": analysis_response})
                 
                 # Extract any new kubectl commands from the analysis
                 new_kubectl_commands = extract_kubectl_commands(llm_response)
@@ -807,36 +1117,165 @@ When converting Docker Compose to Helm:
                     cmd_obj['execute'] = False
                 
                 # Return the analysis and all commands
-                return jsonify({
+                return {
                     "Content": f"Analysis:\n{analysis_response}",
                     "thread_id": thread_id,
                     "data": {
                         "Cmds": new_kubectl_commands,  # Only show new commands as suggestions
                         "executedCmds": newly_executed_commands,  # Only show newly executed commands
                         "execute_all": user_data.get('execute_all', False)  # Echo back the execute_all flag
-                    }
-                })
+                    },
+                    "usage": request_usage,
+                    "history_version": synced_version
+                }, 200
         
         # Default behavior: set execute flag to false for all commands suggested by Claude
         for cmd_obj in kubectl_commands:
             cmd_obj['execute'] = False
         
         # Default response (no execution of Claude's suggestions)
-        return jsonify({
+        return {
             "Content": claude_response,
             "thread_id": thread_id,
             "data": {
                 "Cmds": kubectl_commands,
                 "executedCmds": newly_executed_commands,  # Will be empty if no commands were executed
                 "execute_all": user_data.get('execute_all', False)  # Echo back the execute_all flag
+            },
+            "usage": request_usage,
+            "history_version": synced_version
+        }, 200
+
+def plan_fanout_commands(question, targets, usage, identities):
+    """Ask the LLM which read-only commands answer a fan-out question on every target."""
+    namespaced = any(target.namespace for target in targets)
+    prompt = (f"Current Message Context: The commands you suggest will be run on each of {len(targets)} targets: "
+              f"{', '.join(target.label for target in targets[:20])}. Suggest only read-only kubectl commands"
+              f"{' without a namespace flag; each target sets its own namespace' if namespaced else ''}.\n\n{question}")
+    llm_response = invoke_llm([{"role": "user", "content": prompt}], SYSTEM_PROMPT, usage=usage, identities=identities)
+    commands = []
+    for cmd in llm_response.get("kubectl_cmds", []):
+        try:
+            cmd = check_command(cmd)
+        except FanoutError as e:
+            logger.info(f"Skipping suggested fan-out command: {e}")
+            continue
+        if namespaced and sets_namespace(cmd):
+            logger.info(f"Skipping suggested fan-out command that sets a namespace: {cmd}")
+            continue
+        if cmd not in commands:
+            commands.append(cmd)
+    return commands[:FANOUT_MAX_COMMANDS]
+
+def fan_out(data):
+    """Handle a fanOut request body and return a (response, status code) tuple.
+
+    Runs one read-only command (or the commands the LLM suggests for the question in
+    `content`) on every target in parallel, then analyzes the merged results in a single
+    LLM call."""
+    request_usage = empty_usage()
+    question = (data.get('content') or '').strip()
+    try:
+        targets = parse_targets(data)
+        commands = [check_command(data['command'])] if data.get('command') else []
+        if not commands and not question:
+            raise FanoutError("Provide a 'command', a question in 'content', or both")
+        for cmd in commands:
+            for target in targets:
+                scoped_command(cmd, target.namespace)
+    except FanoutError as e:
+        return {"error": str(e)}, 400
+
+    # Each target's kubeconfig is held for this request only; files shared with threads stay
+    owner = f"fanout-{uuid.uuid4()}"
+    kubeconfig_paths = {}
+    try:
+        for i, target in enumerate(targets):
+            if target.kubeconfig and target.kubeconfig not in kubeconfig_paths:
+                kubeconfig_paths[target.kubeconfig] = setup_kubeconfig(target.kubeconfig, f"{owner}-{i}")
+        if any(target.kubeconfig and not kubeconfig_paths[target.kubeconfig] for target in targets):
+            return {"error": "A kubeconfig could not be decoded"}, 400
+
+        # LLM calls are charged to every targeted kubeconfig, and refused if any of them is over budget
+        identities = sorted({kubeconfig_identity(kubeconfig_paths.get(target.kubeconfig)) for target in targets})
+        over_budget = token_ledger.identities_over_budget(identities)
+        if over_budget:
+            logger.warning(f"Refusing fan-out: {over_budget}")
+            return {"error": over_budget, "usage": {"kubeconfigs": token_ledger.identities_usage(identities)}}, 429
+
+        if not commands:
+            commands = plan_fanout_commands(question, targets, request_usage, identities)
+            if not commands:
+                return {"error": "No read-only commands could be derived from the question; send a 'command'",
+                        "usage": request_usage}, 422
+
+        jobs = [(cmd, target, scoped_command(cmd, target.namespace)) for cmd in commands for target in targets]
+        outputs = run_in_order([
+            (lambda c=scoped, k=kubeconfig_paths.get(target.kubeconfig): run_kubectl_command(c, k, shell=False), True)
+            for _, target, scoped in jobs
+        ], max_concurrency=FANOUT_CONCURRENCY)
+
+        results = []
+        for (cmd, target, scoped), (output, cache_status) in zip(jobs, outputs):
+            result = {
+                "target": target.label,
+                "cluster": kubeconfig_registry.current_context(kubeconfig_paths.get(target.kubeconfig)) or target.name,
+                "namespace": target.namespace,
+                "Command": scoped,
+                "Output": output,
             }
-        })
+            annotate_cache_status(result, cache_status)
+            results.append(result)
+    finally:
+        for i in range(len(targets)):
+            kubeconfig_registry.release(f"{owner}-{i}")
+
+    content = ""
+    suggested_commands = []
+    if data.get('analyze', True):
+        messages = [{"role": "user", "content": f"Current Message Context: Fan-out over {len(targets)} targets\n\n"
+                                                f"{question or 'Compare the results across the targets.'}"}]
+        for cmd in commands:
+            messages.extend(merge_results(cmd, [r for r, (c, _, _) in zip(results, jobs) if c == cmd]))
+        messages.append({"role": "user", "content": "Based on these command outputs from all targets, which targets "
+                                                    "have problems and what do they have in common? What should I look at next?"})
+        llm_response = invoke_llm(messages, SYSTEM_PROMPT, usage=request_usage, identities=identities,
+                                  reduce_outputs=OUTPUT_REDUCTION and not data.get('full_output', False))
+        content = llm_response["content"]
+        suggested_commands = extract_kubectl_commands(llm_response)
+
+    return {
+        "Content": content,
+        "data": {
+            "Cmds": suggested_commands,
+            "results": results,
+        },
+        "usage": request_usage
+    }, 200
+
+@app.route('/api/fanOut', methods=['POST'])
+def fan_out_endpoint():
+    """API endpoint running read-only commands over many clusters/namespaces with one analysis"""
+    data = request.json or {}
+    trace_id, parent_id = request_trace()
+    with SEND_MESSAGE_SECONDS.time(endpoint="fanOut"), \
+            tracing.span("fan_out", trace_id, parent_id, tracing.SPAN_KIND_SERVER, endpoint="fanOut"):
+        response, status = fan_out(data)
+    return jsonify(response), status, {"X-Trace-Id": trace_id}
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics of this worker process"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""    
     return jsonify({
-        "status": "healthy"
+        "status": "healthy",
+        "threads": dict(thread_registry.stats(), memory_bytes=session_store.memory_bytes()),
+        "bedrock": bedrock_llm.stats(),
+        "token_usage": token_ledger.stats()
     })
 
 if __name__ == "__main__":
@@ -853,4 +1292,5 @@ if __name__ == "__main__":
     logger.info(f"Kubernetes Troubleshooting API starting on port {PORT}")
     logger.info("Health check: http://localhost:5002/api/health")
     logger.info("Send messages: http://localhost:5002/api/sendMessage (POST)")
-    app.run(host='0.0.0.0', port=PORT, debug=True)
+    # Development server only; production uses gunicorn (gunicorn -c gunicorn.conf.py k8s_api_agent:app)
+    app.run(host='0.0.0.0', port=PORT, debug=os.getenv("FLASK_DEBUG", "false").lower() == "true", threaded=True)
@@ -0,0 +1,489 @@
+"""
+In-process fast path for common read-only kubectl commands.
+
+Every kubectl invocation starts a shell and a process, loads the kubeconfig,
+runs API discovery and opens a new TLS connection. For the handful of commands
+that make up most troubleshooting traffic this module talks to the API server
+directly, over one keep-alive `requests.Session` per kubeconfig:
+
+- ``kubectl get <resource> [name]`` for well-known resource types, using
+  server-side table printing (default and ``-o wide``), ``-o name`` and ``-o json``
+- ``kubectl logs <pod>`` with ``-c``, ``--tail``, ``--since``, ``-p`` and ``--timestamps``,
+  streamed and capped at COMMAND_MAX_OUTPUT_BYTES like the output of kubectl
+
+Output is formatted the way kubectl formats it. Anything else, including any
+flag the fast path does not understand and every API error, returns None so
+the caller falls back to the kubectl binary, which produces the exact
+kubectl output and error messages.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from command_cache import kubeconfig_identity
+from command_runner import GLOBAL_MAX_CONCURRENCY, MAX_OUTPUT_BYTES, SHELL_OPERATORS, CappedBuffer, split_command
+
+logger = logging.getLogger(__name__)
+
+FAST_PATH_ENABLED = os.getenv("KUBE_API_FAST_PATH", "true").lower() == "true"
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("KUBE_API_TIMEOUT_SECONDS", "30"))
+# How long to wait before retrying a kubeconfig the fast path could not use
+UNSUPPORTED_RETRY_SECONDS = 300
+# Lifetime of exec plugin credentials that do not report an expiry
+EXEC_CREDENTIAL_TTL_SECONDS = 600
+
+SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+
+TABLE_ACCEPT = ("application/json;as=Table;v=v1;g=meta.k8s.io,"
+                "application/json;as=Table;v=v1beta1;g=meta.k8s.io,application/json")
+
+# resource alias -> (API path prefix, plural, group, namespaced)
+_CORE = "/api/v1"
+RESOURCES: Dict[str, Tuple[str, str, str, bool]] = {}
+for _aliases, _prefix, _plural, _group, _namespaced in [
+    (("pods", "pod", "po"), _CORE, "pods", "", True),
+    (("services", "service", "svc"), _CORE, "services", "", True),
+    (("events", "event", "ev"), _CORE, "events", "", True),
+    (("configmaps", "configmap", "cm"), _CORE, "configmaps", "", True),
+    (("secrets", "secret"), _CORE, "secrets", "", True),
+    (("serviceaccounts", "serviceaccount", "sa"), _CORE, "serviceaccounts", "", True),
+    (("endpoints", "ep"), _CORE, "endpoints", "", True),
+    (("persistentvolumeclaims", "persistentvolumeclaim", "pvc"), _CORE, "persistentvolumeclaims", "", True),
+    (("persistentvolumes", "persistentvolume", "pv"), _CORE, "persistentvolumes", "", False),
+    (("nodes", "node", "no"), _CORE, "nodes", "", False),
+    (("namespaces", "namespace", "ns"), _CORE, "namespaces", "", False),
+    (("deployments", "deployment", "deploy"), "/apis/apps/v1", "deployments", "apps", True),
+    (("replicasets", "replicaset", "rs"), "/apis/apps/v1", "replicasets", "apps", True),
+    (("statefulsets", "statefulset", "sts"), "/apis/apps/v1", "statefulsets", "apps", True),
+    (("daemonsets", "daemonset", "ds"), "/apis/apps/v1", "daemonsets", "apps", True),
+    (("jobs", "job"), "/apis/batch/v1", "jobs", "batch", True),
+    (("cronjobs", "cronjob", "cj"), "/apis/batch/v1", "cronjobs", "batch", True),
+    (("ingresses", "ingress", "ing"), "/apis/networking.k8s.io/v1", "ingresses", "networking.k8s.io", True),
+    (("horizontalpodautoscalers", "horizontalpodautoscaler", "hpa"), "/apis/autoscaling/v2",
+     "horizontalpodautoscalers", "autoscaling", True),
+]:
+    for _alias in _aliases:
+        RESOURCES[_alias] = (_prefix, _plural, _group, _namespaced)
+
+# Flags understood by the fast path, and whether they take a value
+GET_FLAGS = {"-n": True, "--namespace": True, "-A": False, "--all-namespaces": False,
+             "-l": True, "--selector": True, "--field-selector": True, "-o": True, "--output": True,
+             "--no-headers": False}
+LOGS_FLAGS = {"-n": True, "--namespace": True, "-c": True, "--container": True, "--tail": True,
+              "--since": True, "-p": False, "--previous": False, "--timestamps": False}
+
+_DURATION = re.compile(r"^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$")
+
+
+class Unsupported(Exception):
+    """Raised when a command or kubeconfig is outside what the fast path handles."""
+
+
+class ApiError(Unsupported):
+    """Raised when the API server answers with an error status."""
+
+    def __init__(self, status_code: int, path: str):
+        super().__init__(f"HTTP {status_code} for {path}")
+        self.status_code = status_code
+
+
+def parse_kubectl_args(tokens: List[str], allowed: Dict[str, bool]) -> Tuple[List[str], Dict[str, Any]]:
+    """Split kubectl arguments into positionals and flags, rejecting unknown flags."""
+    positionals: List[str] = []
+    flags: Dict[str, Any] = {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.startswith("-") and token != "-":
+            name, eq, value = token.partition("=")
+            if name not in allowed:
+                raise Unsupported(f"flag {name}")
+            if allowed[name]:
+                if not eq:
+                    i += 1
+                    if i >= len(tokens):
+                        raise Unsupported(f"missing value for {name}")
+                    value = tokens[i]
+                flags[name] = value
+            else:
+                if eq and value not in ("true", "false"):
+                    raise Unsupported(f"value for {name}")
+                flags[name] = value != "false"
+        else:
+            positionals.append(token)
+        i += 1
+    return positionals, flags
+
+
+def first_flag(flags: Dict[str, Any], *names: str, default=None):
+    for name in names:
+        if name in flags:
+            return flags[name]
+    return default
+
+
+def _since_seconds(value: str) -> int:
+    match = _DURATION.match(value)
+    if not value or not match or not any(match.groups()):
+        raise Unsupported(f"duration {value}")
+    hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_cell(value: Any) -> str:
+    if value is None:
+        return "<none>"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def format_table(rows: List[List[str]]) -> str:
+    """Lay out rows like kubectl's tabwriter (minwidth 10, padding 3, no padding on the last column)."""
+    if not rows:
+        return ""
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    widths = [max(10, width + 3) for width in widths]
+    lines = []
+    for row in rows:
+        cells = [cell.ljust(widths[i]) for i, cell in enumerate(row[:-1])] + [row[-1]]
+        lines.append("".join(cells))
+    return "\n".join(lines)
+
+
+class KubeApiClient:
+    """A pooled HTTP client for one cluster, built from a kubeconfig."""
+
+    def __init__(self, kubeconfig_path: Optional[str]):
+        self.kubeconfig_path = kubeconfig_path
+        self._workdir = tempfile.mkdtemp(prefix="kubeapi_")
+        self._exec_config: Optional[dict] = None
+        self._token_file: Optional[str] = None
+        self._token: Optional[str] = None
+        self._token_expiry = 0.0
+        self._token_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GLOBAL_MAX_CONCURRENCY)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        try:
+            self._configure()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        self.session.close()
+        shutil.rmtree(self._workdir, ignore_errors=True)
+
+    def _write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self._workdir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.chmod(path, 0o600)
+        return path
+
+    def _configure(self) -> None:
+        if not self.kubeconfig_path and not os.getenv("KUBECONFIG") and os.getenv("KUBERNETES_SERVICE_HOST") \
+                and os.path.exists(os.path.join(SERVICE_ACCOUNT_DIR, "token")) \
+                and not os.path.exists(os.path.expanduser("~/.kube/config")):
+            self._configure_in_cluster()
+            return
+
+        env = os.environ.copy()
+        if self.kubeconfig_path:
+            env["KUBECONFIG"] = self.kubeconfig_path
+        # kubectl resolves merging, the current context and relative paths for us, once per kubeconfig
+        result = subprocess.run(["kubectl", "config", "view", "--raw", "--minify", "-o", "json"],
+                                capture_output=True, text=True, env=env, timeout=REQUEST_TIMEOUT_SECONDS)
+        if result.returncode != 0:
+            raise Unsupported(f"kubectl config view failed: {result.stderr.strip()}")
+        config = json.loads(result.stdout)
+
+        context = (config.get("contexts") or [{}])[0].get("context", {})
+        cluster = (config.get("clusters") or [{}])[0].get("cluster", {})
+        user = (config.get("users") or [{}])[0].get("user", {}) or {}
+        if not cluster.get("server") or cluster.get("proxy-url") or cluster.get("tls-server-name"):
+            raise Unsupported("cluster settings")
+
+        self.server = cluster["server"].rstrip("/")
+        self.default_namespace = context.get("namespace") or "default"
+
+        if cluster.get("insecure-skip-tls-verify"):
+            self.session.verify = False
+        elif cluster.get("certificate-authority-data"):
+            self.session.verify = self._write("ca.crt", base64.b64decode(cluster["certificate-authority-data"]))
+        elif cluster.get("certificate-authority"):
+            self.session.verify = cluster["certificate-authority"]
+
+        if user.get("client-certificate-data") and user.get("client-key-data"):
+            self.session.cert = (
+                self._write("client.crt", base64.b64decode(user["client-certificate-data"])),
+                self._write("client.key", base64.b64decode(user["client-key-data"])),
+            )
+        elif user.get("client-certificate") and user.get("client-key"):
+            self.session.cert = (user["client-certificate"], user["client-key"])
+
+        if user.get("token"):
+            self._token = user["token"]
+            self._token_expiry = float("inf")
+        elif user.get("tokenFile"):
+            self._token_file = user["tokenFile"]
+        elif user.get("exec"):
+            self._exec_config = user["exec"]
+        elif user.get("username") or user.get("auth-provider"):
+            raise Unsupported("auth method")
+
+    def _configure_in_cluster(self) -> None:
+        host = os.environ["KUBERNETES_SERVICE_HOST"]
+        port = os.getenv("KUBERNETES_SERVICE_PORT", "443")
+        if ":" in host:
+            host = f"[{host}]"
+        self.server = f"https://{host}:{port}"
+        self.session.verify = os.path.join(SERVICE_ACCOUNT_DIR, "ca.crt")
+        self._token_file = os.path.join(SERVICE_ACCOUNT_DIR, "token")
+        namespace_file = os.path.join(SERVICE_ACCOUNT_DIR, "namespace")
+        self.default_namespace = open(namespace_file).read().strip() if os.path.exists(namespace_file) else "default"
+
+    def _bearer_token(self) -> Optional[str]:
+        """Return the current bearer token, running the exec credential plugin when it has expired."""
+        with self._token_lock:
+            if self._token and time.time() < self._token_expiry:
+                return self._token
+            if self._token_file:
+                # Projected service account tokens rotate; re-read the file periodically
+                with open(self._token_file) as f:
+                    self._token = f.read().strip()
+                self._token_expiry = time.time() + 60
+                return self._token
+            if not self._exec_config:
+                return self._token
+
+            exec_config = self._exec_config
+            env = os.environ.copy()
+            for item in exec_config.get("env") or []:
+                env[item["name"]] = item["value"]
+            result = subprocess.run([exec_config["command"]] + list(exec_config.get("args") or []),
+                                    capture_output=True, text=True, env=env, timeout=REQUEST_TIMEOUT_SECONDS)
+            if result.returncode != 0:
+                raise Unsupported(f"exec credential plugin failed: {result.stderr.strip()}")
+            status = json.loads(result.stdout).get("status", {})
+            if status.get("clientCertificateData"):
+                raise Unsupported("exec client certificates")
+            self._token = status.get("token")
+            expiry = status.get("expirationTimestamp")
+            if expiry:
+                expires_at = datetime.fromisoformat(expiry.replace("Z", "+00:00")).timestamp()
+                self._token_expiry = expires_at - 60
+            else:
+                self._token_expiry = time.time() + EXEC_CREDENTIAL_TTL_SECONDS
+            return self._token
+
+    def request(self, path: str, params: Optional[dict] = None, accept: str = "application/json",
+                stream: bool = False, timeout: float = REQUEST_TIMEOUT_SECONDS) -> requests.Response:
+        headers = {"Accept": accept, "User-Agent": "k8s-agent"}
+        token = self._bearer_token()
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        response = self.session.get(self.server + path, params=params, headers=headers,
+                                    stream=stream, timeout=timeout)
+        if response.status_code >= 400:
+            # Let kubectl produce its own error message
+            response.close()
+            raise ApiError(response.status_code, path)
+        return response
+
+    def get(self, args: List[str]) -> Tuple[str, str, int]:
+        positionals, flags = parse_kubectl_args(args, GET_FLAGS)
+        if not positionals or len(positionals) > 2:
+            raise Unsupported("arguments")
+        resource, _, name = positionals[0].partition("/")
+        if len(positionals) == 2:
+            if name:
+                raise Unsupported("arguments")
+            name = positionals[1]
+        if resource not in RESOURCES:
+            raise Unsupported(f"resource {resource}")
+        prefix, plural, group, namespaced = RESOURCES[resource]
+
+        output = first_flag(flags, "-o", "--output", default="")
+        if output not in ("", "wide", "name", "json"):
+            raise Unsupported(f"output {output}")
+        all_namespaces = bool(first_flag(flags, "-A", "--all-namespaces")) and not name
+        namespace = first_flag(flags, "-n", "--namespace", default=self.default_namespace)
+
+        path = prefix
+        if namespaced and not all_namespaces:
+            path += f"/namespaces/{namespace}"
+        path += f"/{plural}"
+        if name:
+            path += f"/{name}"
+        params = {}
+        if all_namespaces:
+            params["includeObject"] = "Metadata"
+        if first_flag(flags, "-l", "--selector"):
+            params["labelSelector"] = first_flag(flags, "-l", "--selector")
+        if "--field-selector" in flags:
+            params["fieldSelector"] = flags["--field-selector"]
+
+        if output in ("name", "json"):
+            body = self.request(path, params).json()
+            items = [body] if name else body.get("items", [])
+            if not name:
+                # List items do not carry apiVersion/kind; kubectl fills them in ahead of the other fields
+                item_kind = body.get("kind", "").rsplit("List", 1)[0]
+                items = [{"apiVersion": item.get("apiVersion", body.get("apiVersion")),
+                          "kind": item.get("kind", item_kind), **item} for item in items]
+            if output == "name":
+                if not items:
+                    return "", self._no_resources(namespaced, all_namespaces, namespace), 0
+                kind = lambda item: item.get("kind", "").lower() + (f".{group}" if group else "")
+                return "\n".join(f"{kind(item)}/{item['metadata']['name']}" for item in items), "", 0
+            # Fields keep the API server's order, as kubectl prints them
+            if name:
+                return json.dumps(body, indent=4, ensure_ascii=False), "", 0
+            listing = {"apiVersion": "v1", "items": items, "kind": "List", "metadata": {"resourceVersion": ""}}
+            return json.dumps(listing, indent=4, ensure_ascii=False), "", 0
+
+        table = self.request(path, params, accept=TABLE_ACCEPT).json()
+        if table.get("kind") != "Table":
+            raise Unsupported("server-side printing")
+        rows = table.get("rows") or []
+        if not rows:
+            return "", self._no_resources(namespaced, all_namespaces, namespace), 0
+
+        columns = table.get("columnDefinitions", [])
+        shown = [i for i, column in enumerate(columns) if output == "wide" or column.get("priority", 0) == 0]
+        lines: List[List[str]] = []
+        if not flags.get("--no-headers"):
+            lines.append((["NAMESPACE"] if all_namespaces and namespaced else [])
+                         + [columns[i]["name"].upper() for i in shown])
+        for row in rows:
+            cells = row.get("cells", [])
+            line = [format_cell(cells[i]) if i < len(cells) else "" for i in shown]
+            if all_namespaces and namespaced:
+                line.insert(0, ((row.get("object") or {}).get("metadata") or {}).get("namespace", ""))
+            lines.append(line)
+        return format_table(lines), "", 0
+
+    @staticmethod
+    def _no_resources(namespaced: bool, all_namespaces: bool, namespace: str) -> str:
+        if namespaced and not all_namespaces:
+            return f"No resources found in {namespace} namespace."
+        return "No resources found"
+
+    def logs(self, args: List[str]) -> Tuple[str, str, int]:
+        positionals, flags = parse_kubectl_args(args, LOGS_FLAGS)
+        if len(positionals) != 1:
+            raise Unsupported("arguments")
+        pod = positionals[0]
+        if "/" in pod:
+            kind, _, pod = pod.partition("/")
+            if kind not in ("pod", "pods", "po"):
+                raise Unsupported(f"logs for {kind}")
+        namespace = first_flag(flags, "-n", "--namespace", default=self.default_namespace)
+        params: Dict[str, Any] = {}
+        container = first_flag(flags, "-c", "--container")
+        if container:
+            params["container"] = container
+        if "--tail" in flags:
+            tail = int(flags["--tail"])
+            if tail >= 0:
+                params["tailLines"] = tail
+        if "--since" in flags:
+            params["sinceSeconds"] = _since_seconds(flags["--since"])
+        if first_flag(flags, "-p", "--previous"):
+            params["previous"] = "true"
+        if flags.get("--timestamps"):
+            params["timestamps"] = "true"
+        # Logs can be large; keep only their head and tail, as for the kubectl binary
+        buffer = CappedBuffer(MAX_OUTPUT_BYTES)
+        with self.request(f"/api/v1/namespaces/{namespace}/pods/{pod}/log", params, accept="*/*",
+                          stream=True) as response:
+            for chunk in response.iter_content(65536):
+                buffer.write(chunk)
+        return buffer.text(), "", 0
+
+
+class KubeApiFastPath:
+    """Registry of pooled API clients, one per kubeconfig identity."""
+
+    def __init__(self, enabled: bool = FAST_PATH_ENABLED):
+        self.enabled = enabled
+        self._clients: Dict[str, KubeApiClient] = {}
+        self._unsupported: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def client_for(self, kubeconfig_path: Optional[str]) -> Optional[KubeApiClient]:
+        """Return the pooled client for a kubeconfig, or None if the fast path cannot use it."""
+        identity = kubeconfig_identity(kubeconfig_path)
+        with self._lock:
+            client = self._clients.get(identity)
+            if client is not None:
+                return client
+            if time.monotonic() < self._unsupported.get(identity, 0):
+                return None
+        # Building a client runs kubectl, so it happens outside the lock shared by all kubeconfigs
+        try:
+            client = KubeApiClient(kubeconfig_path)
+        except Exception as e:
+            logger.info(f"Kubernetes API fast path unavailable for kubeconfig {kubeconfig_path}: {e}")
+            with self._lock:
+                self._unsupported[identity] = time.monotonic() + UNSUPPORTED_RETRY_SECONDS
+            return None
+        with self._lock:
+            existing = self._clients.setdefault(identity, client)
+        if existing is not client:
+            # Another request built one first
+            client.close()
+        return existing
+
+    def run(self, cmd: str, kubeconfig_path: Optional[str] = None) -> Optional[Tuple[str, str, int]]:
+        """Run a read-only kubectl command in-process.
+
+        Returns (stdout, stderr, returncode) like run_command, or None if the
+        command must be run by the kubectl binary instead.
+        """
+        if not self.enabled or any(op in cmd for op in SHELL_OPERATORS):
+            return None
+        tokens = split_command(cmd)
+        if len(tokens) < 2 or tokens[0] != "kubectl" or tokens[1] not in ("get", "logs"):
+            return None
+        client = self.client_for(kubeconfig_path)
+        if client is None:
+            return None
+        start = time.perf_counter()
+        try:
+            handler = client.get if tokens[1] == "get" else client.logs
+            out, err, code = handler(tokens[2:])
+        except Unsupported as e:
+            logger.debug(f"Falling back to kubectl for '{cmd}': {e}")
+            return None
+        except (requests.RequestException, OSError, subprocess.SubprocessError, ValueError, KeyError) as e:
+            logger.info(f"Kubernetes API fast path failed for '{cmd}', falling back to kubectl: {e}")
+            return None
+        logger.info(f"Ran '{cmd}' via Kubernetes API in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return out.strip(), err, code
+
+    def forget(self, kubeconfig_path: Optional[str]) -> None:
+        """Close and drop the client for a kubeconfig, e.g. once it is no longer in use."""
+        identity = kubeconfig_identity(kubeconfig_path)
+        with self._lock:
+            client = self._clients.pop(identity, None)
+            self._unsupported.pop(identity, None)
+        if client is not None:
+            client.close()
@@ -0,0 +1,229 @@
+"""
+Content-addressed storage of user-provided kubeconfigs.
+
+Each distinct kubeconfig is written once, to a file named after the SHA-256 of
+its content, and shared by every thread that sends it. Sending an unchanged
+kubeconfig again doesn't rewrite the file, and since a file never changes,
+memos of its content are keyed by its path.
+
+Threads keep the kubeconfig content in their config in the session store, and
+the file is written again from it if it is missing when the thread is used,
+e.g. after the thread was loaded by another worker or replica. Since other
+workers may be using a file, it is not deleted when a thread is evicted;
+files that no thread in this process uses and that no request here has used
+for KUBECONFIG_MAX_AGE_SECONDS are deleted instead. Last use is kept in
+memory, not in the file's mtime. A file another worker deletes while a thread
+here still needs it is written again on that thread's next request.
+
+The current context name is read from the kubeconfig itself and cached, so
+creating a thread doesn't need to run `kubectl config current-context`.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+KUBECONFIG_DIR = os.getenv("KUBECONFIG_DIR", os.path.join("/tmp", "k8sagent", "kubeconfigs"))
+# Kubeconfig files unused for this long are deleted; well above the longest command timeout
+KUBECONFIG_MAX_AGE_SECONDS = float(os.getenv("KUBECONFIG_MAX_AGE_SECONDS", "86400"))
+
+# Top-level `current-context: name` line, optionally quoted
+_CURRENT_CONTEXT = re.compile(r"""^current-context:[ \t]*(?:"([^"]*)"|'([^']*)'|([^#\r\n]*?))[ \t]*(?:#.*)?$""", re.MULTILINE)
+_CONTEXT_MEMO_SIZE = 1024
+_CONTENT_ADDRESSED_NAME = re.compile(r"^([0-9a-f]{64})\.kubeconfig$")
+
+
+def parse_current_context(content: str) -> str:
+    """Return the current-context of a kubeconfig (YAML or JSON), or "" if it isn't set."""
+    if content.lstrip().startswith("{"):
+        try:
+            return json.loads(content).get("current-context") or ""
+        except ValueError:
+            return ""
+    match = _CURRENT_CONTEXT.search(content)
+    if not match:
+        return ""
+    return next((group for group in match.groups() if group is not None), "")
+
+
+def content_hash(path: str) -> Optional[str]:
+    """SHA-256 of a registry kubeconfig, taken from its file name, or None for other files."""
+    match = _CONTENT_ADDRESSED_NAME.match(os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def default_kubeconfig_paths():
+    """Files kubectl reads when no --kubeconfig is given."""
+    if os.getenv("KUBECONFIG"):
+        return [p for p in os.environ["KUBECONFIG"].split(os.pathsep) if p]
+    return [os.path.join(os.path.expanduser("~"), ".kube", "config")]
+
+
+class KubeconfigRegistry:
+    """Shared kubeconfig files keyed by content hash, with the threads using each in this process."""
+
+    def __init__(self, root: str = KUBECONFIG_DIR, on_unused: Optional[Callable[[str], None]] = None,
+                 max_age: float = KUBECONFIG_MAX_AGE_SECONDS):
+        """
+        Args:
+            root: Directory holding the kubeconfig files
+            on_unused: Called with a kubeconfig path once no thread in this process uses it
+            max_age: Seconds after their last use that kubeconfig files are deleted
+        """
+        self.root = root
+        self._on_unused = on_unused
+        self.max_age = max_age
+        self._thread_paths: Dict[str, str] = {}
+        self._refcounts: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
+        # Keyed by path for registry files and by (path, mtime, size) for others
+        self._contexts: Dict[object, str] = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _decode(kubeconfig_base64: str) -> Optional[bytes]:
+        try:
+            content = base64.b64decode(kubeconfig_base64)
+            content.decode("utf-8")
+        except Exception as e:
+            logger.error(f"Error decoding kubeconfig: {e}")
+            return None
+        return content
+
+    def register(self, thread_id: str, kubeconfig_base64: str) -> Optional[str]:
+        """Make a base64 kubeconfig available for a thread and return its path."""
+        content = self._decode(kubeconfig_base64)
+        if content is None:
+            return None
+        path = os.path.join(self.root, f"{hashlib.sha256(content).hexdigest()}.kubeconfig")
+        self._ensure(path, content)
+        self.track(thread_id, path)
+        return path
+
+    def _ensure(self, path: str, content: Optional[bytes]) -> None:
+        """Mark a kubeconfig file as used now, writing it if it is missing."""
+        with self._lock:
+            self._last_used[path] = time.time()
+        if not os.path.exists(path):
+            if content is None:
+                logger.error(f"Kubeconfig {path} is missing and its content is not known")
+            else:
+                try:
+                    self._write(path, content)
+                except OSError as e:
+                    logger.error(f"Error writing kubeconfig {path}: {e}")
+        self._sweep()
+
+    def _write(self, path: str, content: bytes) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        # Write under a unique name and rename, so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        logger.info(f"Stored kubeconfig: {path}")
+
+    def _sweep(self) -> None:
+        """Delete kubeconfig files unused for max_age, at most every tenth of max_age.
+
+        Files this process has not used are aged from when they were written."""
+        now = time.time()
+        with self._lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + self.max_age / 10
+            for path, last_used in list(self._last_used.items()):
+                if now - last_used > self.max_age and path not in self._refcounts:
+                    del self._last_used[path]
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.root, name)
+            with self._lock:
+                if path in self._last_used or path in self._refcounts:
+                    continue
+            try:
+                if now - os.stat(path).st_mtime > self.max_age:
+                    os.remove(path)
+                    self._contexts.pop(path, None)
+                    logger.info(f"Deleted unused kubeconfig: {path}")
+            except OSError:
+                pass
+
+    def track(self, thread_id: str, path: Optional[str], kubeconfig_base64: Optional[str] = None) -> None:
+        """Record that a thread uses a kubeconfig path, e.g. for a thread loaded from the session store.
+
+        The file is written again from `kubeconfig_base64` if it is missing."""
+        if path is not None and kubeconfig_base64 is not None:
+            self._ensure(path, self._decode(kubeconfig_base64))
+        with self._lock:
+            previous = self._thread_paths.get(thread_id)
+            if previous == path:
+                return
+            if path is None:
+                self._thread_paths.pop(thread_id, None)
+            else:
+                self._thread_paths[thread_id] = path
+                self._refcounts[path] = self._refcounts.get(path, 0) + 1
+        if previous is not None:
+            self._unref(previous)
+
+    def release(self, thread_id: str) -> None:
+        """Stop tracking a thread. Its kubeconfig file is kept for other workers and later loads."""
+        with self._lock:
+            path = self._thread_paths.pop(thread_id, None)
+        if path is not None:
+            self._unref(path)
+
+    def _unref(self, path: str) -> None:
+        with self._lock:
+            self._refcounts[path] -= 1
+            if self._refcounts[path] > 0:
+                return
+            self._refcounts.pop(path)
+        if self._on_unused:
+            try:
+                self._on_unused(path)
+            except Exception as e:
+                logger.error(f"Error releasing kubeconfig {path}: {e}")
+
+    def current_context(self, kubeconfig_path: Optional[str] = None) -> str:
+        """Current context name of a kubeconfig, or of the default kubeconfig when no path is given."""
+        for path in [kubeconfig_path] if kubeconfig_path else default_kubeconfig_paths():
+            context = self._file_context(path)
+            if context:
+                return context
+        return ""
+
+    def _file_context(self, path: str) -> str:
+        if content_hash(path):
+            key = path
+        else:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return ""
+            key = (path, stat.st_mtime, stat.st_size)
+        context = self._contexts.get(key)
+        if context is None:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    context = parse_current_context(f.read())
+            except (OSError, UnicodeDecodeError):
+                return ""
+            if len(self._contexts) > _CONTEXT_MEMO_SIZE:
+                self._contexts.clear()
+            self._contexts[key] = context
+        return context
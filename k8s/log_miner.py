@@ -0,0 +1,164 @@
+"""
+Drain-style log template mining for `kubectl logs` output.
+
+Container logs are often dominated by a few lines repeated with different
+timestamps, IDs and durations. `LogTemplateMiner` reads lines one at a time
+and groups them into templates: variable-looking tokens (numbers, hex, UUIDs,
+IPs, ...) are masked, lines are bucketed by token count and first token, and a
+line joins the most similar template in its bucket, turning the tokens that
+differ into `<*>`. Memory is bounded by the number of templates kept, not by
+the size of the log. Once no more templates can be added, error lines that
+match none are still kept verbatim (up to MAX_OVERFLOW_ERROR_LINES) and other
+such lines are counted as omitted.
+
+Rendering keeps rare lines and error lines verbatim and collapses everything
+else into "template x count" with the first and last example.
+"""
+
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+WILDCARD = "<*>"
+SIMILARITY_THRESHOLD = 0.5
+MAX_TEMPLATES = 1000
+MAX_TEMPLATES_PER_BUCKET = 100
+MAX_LINE_CHARS = 2000
+# Masked lines remembered for an exact-match shortcut
+EXACT_CACHE_SIZE = 10000
+# Templates seen at most this many times are shown line by line
+RARE_LINES = 2
+# Error templates are shown line by line up to this many occurrences
+ERROR_LINES = 5
+# Error lines kept verbatim once the template limits are reached
+MAX_OVERFLOW_ERROR_LINES = 200
+
+# Variable-looking tokens, tried in order at each position: timestamps, UUIDs, IPs, hex, numbers with units
+_MASK = re.compile("|".join([
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?",
+    r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b",
+    r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b",
+    r"\b0x[0-9a-fA-F]+\b|\b[0-9a-fA-F]{12,}\b",
+    r"(?<![A-Za-z])[-+]?\d+(?:\.\d+)?(?:ms|us|µs|ns|s|m|h|%|[KMG]i?B?)?\b",
+]))
+_ERROR = re.compile(r"\b(?:error|err|exception|fatal|panic|traceback|failed|failure|critical|severe)\b", re.IGNORECASE)
+
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Yield the lines of a string without building a list of all of them."""
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start)
+        if end == -1:
+            end = len(text)
+        yield text[start:end]
+        start = end + 1
+
+
+class _Template:
+    __slots__ = ("tokens", "count", "is_error", "examples", "last")
+
+    def __init__(self, tokens: List[str], line: str):
+        self.tokens = tokens
+        self.count = 0
+        self.is_error = bool(_ERROR.search(line))
+        self.examples: List[str] = []
+        self.last = line
+
+    def add(self, line: str) -> None:
+        self.count += 1
+        self.last = line
+        if len(self.examples) < (ERROR_LINES if self.is_error else RARE_LINES):
+            self.examples.append(line)
+
+
+class LogTemplateMiner:
+    """Streaming log template miner with a bounded number of templates."""
+
+    def __init__(self, max_templates: int = MAX_TEMPLATES):
+        self.max_templates = max_templates
+        self._buckets: Dict[Tuple[int, str], List[_Template]] = {}
+        self._templates: List[_Template] = []
+        self._exact: Dict[str, _Template] = {}
+        self.lines = 0
+        self.overflow_lines = 0
+        self.overflow_errors: List[str] = []
+
+    def add(self, line: str) -> None:
+        line = line.rstrip("\r")
+        if not line.strip():
+            return
+        self.lines += 1
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS] + " ...[truncated]"
+        masked = _MASK.sub(WILDCARD, line)
+        template = self._exact.get(masked)
+        if template is not None:
+            # Same masked line as one already merged into this template; merging again changes nothing
+            template.add(line)
+            return
+
+        tokens = masked.split()
+        first = tokens[0] if tokens and WILDCARD not in tokens[0] else WILDCARD
+        bucket = self._buckets.setdefault((len(tokens), first), [])
+
+        template = self._best_match(bucket, tokens)
+        if template is None:
+            if len(self._templates) >= self.max_templates or len(bucket) >= MAX_TEMPLATES_PER_BUCKET:
+                if _ERROR.search(line) and len(self.overflow_errors) < MAX_OVERFLOW_ERROR_LINES:
+                    self.overflow_errors.append(line)
+                else:
+                    self.overflow_lines += 1
+                return
+            template = _Template(tokens, line)
+            bucket.append(template)
+            self._templates.append(template)
+        else:
+            template.tokens = [t if t == u else WILDCARD for t, u in zip(template.tokens, tokens)]
+        template.add(line)
+        if len(self._exact) < EXACT_CACHE_SIZE:
+            self._exact[masked] = template
+
+    @staticmethod
+    def _best_match(bucket: List[_Template], tokens: List[str]) -> Optional[_Template]:
+        # A line must share more than SIMILARITY_THRESHOLD of its tokens with a template to join it
+        best, best_score = None, SIMILARITY_THRESHOLD
+        for template in bucket:
+            same = sum(1 for t, u in zip(template.tokens, tokens) if t == u)
+            score = same / len(tokens)
+            if score > best_score:
+                best, best_score = template, score
+        return best
+
+    @property
+    def template_count(self) -> int:
+        return len(self._templates)
+
+    def feed(self, text: str) -> "LogTemplateMiner":
+        for line in iter_lines(text):
+            self.add(line)
+        return self
+
+    def render(self) -> str:
+        out = []
+        for template in self._templates:
+            limit = ERROR_LINES if template.is_error else RARE_LINES
+            if template.count <= limit:
+                out.extend(template.examples)
+                continue
+            out.append(f"[x{template.count}] {' '.join(template.tokens)}")
+            out.append(f"  first: {template.examples[0]}")
+            out.append(f"  last:  {template.last}")
+        if self.overflow_errors:
+            out.append(f"[{len(self.overflow_errors)} error lines not matching the first {len(self._templates)} templates]")
+            out.extend(self.overflow_errors)
+        if self.overflow_lines:
+            out.append(f"[{self.overflow_lines} lines not matching the first {len(self._templates)} templates omitted]")
+        return "\n".join(out)
+
+
+def reduce_logs_output(output: str) -> str:
+    """Collapse repeated log lines into templates, keeping rare and error lines verbatim."""
+    miner = LogTemplateMiner().feed(output)
+    rendered = miner.render()
+    omitted = f", {miner.overflow_lines} omitted" if miner.overflow_lines else ""
+    return f"[{miner.lines} log lines grouped into {miner.template_count} templates{omitted}]\n{rendered}"
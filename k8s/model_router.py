@@ -0,0 +1,147 @@
+"""
+Routing of conversation turns to a model tier and an output budget.
+
+Most turns are cheap: a greeting, a short answer to a question the agent
+asked, or a look at the output of a few commands. Those go to the small model
+with a small `max_tokens`. Helm chart generation and open-ended
+troubleshooting questions stay on the default (large) model with the full
+output budget.
+
+A small-model response that fails validation (truncated at `max_tokens`, no
+`content`, malformed commands or Helm operations) is discarded and the turn is
+asked again on the large model.
+"""
+
+import os
+import re
+from typing import Any, List, NamedTuple, Optional
+
+from compaction import COMMAND_OUTPUT_MARKER
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "false").lower() == "true"
+DEFAULT_LARGE_MODEL_ID = "us.anthropic.claude-3-5-sonnet-20240620-v1:0"
+DEFAULT_SMALL_MODEL_ID = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
+
+TURN_CHAT = "chat"
+TURN_ANALYSIS = "analysis"
+TURN_HELM = "helm"
+TURN_GENERAL = "general"
+
+# (tier, max_tokens) per kind of turn
+TURN_ROUTES = {
+    TURN_CHAT: ("small", 1024),
+    TURN_ANALYSIS: ("small", 4096),
+    TURN_HELM: ("large", 10000),
+    TURN_GENERAL: ("large", 10000),
+}
+LARGE_MAX_TOKENS = 10000
+
+CHAT_MAX_CHARS = 120
+# Prefix process_message adds to every user message
+_CONTEXT_PREFIX = re.compile(r"^Current Message Context:[^\n]*\n\n")
+_HELM = re.compile(r"\b(?:helm|charts?|docker[- ]?compose|values\.ya?ml)\b", re.IGNORECASE)
+_GREETING = re.compile(r"^(?:hi|hello|hey|thanks|thank you|thx|ok|okay|yes|yep|no|nope|sure|cool|great|"
+                       r"got it|sounds good|bye|good (?:morning|afternoon|evening))\b[\s!.,?]*", re.IGNORECASE)
+_EXECUTED_PREFIX = "I executed the suggested kubectl commands"
+
+
+class Route(NamedTuple):
+    turn: str
+    model_id: str
+    max_tokens: int
+    # Large model to retry on if the response fails validation, None when already on it
+    escalate_to: Optional[str]
+
+
+def large_model_id() -> str:
+    return os.getenv("BEDROCK_MODEL_ID", DEFAULT_LARGE_MODEL_ID)
+
+
+def small_model_id() -> str:
+    return os.getenv("BEDROCK_SMALL_MODEL_ID", DEFAULT_SMALL_MODEL_ID)
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    return ""
+
+
+def _current_turn(messages: List[dict]):
+    """Texts of the user messages after the last assistant message, and that assistant message's text."""
+    start = len(messages)
+    while start > 0 and messages[start - 1].get("role") != "assistant":
+        start -= 1
+    turn = [_text(m.get("content")) for m in messages[start:]]
+    previous = _text(messages[start - 1].get("content")) if start > 0 else ""
+    return turn, previous
+
+
+def _is_command_output(text: str) -> bool:
+    return COMMAND_OUTPUT_MARKER in text or text.startswith(_EXECUTED_PREFIX)
+
+
+def turn_has_command_output(messages: List[dict]) -> bool:
+    """Whether the current turn carries output of commands that were just run."""
+    turn, _ = _current_turn(messages)
+    return any(_is_command_output(text) for text in turn)
+
+
+def classify_turn(messages: List[dict]) -> str:
+    """Classify the current turn: the user messages after the last assistant message."""
+    turn, previous = _current_turn(messages)
+    if not turn:
+        return TURN_GENERAL
+
+    has_output = any(_is_command_output(text) for text in turn)
+    # Only what the user wrote counts for Helm, not what the commands printed
+    written = [text for text in turn if not _is_command_output(text)]
+    if any(_HELM.search(text) for text in written) or (not has_output and _HELM.search(previous)):
+        return TURN_HELM
+    if has_output:
+        return TURN_ANALYSIS
+    # The user's own message is the last one of the turn (anything after it, like rejected commands, is not chat)
+    if _CONTEXT_PREFIX.match(turn[-1]):
+        message = _CONTEXT_PREFIX.sub("", turn[-1]).strip()
+        if len(message) <= CHAT_MAX_CHARS and (_GREETING.fullmatch(message) or previous.rstrip().endswith("?")):
+            return TURN_CHAT
+    return TURN_GENERAL
+
+
+def route_turn(messages: List[dict]) -> Route:
+    """Pick the model and max_tokens for the current turn."""
+    if not MODEL_ROUTING:
+        return Route(TURN_GENERAL, large_model_id(), LARGE_MAX_TOKENS, None)
+    turn = classify_turn(messages)
+    tier, max_tokens = TURN_ROUTES[turn]
+    if tier == "small":
+        return Route(turn, small_model_id(), max_tokens, large_model_id())
+    return Route(turn, large_model_id(), max_tokens, None)
+
+
+def validate_response(llm_response: Any, stop_reason: Optional[str]) -> Optional[str]:
+    """Return why a tool response is unusable, or None if it is fine."""
+    if stop_reason == "max_tokens":
+        return "response was cut off at max_tokens"
+    if not isinstance(llm_response, dict):
+        return "response is not a tool call"
+    content = llm_response.get("content")
+    if not isinstance(content, str) or not content.strip():
+        return "response has no content"
+    cmds = llm_response.get("kubectl_cmds", [])
+    if not isinstance(cmds, list) or not all(isinstance(cmd, str) and cmd.strip().startswith("kubectl") for cmd in cmds):
+        return "kubectl_cmds is not a list of kubectl commands"
+    helm_operations = llm_response.get("helm_operations", [])
+    if not isinstance(helm_operations, list):
+        return "helm_operations is not a list"
+    for operation in helm_operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get("helm_command"), str):
+            return "helm operation without a helm_command"
+        files = operation.get("required_files", [])
+        if not isinstance(files, list) or not all(
+                isinstance(f, dict) and isinstance(f.get("file_path"), str) and isinstance(f.get("file_content"), str)
+                for f in files):
+            return "helm operation with malformed required_files"
+    return None
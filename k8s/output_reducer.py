@@ -0,0 +1,305 @@
+"""
+Structure-aware reduction of kubectl output before it is sent to the LLM.
+
+Large clusters produce command outputs of many thousands of tokens that are
+mostly healthy, identical-looking rows. Like compaction, reduction only shapes
+the copy of the conversation that goes to Bedrock: threads and API responses
+keep the full output, and a request can ask for unreduced outputs.
+
+- Tables (`kubectl get`): abnormal rows are kept verbatim (pods that are not
+  Running/Completed, not fully ready or restarting, Warning events, ...) and
+  healthy rows are grouped into one line per namespace and status.
+- `kubectl describe`: Normal events are grouped by reason and long annotation
+  values are shortened.
+- JSON/YAML (`-o json`, `-o yaml`): `managedFields` and the last-applied
+  configuration annotation are dropped.
+- `kubectl logs`: repeated lines are collapsed into templates (see log_miner).
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from command_runner import kubectl_args
+from compaction import COMMAND_OUTPUT_MARKER
+from log_miner import reduce_logs_output
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_REDUCTION = os.getenv("KUBECTL_OUTPUT_REDUCTION", "true").lower() == "true"
+# Outputs shorter than this are sent as they are
+REDUCE_MIN_CHARS = int(os.getenv("KUBECTL_OUTPUT_REDUCE_MIN_CHARS", "2000"))
+
+# "I ran this kubectl command: <cmd>" / "I ran this kubectl command with your approval: <cmd>"
+_COMMAND_PREFIX = re.compile(r"I ran this kubectl command[^:]*: (.*)$", re.DOTALL)
+
+NOISY_JSON_KEYS = {"managedFields"}
+NOISY_ANNOTATIONS = {"kubectl.kubernetes.io/last-applied-configuration"}
+HEALTHY_STATUSES = {"Running", "Ready", "Active", "Bound", "Available", "Established"}
+FINISHED_STATUSES = {"Completed", "Succeeded"}
+GROUP_EXAMPLES = 3
+ANNOTATION_VALUE_CHARS = 200
+# Reduced outputs are cached by a digest of the message, up to this many characters in total.
+# Every entry is charged its digest too, so entries for unreduced messages are bounded as well.
+REDUCE_CACHE_MAX_CHARS = 8 * 1024 * 1024
+
+# Table headers are upper-case column names separated by two or more spaces
+_HEADER_CELL = re.compile(r"\S+(?: \S+)*")
+_HEADER_NAME = re.compile(r"^[A-Z][A-Z0-9()./_-]*(?: [A-Z][A-Z0-9()./_-]*)*$")
+
+
+def _parse_header(line: str) -> Optional[List[tuple]]:
+    """Return [(column name, start offset)] if a line looks like a kubectl table header."""
+    columns = [(m.group(0), m.start()) for m in _HEADER_CELL.finditer(line)]
+    if len(columns) < 2 or not all(_HEADER_NAME.match(name) for name, _ in columns):
+        return None
+    return columns
+
+
+def _parse_row(line: str, columns: List[tuple]) -> Dict[str, str]:
+    row = {}
+    for i, (name, start) in enumerate(columns):
+        end = columns[i + 1][1] if i + 1 < len(columns) else None
+        row[name] = line[start:end].strip()
+    return row
+
+
+def _row_healthy(row: Dict[str, str]) -> Optional[bool]:
+    """Whether a table row looks healthy, or None if the table has no health signal."""
+    if "TYPE" in row and "REASON" in row:
+        return row["TYPE"] == "Normal"
+    signal = False
+    status = row.get("STATUS")
+    if status is not None:
+        signal = True
+        if status in FINISHED_STATUSES:
+            return True
+        if status not in HEALTHY_STATUSES:
+            return False
+    ready = row.get("READY", "")
+    if "/" in ready:
+        signal = True
+        current, _, desired = ready.partition("/")
+        if current != desired:
+            return False
+    restarts = row.get("RESTARTS")
+    if restarts is not None:
+        signal = True
+        if not restarts.startswith("0"):
+            return False
+    return True if signal else None
+
+
+def _group_label(row: Dict[str, str]) -> str:
+    parts = []
+    if "TYPE" in row and "REASON" in row:
+        parts.append(f"{row['TYPE']} {row['REASON']}")
+    elif "STATUS" in row:
+        parts.append(row["STATUS"])
+    else:
+        parts.append("healthy")
+    if "NAMESPACE" in row:
+        parts.append(f"in {row['NAMESPACE']}")
+    return " ".join(parts)
+
+
+def _reduce_table(lines: List[str]) -> List[str]:
+    """Reduce one table block (header + rows)."""
+    columns = _parse_header(lines[0])
+    if columns is None or len(lines) < 2:
+        return lines
+
+    kept = [lines[0]]
+    groups: Dict[str, List[str]] = {}
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        row = _parse_row(line, columns)
+        healthy = _row_healthy(row)
+        if healthy is None:
+            return lines
+        if healthy:
+            example = row.get("NAME") or row.get("OBJECT") or row.get("MESSAGE", "")
+            groups.setdefault(_group_label(row), []).append(example)
+        else:
+            kept.append(line)
+
+    healthy_rows = sum(len(examples) for examples in groups.values())
+    if healthy_rows <= GROUP_EXAMPLES:
+        return lines
+    kept.append(f"[{healthy_rows} healthy rows grouped:]")
+    for label, examples in groups.items():
+        sample = ", ".join(e for e in examples[:GROUP_EXAMPLES] if e)
+        more = ", ..." if len(examples) > GROUP_EXAMPLES else ""
+        kept.append(f"  {len(examples)} x {label}" + (f" (e.g. {sample}{more})" if sample else ""))
+    return kept
+
+
+def reduce_table_output(output: str) -> str:
+    """Reduce every table in a `kubectl get` output (several kinds are separated by blank lines)."""
+    blocks = output.split("\n\n")
+    return "\n\n".join("\n".join(_reduce_table(block.split("\n"))) if block.strip() else block
+                       for block in blocks)
+
+
+def reduce_describe_output(output: str) -> str:
+    """Group Normal events by reason and shorten long annotation values in `kubectl describe` output."""
+    result = []
+    events: Optional[Dict[str, int]] = None
+    in_annotations = False
+    for line in output.split("\n"):
+        stripped = line.strip()
+        if line.startswith("Events:"):
+            events = {}
+            result.append(line)
+            continue
+        if events is not None:
+            fields = stripped.split(None, 2)
+            if fields and fields[0] == "Normal" and len(fields) > 1:
+                events[fields[1]] = events.get(fields[1], 0) + 1
+                continue
+            if not stripped or not line.startswith(" "):
+                # End of the Events table
+                result.extend(f"  Normal  {reason}  (x{count})" for reason, count in events.items())
+                events = None
+            else:
+                result.append(line)
+                continue
+
+        if line.startswith("Annotations:"):
+            in_annotations = True
+        elif line and not line[0].isspace():
+            in_annotations = False
+        if in_annotations and len(line) > ANNOTATION_VALUE_CHARS:
+            line = line[:ANNOTATION_VALUE_CHARS] + " ...[truncated]"
+        result.append(line)
+
+    if events:
+        result.extend(f"  Normal  {reason}  (x{count})" for reason, count in events.items())
+    return "\n".join(result)
+
+
+def _strip_noise(value):
+    if isinstance(value, dict):
+        stripped = {}
+        for key, item in value.items():
+            if key in NOISY_JSON_KEYS:
+                continue
+            if key == "annotations" and isinstance(item, dict):
+                item = {k: v for k, v in item.items() if k not in NOISY_ANNOTATIONS}
+            stripped[key] = _strip_noise(item)
+        return stripped
+    if isinstance(value, list):
+        return [_strip_noise(item) for item in value]
+    return value
+
+
+def reduce_json_output(output: str) -> str:
+    try:
+        document = json.loads(output)
+    except ValueError:
+        return output
+    return json.dumps(_strip_noise(document), indent=1)
+
+
+def reduce_yaml_output(output: str) -> str:
+    """Drop managedFields and last-applied-configuration blocks from YAML without a YAML parser."""
+    result = []
+    skip_indent = None
+    noisy = tuple(f"{key}:" for key in NOISY_JSON_KEYS) + tuple(f"{key}:" for key in NOISY_ANNOTATIONS)
+    for line in output.split("\n"):
+        indent = len(line) - len(line.lstrip(" "))
+        if skip_indent is not None:
+            # A block continues with deeper lines, or list items at the key's own indent
+            if line.strip() and (indent > skip_indent or (indent == skip_indent and line.lstrip().startswith("- "))):
+                continue
+            skip_indent = None
+        if line.lstrip().startswith(noisy):
+            skip_indent = indent
+            continue
+        result.append(line)
+    return "\n".join(result)
+
+
+def reduce_output(cmd: str, output: str) -> str:
+    """Reduce the output of a kubectl command, returning it unchanged if no reduction applies."""
+    if len(output) < REDUCE_MIN_CHARS:
+        return output
+    args = kubectl_args(cmd)
+    verb = args[0] if args else None
+    head = output.lstrip()
+
+    # Recognize the format from the output itself, so "-ojson", "-o=yaml" etc. need no special cases
+    if verb == "logs":
+        reduced = reduce_logs_output(output)
+    elif head.startswith(("{", "[")):
+        reduced = reduce_json_output(output)
+    elif head.startswith(("apiVersion:", "items:", "kind:")):
+        reduced = reduce_yaml_output(output)
+    elif verb == "describe":
+        reduced = reduce_describe_output(output)
+    elif verb in ("get", "top", "events"):
+        reduced = reduce_table_output(output)
+    else:
+        return output
+
+    if len(reduced) >= len(output):
+        return output
+    return (f"{reduced}\n[Output reduced by the agent from {len(output)} to {len(reduced)} characters; "
+            f"the user can request the full output]")
+
+
+# digest -> reduced content, or None if the content is sent as is
+_reduce_cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+_reduce_cache_chars = 0
+_reduce_cache_lock = threading.Lock()
+
+
+def _reduce_cache_cost(key: str, reduced: Optional[str]) -> int:
+    return len(key) + len(reduced or "")
+
+
+def _reduce_message_content(content: str) -> str:
+    global _reduce_cache_chars
+    key = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    with _reduce_cache_lock:
+        if key in _reduce_cache:
+            _reduce_cache.move_to_end(key)
+            reduced = _reduce_cache[key]
+            return content if reduced is None else reduced
+
+    prefix, output = content.split(COMMAND_OUTPUT_MARKER, 1)
+    match = _COMMAND_PREFIX.search(prefix)
+    reduced_output = reduce_output(match.group(1).strip(), output) if match else output
+    reduced = None if reduced_output is output else prefix + COMMAND_OUTPUT_MARKER + reduced_output
+
+    with _reduce_cache_lock:
+        if key not in _reduce_cache:
+            _reduce_cache[key] = reduced
+            _reduce_cache_chars += _reduce_cache_cost(key, reduced)
+            while _reduce_cache_chars > REDUCE_CACHE_MAX_CHARS:
+                evicted_key, evicted = _reduce_cache.popitem(last=False)
+                _reduce_cache_chars -= _reduce_cache_cost(evicted_key, evicted)
+    return content if reduced is None else reduced
+
+
+def reduce_command_outputs(messages: List[dict]) -> List[dict]:
+    """Return a copy of `messages` with kubectl outputs reduced. The input is never modified."""
+    reduced_messages = []
+    saved = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str) and COMMAND_OUTPUT_MARKER in content and len(content) >= REDUCE_MIN_CHARS:
+            reduced = _reduce_message_content(content)
+            if reduced is not content:
+                saved += len(content) - len(reduced)
+                message = {**message, "content": reduced}
+        reduced_messages.append(message)
+    if saved:
+        logger.info("Reduced kubectl outputs by %d characters", saved)
+    return reduced_messages
@@ -0,0 +1,420 @@
+"""
+Storage for conversation threads.
+
+A thread is its message history, a small config dict (e.g. the kubeconfig
+path) and a lock that serializes requests on the thread. `MemorySessionStore`
+keeps everything in process memory, so every request for a thread has to reach
+the same worker. `SqliteSessionStore` persists threads to a SQLite file that
+the workers of one host can use at once: messages are appended as rows, threads
+are loaded lazily on first use and refreshed when a request takes the thread's
+lock, and the lock is a file lock so it holds across processes. The file must
+be on a local disk; SQLite's write-ahead log and flock are not safe on network
+file systems such as NFS or EFS, so replicas cannot share it.
+
+Other backends (e.g. Redis) implement the `SessionStore` interface and are
+selected in `create_session_store`.
+"""
+
+import os
+import abc
+import json
+import time
+import fcntl
+import sqlite3
+import hashlib
+import logging
+import weakref
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# memory | sqlite
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").lower()
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "/tmp/k8sagent-sessions/sessions.db")
+# Durable threads not updated for this long are deleted (sqlite only)
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+PURGE_INTERVAL_SECONDS = 3600
+
+
+class SessionStore(abc.ABC):
+    """Interface for conversation thread storage."""
+
+    @abc.abstractmethod
+    def exists(self, thread_id: str) -> bool:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def create(self, thread_id: str, config: Dict[str, Any], messages: List[Dict[str, Any]]) -> None:
+        """Create a thread unless it already exists."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def messages(self, thread_id: str) -> List[Dict[str, Any]]:
+        """The thread's history. Treat it as read-only; use append/replace to change it."""
+        raise NotImplementedError
+
+    def append(self, thread_id: str, message: Dict[str, Any]) -> None:
+        self.extend(thread_id, [message])
+
+    @abc.abstractmethod
+    def extend(self, thread_id: str, messages: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def truncate(self, thread_id: str, length: int) -> None:
+        """Drop every message after the first `length`."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def replace(self, thread_id: str, messages: List[Dict[str, Any]]) -> None:
+        """Replace the whole history, e.g. with client-provided past messages."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def config(self, thread_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_config(self, thread_id: str, **values: Any) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def lock(self, thread_id: str):
+        """A lock object (acquire/release, context manager) serializing requests on the thread."""
+        raise NotImplementedError
+
+    def refresh(self, thread_id: str) -> None:
+        """Pick up changes made by other processes. Call while holding the thread's lock."""
+
+    @abc.abstractmethod
+    def unload(self, thread_id: str) -> None:
+        """Release the thread from process memory."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def thread_ids(self) -> List[str]:
+        """Threads currently held in process memory."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def memory_bytes(self) -> int:
+        """Approximate size of the message histories held in process memory."""
+        raise NotImplementedError
+
+
+class ThreadLock:
+    """A `threading.Lock` that can be weakly referenced."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        return self._lock.acquire(blocking)
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class MemorySessionStore(SessionStore):
+    """Threads held in this process only. Unloading a thread deletes it."""
+
+    def __init__(self):
+        self._messages: Dict[str, List[Dict[str, Any]]] = {}
+        self._configs: Dict[str, Dict[str, Any]] = {}
+        # A thread's lock lives as long as a request holds or waits for it, even across
+        # unloading, so a request never gets a new lock while the old one is in use
+        self._locks: "weakref.WeakValueDictionary[str, Any]" = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def exists(self, thread_id: str) -> bool:
+        return thread_id in self._messages
+
+    def create(self, thread_id: str, config: Dict[str, Any], messages: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            if thread_id not in self._messages:
+                self._messages[thread_id] = list(messages)
+                self._configs[thread_id] = dict(config)
+
+    def messages(self, thread_id: str) -> List[Dict[str, Any]]:
+        return self._messages[thread_id]
+
+    def extend(self, thread_id: str, messages: List[Dict[str, Any]]) -> None:
+        self._messages[thread_id].extend(messages)
+
+    def truncate(self, thread_id: str, length: int) -> None:
+        del self._messages[thread_id][length:]
+
+    def replace(self, thread_id: str, messages: List[Dict[str, Any]]) -> None:
+        self._messages[thread_id] = list(messages)
+
+    def config(self, thread_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._configs.setdefault(thread_id, {})
+
+    def update_config(self, thread_id: str, **values: Any) -> None:
+        self.config(thread_id).update(values)
+
+    def _new_lock(self, thread_id: str):
+        return ThreadLock()
+
+    def lock(self, thread_id: str):
+        with self._lock:
+            lock = self._locks.get(thread_id)
+            if lock is None:
+                lock = self._locks[thread_id] = self._new_lock(thread_id)
+            return lock
+
+    def unload(self, thread_id: str) -> None:
+        with self._lock:
+            self._messages.pop(thread_id, None)
+            self._configs.pop(thread_id, None)
+
+    def thread_ids(self) -> List[str]:
+        return list(self._messages)
+
+    def memory_bytes(self) -> int:
+        total = 0
+        for messages in list(self._messages.values()):
+            for message in list(messages):
+                content = message.get("content", "")
+                total += len(content) if isinstance(content, str) else len(json.dumps(content))
+        return total
+
+
+class FileLock:
+    """A thread lock combined with an exclusive flock, so it also excludes other processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking):
+            return False
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            self._thread_lock.release()
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        fd, self._fd = self._fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        self._thread_lock.release()
+
+    def locked(self) -> bool:
+        return self._thread_lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SqliteSessionStore(MemorySessionStore):
+    """Threads persisted in SQLite and cached in process memory.
+
+    Each history has a generation that changes whenever it is replaced or
+    truncated, and messages are rows numbered within their generation.
+    Refreshing a cached thread reads only rows it hasn't seen, or reloads it if
+    another process replaced or truncated the history. Unloading a thread keeps
+    it on disk."""
+
+    def __init__(self, path: str = SESSION_STORE_PATH, ttl: float = SESSION_TTL_SECONDS):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self._lock_dir = os.path.join(os.path.dirname(os.path.abspath(path)), "locks")
+        self._create_private_files()
+        self._generations: Dict[str, int] = {}
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY, config TEXT NOT NULL,
+                generation INTEGER NOT NULL, updated_at REAL NOT NULL)""")
+            db.execute("""CREATE TABLE IF NOT EXISTS messages (
+                thread_id TEXT NOT NULL, generation INTEGER NOT NULL, seq INTEGER NOT NULL,
+                message TEXT NOT NULL, PRIMARY KEY (thread_id, generation, seq))""")
+        logger.info(f"Using SQLite session store at {path}")
+
+    def _create_private_files(self) -> None:
+        """Make the database readable only by this user, since thread configs hold kubeconfigs.
+
+        SQLite creates the -wal and -shm files with the permissions of the
+        database file, so creating that file 0600 before connecting covers them.
+        """
+        for directory in (os.path.dirname(self._lock_dir), self._lock_dir):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            os.chmod(directory, 0o700)
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+        for path in (self.path, self.path + "-wal", self.path + "-shm"):
+            if os.path.exists(path):
+                os.chmod(path, 0o600)
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30)
+        return db
+
+    def _load(self, thread_id: str) -> bool:
+        """Read a thread from disk into memory. Returns False if it doesn't exist."""
+        db = self._db()
+        row = db.execute("SELECT config, generation FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return False
+        config, generation = json.loads(row[0]), row[1]
+        messages = [json.loads(m) for (m,) in db.execute(
+            "SELECT message FROM messages WHERE thread_id = ? AND generation = ? ORDER BY seq",
+            (thread_id, generation))]
+        with self._lock:
+            self._messages[thread_id] = messages
+            self._configs[thread_id] = config
+            self._generations[thread_id] = generation
+        return True
+
+    def exists(self, thread_id: str) -> bool:
+        return thread_id in self._messages or self._load(thread_id)
+
+    def create(self, thread_id: str, config: Dict[str, Any], messages: List[Dict[str, Any]]) -> None:
+        self._purge_expired()
+        with self._db() as db:
+            created = db.execute(
+                "INSERT OR IGNORE INTO threads (thread_id, config, generation, updated_at) VALUES (?, ?, 0, ?)",
+                (thread_id, json.dumps(config), time.time())).rowcount
+            if created:
+                db.executemany(
+                    "INSERT INTO messages (thread_id, generation, seq, message) VALUES (?, 0, ?, ?)",
+                    [(thread_id, seq, json.dumps(m)) for seq, m in enumerate(messages)])
+        self._load(thread_id)
+
+    def messages(self, thread_id: str) -> List[Dict[str, Any]]:
+        if thread_id not in self._messages:
+            self._load(thread_id)
+        return self._messages[thread_id]
+
+    def extend(self, thread_id: str, new_messages: List[Dict[str, Any]]) -> None:
+        messages = self.messages(thread_id)
+        with self._db() as db:
+            db.executemany("INSERT INTO messages (thread_id, generation, seq, message) VALUES (?, ?, ?, ?)",
+                           [(thread_id, self._generations[thread_id], seq, json.dumps(m))
+                            for seq, m in enumerate(new_messages, len(messages))])
+            db.execute("UPDATE threads SET updated_at = ? WHERE thread_id = ?", (time.time(), thread_id))
+        messages.extend(new_messages)
+
+    def truncate(self, thread_id: str, length: int) -> None:
+        messages = self.messages(thread_id)
+        if length >= len(messages):
+            return
+        # Move the kept rows to a new generation so other processes reload instead of appending
+        generation = self._generations[thread_id] + 1
+        with self._db() as db:
+            db.execute("UPDATE messages SET generation = ? WHERE thread_id = ? AND generation = ? AND seq < ?",
+                       (generation, thread_id, self._generations[thread_id], length))
+            db.execute("DELETE FROM messages WHERE thread_id = ? AND generation != ?", (thread_id, generation))
+            db.execute("UPDATE threads SET generation = ?, updated_at = ? WHERE thread_id = ?",
+                       (generation, time.time(), thread_id))
+        with self._lock:
+            del messages[length:]
+            self._generations[thread_id] = generation
+
+    def replace(self, thread_id: str, messages: List[Dict[str, Any]]) -> None:
+        self.messages(thread_id)
+        generation = self._generations[thread_id] + 1
+        with self._db() as db:
+            db.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+            db.executemany("INSERT INTO messages (thread_id, generation, seq, message) VALUES (?, ?, ?, ?)",
+                           [(thread_id, generation, seq, json.dumps(m)) for seq, m in enumerate(messages)])
+            db.execute("UPDATE threads SET generation = ?, updated_at = ? WHERE thread_id = ?",
+                       (generation, time.time(), thread_id))
+        with self._lock:
+            self._messages[thread_id] = list(messages)
+            self._generations[thread_id] = generation
+
+    def config(self, thread_id: str) -> Dict[str, Any]:
+        if thread_id not in self._configs:
+            self._load(thread_id)
+        return super().config(thread_id)
+
+    def update_config(self, thread_id: str, **values: Any) -> None:
+        config = self.config(thread_id)
+        config.update(values)
+        with self._db() as db:
+            db.execute("UPDATE threads SET config = ?, updated_at = ? WHERE thread_id = ?",
+                       (json.dumps(config), time.time(), thread_id))
+
+    def _lock_path(self, thread_id: str) -> str:
+        return os.path.join(self._lock_dir, hashlib.sha256(thread_id.encode()).hexdigest() + ".lock")
+
+    def _new_lock(self, thread_id: str):
+        return FileLock(self._lock_path(thread_id))
+
+    def refresh(self, thread_id: str) -> None:
+        if thread_id not in self._messages:
+            self._load(thread_id)
+            return
+        db = self._db()
+        row = db.execute("SELECT config, generation FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None or row[1] != self._generations.get(thread_id):
+            self._load(thread_id)
+            return
+        messages = self._messages[thread_id]
+        messages.extend(json.loads(m) for (m,) in db.execute(
+            "SELECT message FROM messages WHERE thread_id = ? AND generation = ? AND seq >= ? ORDER BY seq",
+            (thread_id, row[1], len(messages))))
+        with self._lock:
+            self._configs[thread_id] = json.loads(row[0])
+
+    def unload(self, thread_id: str) -> None:
+        super().unload(thread_id)
+        with self._lock:
+            self._generations.pop(thread_id, None)
+        self._purge_expired()
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        if self.ttl <= 0 or now - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        with self._db() as db:
+            expired = [t for (t,) in db.execute("SELECT thread_id FROM threads WHERE updated_at < ?", (now - self.ttl,))]
+            for thread_id in expired:
+                db.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+                db.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+        for thread_id in expired:
+            try:
+                os.remove(self._lock_path(thread_id))
+            except OSError:
+                pass
+        if expired:
+            logger.info(f"Purged {len(expired)} expired threads from the session store")
+
+
+def create_session_store(backend: str = SESSION_STORE) -> SessionStore:
+    """Create the session store selected by SESSION_STORE."""
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SqliteSessionStore()
+    raise ValueError(f"Unsupported SESSION_STORE: {backend}")
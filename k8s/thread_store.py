@@ -0,0 +1,101 @@
+"""
+Bookkeeping for conversation thread lifetimes.
+
+Conversation state is kept in the session store. Kubeconfig files are shared
+through the content-addressed kubeconfig registry and Helm runs in the shared
+workspace cache, so a thread only holds references to them. `ThreadRegistry`
+tracks when each thread was last used and evicts threads once they have
+been idle for too long, or least-recently-used first once the number of live
+threads exceeds its capacity. Eviction itself is delegated to a callback so the owner of the
+thread state decides what to release, and can refuse to evict a thread that is
+in the middle of a request.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+MAX_THREADS = int(os.getenv("THREAD_STORE_MAX_THREADS", "1000"))
+# Threads not used for this long are evicted; 0 disables idle eviction
+IDLE_TTL_SECONDS = float(os.getenv("THREAD_IDLE_TTL_SECONDS", str(6 * 3600)))
+REAP_INTERVAL_SECONDS = 60
+
+
+class ThreadRegistry:
+    """LRU + idle-TTL registry of live conversation threads."""
+
+    def __init__(self, evict: Callable[[str], bool], max_threads: int = MAX_THREADS,
+                 idle_ttl: float = IDLE_TTL_SECONDS, reap_interval: float = REAP_INTERVAL_SECONDS):
+        """
+        Args:
+            evict: Called with a thread id to release its state. Returns False if the
+                thread is busy and must be kept for now.
+            max_threads: Maximum number of live threads before LRU eviction
+            idle_ttl: Seconds after which an unused thread is evicted (0 disables)
+            reap_interval: How often idle threads are looked for
+        """
+        self._evict = evict
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        self._last_used: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        if idle_ttl > 0:
+            threading.Thread(target=self._reap_loop, args=(reap_interval,), daemon=True,
+                             name="thread-registry-reaper").start()
+
+    def touch(self, thread_id: str) -> None:
+        """Record that a thread is in use, evicting the least recently used threads if over capacity."""
+        with self._lock:
+            self._last_used[thread_id] = time.monotonic()
+            self._last_used.move_to_end(thread_id)
+            overflow = len(self._last_used) - self.max_threads
+            candidates = list(self._last_used)[:max(0, overflow)]
+        for victim in candidates:
+            self._try_evict(victim, "capacity")
+
+    def forget(self, thread_id: str) -> None:
+        """Stop tracking a thread whose state was removed elsewhere."""
+        with self._lock:
+            self._last_used.pop(thread_id, None)
+
+    def __len__(self) -> int:
+        return len(self._last_used)
+
+    def evict_idle(self) -> int:
+        """Evict every thread idle for longer than the TTL. Returns the number evicted."""
+        cutoff = time.monotonic() - self.idle_ttl
+        with self._lock:
+            idle = [thread_id for thread_id, last_used in self._last_used.items() if last_used < cutoff]
+        return sum(1 for thread_id in idle if self._try_evict(thread_id, "idle"))
+
+    def _try_evict(self, thread_id: str, reason: str) -> bool:
+        try:
+            evicted = self._evict(thread_id)
+        except Exception as e:
+            logger.error(f"Error evicting thread {thread_id}: {e}")
+            evicted = False
+        with self._lock:
+            if evicted:
+                self._last_used.pop(thread_id, None)
+                self.evictions += 1
+            elif thread_id in self._last_used:
+                # Busy right now; treat it as recently used and try again later
+                self._last_used.move_to_end(thread_id)
+        if evicted:
+            logger.info(f"Evicted thread {thread_id} ({reason})")
+        return evicted
+
+    def _reap_loop(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self.evict_idle()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"live_threads": len(self._last_used), "evictions": self.evictions}
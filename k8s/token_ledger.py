@@ -0,0 +1,158 @@
+"""
+Token accounting per conversation thread and per kubeconfig identity.
+
+Every LLM call's usage (input, output and prompt cache tokens, model time) is
+added to the totals of the thread it was made for and of the kubeconfig the
+thread uses, so heavy threads and tenants can be told apart. A kubeconfig
+identity is the SHA-256 of the kubeconfig's content, the same identity the
+command cache uses; threads without a kubeconfig share the `default` identity
+of the agent's own cluster access. Calls made for a fan-out request, which has
+no thread, are charged in full to every kubeconfig it targets.
+
+Thread totals live in the thread's config in the session store, so they
+survive eviction from memory with SESSION_STORE=sqlite and are shared by all
+workers. Identity totals are kept per worker process and restart every
+TOKEN_BUDGET_WINDOW_SECONDS, so with N workers a kubeconfig can use up to N
+times KUBECONFIG_TOKEN_BUDGET per window.
+
+Budgets count all tokens of a call (input, cache reads and writes, output):
+
+- THREAD_TOKEN_SOFT_BUDGET: past it, the history sent for the thread is
+  compacted to a smaller context budget, which slows its consumption down.
+- THREAD_TOKEN_BUDGET and KUBECONFIG_TOKEN_BUDGET: past them, new messages on
+  the thread (or any thread using the kubeconfig) are refused.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from common.llm import USAGE_TOKEN_KEYS
+from command_cache import DEFAULT_IDENTITY, kubeconfig_identity
+
+logger = logging.getLogger(__name__)
+
+# 0 disables a budget
+THREAD_TOKEN_BUDGET = int(os.getenv("THREAD_TOKEN_BUDGET", "0"))
+THREAD_TOKEN_SOFT_BUDGET = int(os.getenv("THREAD_TOKEN_SOFT_BUDGET", "0"))
+KUBECONFIG_TOKEN_BUDGET = int(os.getenv("KUBECONFIG_TOKEN_BUDGET", "0"))
+TOKEN_BUDGET_WINDOW_SECONDS = float(os.getenv("TOKEN_BUDGET_WINDOW_SECONDS", "86400"))
+# Share of the model's context budget used for threads past their soft budget
+SOFT_BUDGET_CONTEXT_RATIO = 0.5
+
+
+def empty_usage() -> Dict[str, Any]:
+    return dict({key: 0 for key in USAGE_TOKEN_KEYS}, total_tokens=0, llm_calls=0, llm_seconds=0.0, response_cache_hits=0)
+
+
+def add_usage(totals: Dict[str, Any], call_usage: Dict[str, Any]) -> None:
+    """Add the usage of one LLM call, as returned by `BedrockLLM.invoke`, to running totals."""
+    for key in USAGE_TOKEN_KEYS:
+        totals[key] = totals.get(key, 0) + (call_usage.get(key) or 0)
+    totals["total_tokens"] = sum(totals[key] for key in USAGE_TOKEN_KEYS)
+    if call_usage.get("response_cache_hit"):
+        totals["response_cache_hits"] = totals.get("response_cache_hits", 0) + 1
+    else:
+        totals["llm_calls"] = totals.get("llm_calls", 0) + 1
+        totals["llm_seconds"] = round(totals.get("llm_seconds", 0.0) + (call_usage.get("latency_seconds") or 0.0), 3)
+
+
+class TokenLedger:
+    """Token totals and budgets per thread (in the session store) and per kubeconfig identity."""
+
+    def __init__(self, session_store, thread_budget: int = THREAD_TOKEN_BUDGET,
+                 thread_soft_budget: int = THREAD_TOKEN_SOFT_BUDGET,
+                 kubeconfig_budget: int = KUBECONFIG_TOKEN_BUDGET, window: float = TOKEN_BUDGET_WINDOW_SECONDS):
+        self.session_store = session_store
+        self.thread_budget = thread_budget
+        self.thread_soft_budget = thread_soft_budget
+        self.kubeconfig_budget = kubeconfig_budget
+        self.window = window
+        # identity -> (window start, totals)
+        self._identities: Dict[str, tuple] = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def _identity(self, thread_id: Optional[str]) -> str:
+        if not thread_id:
+            return DEFAULT_IDENTITY
+        return kubeconfig_identity(self.session_store.config(thread_id).get("kubeconfig_path"))
+
+    def _identity_totals(self, identity: str) -> Dict[str, Any]:
+        """Totals of an identity's current window. Call with the lock held."""
+        now = time.time()
+        if now >= self._next_sweep:
+            # Drop the expired windows of identities that are no longer used, every tenth of a window
+            self._next_sweep = now + self.window / 10
+            for expired in [key for key, (start, _) in self._identities.items() if now - start >= self.window]:
+                del self._identities[expired]
+        entry = self._identities.get(identity)
+        if entry is None or now - entry[0] >= self.window:
+            entry = self._identities[identity] = (now, empty_usage())
+        return entry[1]
+
+    def record(self, thread_id: Optional[str], call_usage: Dict[str, Any],
+               identities: Optional[Iterable[str]] = None) -> None:
+        """Add an LLM call's usage to its thread and kubeconfig identity. Call while holding the thread's lock.
+
+        `identities` overrides the thread's identity, e.g. with the kubeconfigs a fan-out targets."""
+        if thread_id:
+            totals = dict(empty_usage(), **self.session_store.config(thread_id).get("token_usage", {}))
+            add_usage(totals, call_usage)
+            self.session_store.update_config(thread_id, token_usage=totals)
+        with self._lock:
+            for identity in set(identities or [self._identity(thread_id)]):
+                add_usage(self._identity_totals(identity), call_usage)
+
+    def thread_usage(self, thread_id: str) -> Dict[str, Any]:
+        usage = dict(empty_usage(), **self.session_store.config(thread_id).get("token_usage", {}))
+        usage["budget"] = self.thread_budget or None
+        return usage
+
+    def identity_usage(self, thread_id: Optional[str], identity: Optional[str] = None) -> Dict[str, Any]:
+        identity = identity or self._identity(thread_id)
+        with self._lock:
+            usage = dict(self._identity_totals(identity))
+            window_start = self._identities[identity][0]
+        usage.update(identity=identity, budget=self.kubeconfig_budget or None,
+                     window_resets_in_seconds=round(max(0.0, window_start + self.window - time.time())))
+        return usage
+
+    def usage(self, thread_id: str) -> Dict[str, Any]:
+        """Totals reported with responses: the thread's and its kubeconfig identity's."""
+        return {"thread": self.thread_usage(thread_id), "kubeconfig": self.identity_usage(thread_id)}
+
+    def over_budget(self, thread_id: str) -> Optional[str]:
+        """Why a new message on the thread must be refused, or None if it is within its budgets."""
+        if self.thread_budget and self.thread_usage(thread_id)["total_tokens"] >= self.thread_budget:
+            return f"This conversation has used its budget of {self.thread_budget} tokens. Please start a new conversation."
+        return self.identities_over_budget([self._identity(thread_id)])
+
+    def identities_over_budget(self, identities: Iterable[str]) -> Optional[str]:
+        """Why calls charged to these kubeconfig identities must be refused, or None if all are within budget."""
+        if not self.kubeconfig_budget:
+            return None
+        for identity in identities:
+            usage = self.identity_usage(None, identity)
+            if usage["total_tokens"] >= self.kubeconfig_budget:
+                return (f"This cluster's budget of {self.kubeconfig_budget} tokens is used up. "
+                        f"It resets in {usage['window_resets_in_seconds']} seconds.")
+        return None
+
+    def identities_usage(self, identities: Iterable[str]) -> List[Dict[str, Any]]:
+        return [self.identity_usage(None, identity) for identity in sorted(set(identities))]
+
+    def context_budget(self, thread_id: Optional[str], budget: int) -> int:
+        """Context token budget for a call on the thread: reduced once it is past its soft budget."""
+        if thread_id and self.thread_soft_budget and \
+                self.thread_usage(thread_id)["total_tokens"] >= self.thread_soft_budget:
+            logger.info("Thread %s is past its soft token budget, compacting its history harder", thread_id)
+            return int(budget * SOFT_BUDGET_CONTEXT_RATIO)
+        return budget
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Token totals of each kubeconfig identity's current window in this process."""
+        with self._lock:
+            return {identity: dict(totals) for identity, (_, totals) in self._identities.items()}
@@ -0,0 +1,6 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The agent's modules import each other by their flat names, as when run from k8s/
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, "k8s")]
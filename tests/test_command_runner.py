@@ -0,0 +1,31 @@
+import pytest
+
+from command_runner import is_read_only
+
+
+@pytest.mark.parametrize("cmd", [
+    "kubectl get pods",
+    "kubectl get pods -n default -o wide",
+    "kubectl describe pod api-0",
+    "kubectl logs api-0 --tail=100",
+])
+def test_read_only_commands(cmd):
+    assert is_read_only(cmd)
+
+
+@pytest.mark.parametrize("cmd", [
+    "kubectl get pods\ntouch /tmp/pwned",
+    "kubectl get pods\rtouch /tmp/pwned",
+    "kubectl get pods; touch /tmp/pwned",
+    "kubectl get pods && touch /tmp/pwned",
+    "kubectl get pods | sh",
+    "kubectl get pods > /tmp/out",
+    "kubectl get pods -n $NAMESPACE",
+    "kubectl get pods -n ${NAMESPACE}",
+    "kubectl get pods -n $(touch /tmp/pwned)",
+    "kubectl get pods -n `touch /tmp/pwned`",
+    "kubectl delete pod api-0",
+    "kubectl logs -f api-0",
+])
+def test_not_read_only_commands(cmd):
+    assert not is_read_only(cmd)
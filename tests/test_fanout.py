@@ -0,0 +1,32 @@
+import pytest
+
+from fanout import FanoutError, check_command, scoped_command
+
+
+def test_check_command_strips_read_only_command():
+    assert check_command("  kubectl get pods -o wide ") == "kubectl get pods -o wide"
+
+
+@pytest.mark.parametrize("cmd", [
+    "kubectl get pods\ntouch /tmp/pwned",
+    "kubectl get pods\rtouch /tmp/pwned",
+    "kubectl get pods -n $NAMESPACE",
+    "kubectl get pods $(touch /tmp/pwned)",
+    "kubectl get pods; touch /tmp/pwned",
+    "kubectl get pods 'unterminated",
+    "kubectl delete pod web",
+    "ls /",
+    None,
+])
+def test_check_command_rejects(cmd):
+    with pytest.raises(FanoutError):
+        check_command(cmd)
+
+
+def test_scoped_command_quotes_namespace():
+    assert scoped_command("kubectl get pods", "team a") == "kubectl get pods -n 'team a'"
+
+
+def test_scoped_command_rejects_own_namespace():
+    with pytest.raises(FanoutError):
+        scoped_command("kubectl get pods -n web", "api")